@@ -0,0 +1,253 @@
+"""
+Active Session - ユーザーのアクティブセッションの解決
+users/{uid} ドキュメントの active_session_id をポインタとして使い、
+毎回の status == active クエリをドキュメント1件の読み取り（またはメモリヒット）に置き換える
+セッションの作成はトランザクションで行い、同時アクセスでもユーザーごとに1セッションにする
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from firebase_admin import firestore
+
+from guardian_analysis_cache import get_analysis_cache
+from guardian_state import get_state_store
+from session_aggregate import SessionNotActive, initial_session_aggregate, record_drink
+
+# Firestore client（初回利用時に生成される共有クライアント）
+from clients import db
+
+ACTIVE_SESSION_FIELD = "active_session_id"
+ACTIVE_SESSION_CACHE_TTL_SECONDS = float(os.getenv("ACTIVE_SESSION_CACHE_TTL_SECONDS", "300"))
+ACTIVE_SESSION_CACHE_MAX_ENTRIES = int(os.getenv("ACTIVE_SESSION_CACHE_MAX_ENTRIES", "10000"))
+# セッションがないことを覚えておく秒数（別インスタンスでの開始を早めに拾えるよう短くする）
+ACTIVE_SESSION_MISSING_TTL_SECONDS = float(os.getenv("ACTIVE_SESSION_MISSING_TTL_SECONDS", "5"))
+
+# セッションなしを表すキャッシュ値
+_NO_SESSION = ""
+
+# uid -> (session_id または _NO_SESSION, 期限)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _user_ref(user_id):
+    return db.collection('users').document(user_id)
+
+
+def _sessions_ref(user_id):
+    return _user_ref(user_id).collection('sessions')
+
+
+def new_session_data():
+    """新規セッションドキュメントの初期値"""
+    return {
+        'start_time': firestore.SERVER_TIMESTAMP,
+        'end_time': None,
+        'total_alcohol_g': 0,
+        'status': 'active',
+        'guardian_warnings': [],
+        **initial_session_aggregate()
+    }
+
+
+# ---------- プロセス内キャッシュ ----------
+
+def _cache_get(user_id):
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry is None:
+            return None
+        session_id, expires_at = entry
+        if time.monotonic() > expires_at:
+            del _cache[user_id]
+            return None
+        _cache.move_to_end(user_id)
+        return session_id
+
+
+def _cache_put(user_id, session_id):
+    ttl = ACTIVE_SESSION_CACHE_TTL_SECONDS if session_id else ACTIVE_SESSION_MISSING_TTL_SECONDS
+    with _cache_lock:
+        _cache[user_id] = (session_id or _NO_SESSION, time.monotonic() + ttl)
+        _cache.move_to_end(user_id)
+        while len(_cache) > ACTIVE_SESSION_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def invalidate(user_id):
+    """キャッシュからユーザーのセッションIDを消す"""
+    with _cache_lock:
+        _cache.pop(user_id, None)
+
+
+# ---------- Firestore ----------
+
+@firestore.transactional
+def _resolve_in_transaction(transaction, user_id, create):
+    """
+    ポインタを読み、なければ（旧データの移行を兼ねて）作成する
+
+    Returns:
+        (session_id or None, 新規作成したか)
+    """
+    user_ref = _user_ref(user_id)
+    sessions_ref = _sessions_ref(user_id)
+
+    user_snapshot = user_ref.get(transaction=transaction)
+    user_data = user_snapshot.to_dict() if user_snapshot.exists else {}
+
+    session_id = user_data.get(ACTIVE_SESSION_FIELD)
+    if session_id:
+        return session_id, False
+
+    if ACTIVE_SESSION_FIELD not in user_data:
+        # ポインタ導入前のユーザー: 一度だけ status で探してポインタを書き込む
+        legacy = list(transaction.get(sessions_ref.where('status', '==', 'active').limit(1)))
+        if legacy:
+            transaction.set(user_ref, {ACTIVE_SESSION_FIELD: legacy[0].id}, merge=True)
+            return legacy[0].id, False
+
+    if not create:
+        if ACTIVE_SESSION_FIELD not in user_data:
+            transaction.set(user_ref, {ACTIVE_SESSION_FIELD: None}, merge=True)
+        return None, False
+
+    session_ref = sessions_ref.document()
+    transaction.create(session_ref, new_session_data())
+    transaction.set(user_ref, {ACTIVE_SESSION_FIELD: session_ref.id}, merge=True)
+    return session_ref.id, True
+
+
+def _is_active(user_id, session_id):
+    snapshot = _sessions_ref(user_id).document(session_id).get()
+    return snapshot.exists and (snapshot.to_dict() or {}).get('status') == 'active'
+
+
+def _resolve(user_id, create):
+    session_id = _cache_get(user_id)
+    if session_id == _NO_SESSION and not create:
+        return None, False
+    if session_id:
+        # 書き込み側（create=True）は、別インスタンスで終了されたセッションを返さないよう状態を確かめる
+        if not create or _is_active(user_id, session_id):
+            return session_id, False
+        logging.info(f"Cached session {session_id} for user {user_id} is no longer active")
+        invalidate(user_id)
+
+    # ポインタがあればドキュメント1件の読み取りで済む
+    user_snapshot = _user_ref(user_id).get()
+    session_id = (user_snapshot.to_dict() or {}).get(ACTIVE_SESSION_FIELD) if user_snapshot.exists else None
+
+    created = False
+    if not session_id:
+        session_id, created = _resolve_in_transaction(db.transaction(), user_id, create)
+        if created:
+            logging.info(f"Created session {session_id} for user {user_id}")
+
+    # セッションがない場合も覚えておき、状態のポーリングで毎回トランザクションを実行しない
+    _cache_put(user_id, session_id)
+    return session_id, created
+
+
+def get_active_session_id(user_id):
+    """アクティブなセッションIDを返す（なければ None）"""
+    return _resolve(user_id, create=False)[0]
+
+
+def get_or_create_session(user_id):
+    """アクティブなセッションIDを返し、なければ作成する"""
+    return _resolve(user_id, create=True)[0]
+
+
+def record_drink_in_active_session(user_id, drink_record):
+    """
+    アクティブなセッション（なければ作成）に飲酒記録を追加する
+
+    キャッシュしたセッションが別インスタンスで終了されていた場合は、ポインタを読み直して1回だけ再試行する。
+
+    Returns:
+        (session_id, drink_id, 追加後のセッション統計)
+    """
+    session_id = get_or_create_session(user_id)
+    try:
+        drink_id, stats = record_drink(user_id, session_id, drink_record)
+    except SessionNotActive:
+        logging.info(f"Session {session_id} already ended, resolving the active session again")
+        invalidate(user_id)
+        session_id = get_or_create_session(user_id)
+        drink_id, stats = record_drink(user_id, session_id, drink_record)
+    return session_id, drink_id, stats
+
+
+def open_session(user_id):
+    """
+    セッションを開始する
+
+    Returns:
+        (session_id, 新規作成したか)。既にアクティブなセッションがあればそのIDと False
+    """
+    return _resolve(user_id, create=True)
+
+
+def get_active_session(user_id):
+    """
+    アクティブなセッションのIDとドキュメントを返す
+
+    Returns:
+        (session_id, session_data)。なければ (None, None)
+    """
+    session_id = get_active_session_id(user_id)
+    if not session_id:
+        return None, None
+
+    snapshot = _sessions_ref(user_id).document(session_id).get()
+    session_data = snapshot.to_dict() if snapshot.exists else None
+    if session_data and session_data.get('status') == 'active':
+        return session_id, session_data
+
+    # 他のインスタンスで終了済み（キャッシュが古い）: ポインタを読み直す
+    invalidate(user_id)
+    session_id = get_active_session_id(user_id)
+    if not session_id:
+        return None, None
+    snapshot = _sessions_ref(user_id).document(session_id).get()
+    session_data = snapshot.to_dict() if snapshot.exists else None
+    if session_data and session_data.get('status') == 'active':
+        return session_id, session_data
+    return None, None
+
+
+@firestore.transactional
+def _close_in_transaction(transaction, user_id):
+    user_ref = _user_ref(user_id)
+    user_snapshot = user_ref.get(transaction=transaction)
+    session_id = (user_snapshot.to_dict() or {}).get(ACTIVE_SESSION_FIELD) if user_snapshot.exists else None
+    if not session_id:
+        return None
+
+    transaction.update(_sessions_ref(user_id).document(session_id), {
+        'status': 'ended',
+        'end_time': firestore.SERVER_TIMESTAMP
+    })
+    transaction.set(user_ref, {ACTIVE_SESSION_FIELD: None}, merge=True)
+    return session_id
+
+
+def close_session(user_id):
+    """
+    アクティブなセッションを終了し、ポインタとキャッシュを消す
+
+    Returns:
+        終了したセッションID（なければ None）
+    """
+    # ポインタ導入前のセッションも終了できるよう、先に解決しておく
+    get_active_session_id(user_id)
+    session_id = _close_in_transaction(db.transaction(), user_id)
+    invalidate(user_id)
+    if session_id:
+        get_state_store().forget(user_id, session_id)
+        get_analysis_cache().invalidate(user_id, session_id)
+    return session_id
@@ -1,9 +1,11 @@
 """
 A2A (Agent-to-Agent) Message Broker
 エージェント間の通信を管理
+メッセージの永続化はライトビハインドのバッファ（agents.write_buffer）でまとめてFirestoreのバッチ書き込みにする
 """
 import logging
 import asyncio
+import threading
 from typing import Dict, Any, List, Callable
 from datetime import datetime
 from collections import defaultdict
@@ -12,6 +14,9 @@ import json
 from google.cloud import firestore
 from google.adk.messages import Message
 
+from agents.write_buffer import MessageWriteBuffer
+from clients import get_firestore
+
 
 class A2ABroker:
     """
@@ -20,13 +25,15 @@ class A2ABroker:
     """
     
     def __init__(self, project_id: str = None):
-        self.db = firestore.Client(project=project_id)
+        # プロジェクト指定がなければ他のモジュールと同じ共有クライアントを使う
+        self.db = firestore.Client(project=project_id) if project_id else get_firestore()
         self.agents = {}  # agent_id -> agent instance
         self.subscriptions = defaultdict(list)  # message_type -> [agent_ids]
         self.message_handlers = {}  # agent_id -> handler function
         
-        # メッセージ履歴コレクション
+        # メッセージ履歴コレクション（書き込みはライトビハインド）
         self.messages_collection = self.db.collection('a2a_messages')
+        self.writer = MessageWriteBuffer(self.db, self.messages_collection)
         
         # リアルタイム配信用のキュー
         self.message_queues = defaultdict(asyncio.Queue)  # agent_id -> Queue
@@ -72,9 +79,10 @@ class A2ABroker:
             "processed": False
         }
         
-        # Firestoreに保存
-        doc_ref = self.messages_collection.add(message_dict)
-        message_dict["firestore_id"] = doc_ref[1].id
+        # Firestoreへの保存はバッファに積む（IDはクライアント側で採番）
+        firestore_id = self.messages_collection.document().id
+        await self._persist(firestore_id, "set", dict(message_dict))
+        message_dict["firestore_id"] = firestore_id
         
         logging.info(f"A2A Message published: {message.type} from {message.from_agent} to {message.to_agent}")
         
@@ -97,6 +105,11 @@ class A2ABroker:
         
         return message_dict
     
+    async def _persist(self, doc_id: str, op: str, data: Dict[str, Any]):
+        """書き込みをバッファに積む。満杯ならイベントループ外で空きを待つ"""
+        if not self.writer.offer(doc_id, op, data):
+            await asyncio.to_thread(self.writer.put, doc_id, op, data)
+    
     async def start_message_processor(self, agent_id: str):
         """
         エージェントのメッセージ処理ループを開始
@@ -133,7 +146,7 @@ class A2ABroker:
                 
                 # 処理済みフラグを更新
                 if "firestore_id" in message_dict:
-                    self.messages_collection.document(message_dict["firestore_id"]).update({
+                    await self._persist(message_dict["firestore_id"], "update", {
                         "processed": True,
                         "processed_by": agent_id,
                         "processed_at": datetime.now().isoformat()
@@ -157,6 +170,9 @@ class A2ABroker:
         Returns:
             メッセージのリスト
         """
+        # バッファ中のメッセージも履歴に含める
+        await asyncio.to_thread(self.writer.flush)
+        
         query = self.messages_collection.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(limit)
         
         if agent_id:
@@ -165,7 +181,7 @@ class A2ABroker:
             query = query.where("type", "==", message_type)
             
         messages = []
-        for doc in query.get():
+        for doc in await asyncio.to_thread(query.get):
             message_data = doc.to_dict()
             message_data["id"] = doc.id
             messages.append(message_data)
@@ -186,6 +202,7 @@ class A2ABroker:
                 agent_id: queue.qsize() 
                 for agent_id, queue in self.message_queues.items()
             },
+            "persistence": self.writer.stats(),
             "timestamp": datetime.now().isoformat()
         }
         return stats
@@ -193,13 +210,16 @@ class A2ABroker:
 
 # シングルトンインスタンス
 _broker_instance = None
+_broker_lock = threading.Lock()
 
 
 def get_broker() -> A2ABroker:
     """A2Aブローカーのシングルトンインスタンスを取得"""
     global _broker_instance
     if _broker_instance is None:
-        _broker_instance = A2ABroker()
+        with _broker_lock:
+            if _broker_instance is None:
+                _broker_instance = A2ABroker()
     return _broker_instance
 
 
@@ -207,11 +227,10 @@ async def setup_agents(broker: A2ABroker):
     """
     全エージェントをブローカーに登録
     """
-    from agents.bartender_adk import create_bartender_service
-    from agents.guardian_adk import create_guardian_service
+    from agents.registry import get_bartender_service, get_guardian_service
     
     # Bartenderエージェント
-    bartender = create_bartender_service()
+    bartender = get_bartender_service()
     broker.register_agent(
         agent_id="bartender",
         agent_instance=bartender,
@@ -220,7 +239,7 @@ async def setup_agents(broker: A2ABroker):
     )
     
     # Guardianエージェント
-    guardian = create_guardian_service()
+    guardian = get_guardian_service()
     broker.register_agent(
         agent_id="guardian",
         agent_instance=guardian,
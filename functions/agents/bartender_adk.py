@@ -1,6 +1,7 @@
 """
 Bartender Agent - Google ADK実装
 """
+import asyncio
 import logging
 from typing import Dict, Any, List
 from datetime import datetime
@@ -13,6 +14,9 @@ from google.adk.messages import Message
 import vertexai
 from vertexai.generative_models import GenerativeModel
 
+from active_session import get_active_session_id
+from agents.conversation_memory import get_conversation_memory
+
 # カスタムツールの定義
 async def check_guardian_status(user_id: str) -> Dict[str, Any]:
     """Guardianエージェントの状態を確認"""
@@ -150,7 +154,8 @@ class BartenderService:
     
     def __init__(self):
         self.agent = create_bartender_agent()
-        self.conversation_history = []
+        # 履歴はユーザーごとのリングバッファ（ターン数・トークン数の上限つき）
+        self.memory = get_conversation_memory()
         
     async def chat(self, user_message: str, user_id: str = "demo_user") -> Dict[str, Any]:
         """ユーザーとチャット"""
@@ -167,21 +172,22 @@ class BartenderService:
             }
         )
         
-        # エージェントに問い合わせ
+        # エージェントに問い合わせ（履歴はメモリから読む）
+        # セッションの解決と履歴の読み込みは同期のFirestore呼び出しなのでスレッドで実行
+        session_id = await asyncio.to_thread(get_active_session_id, user_id)
+        # 要約 + 直近のターン（トークン予算内）でプロンプトの大きさを一定に保つ
+        memory_context = await asyncio.to_thread(self.memory.prompt_context, user_id, session_id)
         response = await self.agent.chat(
             message=user_message,
             context={
                 "user_id": user_id,
-                "history": self.conversation_history[-5:] if self.conversation_history else []
+                "summary": memory_context["summary"],
+                "history": memory_context["history"]
             }
         )
         
-        # 会話履歴に追加
-        self.conversation_history.append({
-            "user": user_message,
-            "agent": response.text,
-            "timestamp": datetime.now().isoformat()
-        })
+        # 会話履歴に追加（Firestoreへはライトビハインドで保存）
+        self.memory.append(user_id, session_id, user_message, response.text)
         
         # 飲み物の提案を検出
         if any(word in user_message or word in response.text for word in ["飲み", "ビール", "ワイン", "お酒"]):
@@ -1,6 +1,7 @@
 """
 Bartender Agent - ADKベースの実装
 """
+import asyncio
 import logging
 from typing import Dict, Any, List, Optional
 from datetime import datetime
@@ -17,12 +18,16 @@ except ImportError:
     
 from vertexai.generative_models import GenerativeModel
 
+from agents.conversation_memory import get_conversation_memory
+from clients import init_vertexai
+
 
 class BartenderAgent:
     """ADKスタイルのBartenderエージェント"""
     
     def __init__(self, model_name: str = "gemini-2.0-flash"):
         self.agent_id = "bartender"
+        init_vertexai()
         self.model = GenerativeModel(model_name)
         
         # エージェントの能力定義
@@ -40,12 +45,12 @@ class BartenderAgent:
             "mood.update": self._handle_mood_update
         }
         
-        # 内部状態
+        # 内部状態（会話履歴はユーザーごとの上限つきバッファで管理）
         self.context = {
             "guardian_warnings": [],
-            "current_mood": "neutral",
-            "conversation_history": []
+            "current_mood": "neutral"
         }
+        self.memory = get_conversation_memory()
         
     async def process_chat(self, user_message: str, session_context: Dict) -> Dict[str, Any]:
         """ユーザーとのチャットを処理"""
@@ -62,11 +67,14 @@ class BartenderAgent:
             }
         })
         
-        # プロンプトを構築
-        prompt = self._build_prompt(user_message)
+        # プロンプトを構築（履歴はメモリから読む）
+        user_id = session_context.get("user_id", "demo_user")
+        session_id = session_context.get("session_id")
+        memory_context = await asyncio.to_thread(self.memory.prompt_context, user_id, session_id)
+        prompt = self._build_prompt(user_message, memory_context)
         
         # Geminiで応答生成
-        response = self.model.generate_content(prompt)
+        response = await self.model.generate_content_async(prompt)
         bartender_response = response.text.strip()
         
         # 飲み物の提案を検出
@@ -96,11 +104,7 @@ class BartenderAgent:
             self.context["current_mood"] = detected_mood
         
         # 会話履歴に追加
-        self.context["conversation_history"].append({
-            "user": user_message,
-            "agent": bartender_response,
-            "timestamp": datetime.now().isoformat()
-        })
+        self.memory.append(user_id, session_id, user_message, bartender_response)
         
         return {
             "message": bartender_response,
@@ -109,7 +113,7 @@ class BartenderAgent:
             "a2a_messages_sent": 2 if self._detect_drink_suggestion(user_message, bartender_response) else 1
         }
     
-    def _build_prompt(self, user_message: str) -> str:
+    def _build_prompt(self, user_message: str, memory_context: Dict[str, Any]) -> str:
         """コンテキストを含むプロンプトを構築"""
         
         # 基本的な役割設定
@@ -135,10 +139,12 @@ class BartenderAgent:
         days = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
         prompt += f"\n# 現在の状況\n- 時刻: {now.strftime('%H:%M')}\n- 曜日: {days[now.weekday()]}\n"
         
-        # 会話履歴（直近3つ）
-        if self.context["conversation_history"]:
+        # これまでの会話の要約と直近の会話（トークン予算内）
+        if memory_context["summary"]:
+            prompt += f"\n# これまでの会話の要約\n{memory_context['summary']}\n"
+        if memory_context["history"]:
             prompt += "\n# 直近の会話\n"
-            for conv in self.context["conversation_history"][-3:]:
+            for conv in memory_context["history"]:
                 prompt += f"ユーザー: {conv['user']}\nBartender: {conv['agent']}\n"
         
         prompt += f"\nユーザー: {user_message}\nBartender:"
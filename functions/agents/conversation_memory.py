@@ -0,0 +1,352 @@
+"""
+Conversation Memory - Bartenderの会話履歴
+ユーザーごとのリングバッファ（ターン数・トークン数の上限つき）をメモリに持ち、
+セッションの conversations サブコレクションへはライトビハインドで保存する
+読み取りはメモリから行い、インスタンスが温まっていればチャット1回あたりのFirestore読み取りは0になる
+バッファから押し出されたターンはN件ごとにバックグラウンドで要約に畳み込み、セッションドキュメントに保存する
+プロンプトは「要約 + 直近のターン」をトークン予算内に収めて組み立てるため、長いセッションでも一定の大きさになる
+"""
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from firebase_admin import firestore
+
+from agents.write_buffer import MessageWriteBuffer
+from clients import get_firestore, get_generative_model
+
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "6"))
+CONVERSATION_MAX_TOKENS = int(os.getenv("CONVERSATION_MAX_TOKENS", "1200"))
+CONVERSATION_MAX_USERS = int(os.getenv("CONVERSATION_MAX_USERS", "5000"))
+# 押し出されたターンがこの件数たまったら要約を更新する
+CONVERSATION_SUMMARY_EVERY = int(os.getenv("CONVERSATION_SUMMARY_EVERY", "4"))
+CONVERSATION_SUMMARY_MAX_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_MAX_TOKENS", "300"))
+# 要約 + 直近のターンに使えるトークン数
+CONVERSATION_PROMPT_BUDGET_TOKENS = int(os.getenv("CONVERSATION_PROMPT_BUDGET_TOKENS", "1500"))
+CONVERSATION_SUMMARY_WORKERS = 2
+# 要約に失敗し続けた場合に保持する未要約ターンの上限
+CONVERSATION_MAX_UNSUMMARIZED = CONVERSATION_SUMMARY_EVERY * 4
+SUMMARY_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-001")
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（ASCIIは4文字で1、それ以外は1文字で1）"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _turn_tokens(turn: Dict[str, Any]) -> int:
+    return estimate_tokens(turn.get("user", "")) + estimate_tokens(turn.get("agent", ""))
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """概算トークン数が max_tokens に収まるよう末尾を切る"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    used = 0
+    for i, ch in enumerate(text):
+        used += 0.25 if ord(ch) < 128 else 1
+        if used > max_tokens:
+            return text[:i]
+    return text
+
+
+def summarize_with_gemini(summary: str, turns: List[Dict[str, Any]]) -> str:
+    """これまでの要約に古いターンを畳み込んだ新しい要約を返す"""
+    lines = "\n".join(f"ユーザー: {t['user']}\nBartender: {t['agent']}" for t in turns)
+    prompt = f"""以下はAI Bartenderとユーザーの会話の要約と、その続きの会話です。
+続きの内容を取り込んだ新しい要約を、{CONVERSATION_SUMMARY_MAX_TOKENS}文字以内の日本語で書いてください。
+ユーザーの好み・話題・気分・飲んだお酒など、今後の会話に役立つ事実を優先して残してください。
+
+# これまでの要約
+{summary or "（なし）"}
+
+# 続きの会話
+{lines}
+
+# 新しい要約
+"""
+    response = get_generative_model(SUMMARY_MODEL).generate_content(prompt)
+    return response.text.strip()
+
+
+class _UserBuffer:
+    """1ユーザー分のリングバッファ"""
+
+    def __init__(self, session_id: Optional[str], summary: str = ""):
+        self.session_id = session_id
+        self.turns = deque()
+        self.tokens = 0
+        self.summary = summary
+        self.unsummarized = []  # バッファから押し出され、まだ要約に入っていないターン
+        self.summarizing = False
+
+    def append(self, turn: Dict[str, Any], max_turns: int, max_tokens: int):
+        self.turns.append(turn)
+        self.tokens += turn["tokens"]
+        # 最新の1ターンは上限を超えていても残す
+        while len(self.turns) > 1 and (len(self.turns) > max_turns or self.tokens > max_tokens):
+            evicted = self.turns.popleft()
+            self.tokens -= evicted["tokens"]
+            self.unsummarized.append(evicted)
+        if len(self.unsummarized) > CONVERSATION_MAX_UNSUMMARIZED:
+            del self.unsummarized[:len(self.unsummarized) - CONVERSATION_MAX_UNSUMMARIZED]
+
+
+class ConversationMemory:
+    """ユーザーごとの会話履歴（メモリ + ライトビハインド保存）"""
+
+    def __init__(self, max_turns: int = CONVERSATION_MAX_TURNS,
+                 max_tokens: int = CONVERSATION_MAX_TOKENS,
+                 max_users: int = CONVERSATION_MAX_USERS,
+                 summarizer=summarize_with_gemini,
+                 summary_every: int = CONVERSATION_SUMMARY_EVERY,
+                 budget_tokens: int = CONVERSATION_PROMPT_BUDGET_TOKENS):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.max_users = max_users
+        self.summarizer = summarizer
+        self.summary_every = summary_every
+        self.budget_tokens = budget_tokens
+        self._executor = ThreadPoolExecutor(
+            max_workers=CONVERSATION_SUMMARY_WORKERS, thread_name_prefix="conversation-summary"
+        )
+        self.db = get_firestore()
+        # doc_id にフルパスを渡して任意のセッションの conversations に書く
+        self.writer = MessageWriteBuffer(self.db, self.db, name="conversation")
+
+        self._buffers = OrderedDict()  # user_id -> _UserBuffer
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "loads": 0,
+            "appends": 0,
+            "persist_dropped": 0,
+            "summaries": 0,
+            "summary_failures": 0
+        }
+
+    def _session_ref(self, user_id: str, session_id: str):
+        return self.db.collection('users').document(user_id).collection('sessions').document(session_id)
+
+    def _conversations_ref(self, user_id: str, session_id: str):
+        return self._session_ref(user_id, session_id).collection('conversations')
+
+    def _load(self, user_id: str, session_id: str) -> _UserBuffer:
+        """
+        コールドスタート時に要約と直近の会話をFirestoreから1回だけ読み込む
+
+        要約に含まれていない（summary_through より後の）ターンのうち、
+        直近のバッファに入らなかったものは未要約として次の要約に回す
+        """
+        try:
+            snapshot = self._session_ref(user_id, session_id).get()
+            session_data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+        except Exception as e:
+            logging.warning(f"Failed to load conversation summary: {e}")
+            session_data = {}
+        summary = session_data.get("conversation_summary") or ""
+        summary_through = session_data.get("conversation_summary_through")
+
+        buffer = _UserBuffer(session_id, summary)
+        try:
+            query = self._conversations_ref(user_id, session_id)
+            if summary_through is not None:
+                query = query.where("timestamp", ">", summary_through)
+            query = (query.order_by("timestamp", direction=firestore.Query.DESCENDING)
+                     .limit(self.max_turns + CONVERSATION_MAX_UNSUMMARIZED))
+            docs = [doc.to_dict() for doc in query.stream()]
+        except Exception as e:
+            logging.warning(f"Failed to load conversation history: {e}")
+            docs = []
+
+        for data in reversed(docs):
+            turn = {
+                "user": data.get("user_message", ""),
+                "agent": data.get("agent_message", ""),
+                "timestamp": data["timestamp"].isoformat() if hasattr(data.get("timestamp"), "isoformat") else None
+            }
+            if turn["user"] or turn["agent"]:
+                turn["tokens"] = _turn_tokens(turn)
+                buffer.append(turn, self.max_turns, self.max_tokens)
+        if summary and summary_through is None:
+            # summary_through のない要約は、押し出した古いターンを含んでいるものとみなす
+            buffer.unsummarized = []
+        return buffer
+
+    def _get_buffer(self, user_id: str, session_id: Optional[str]) -> _UserBuffer:
+        with self._lock:
+            buffer = self._buffers.get(user_id)
+            # セッションが変わったら前のセッションの会話は使わない
+            if buffer is not None and (session_id is None or buffer.session_id == session_id):
+                self._buffers.move_to_end(user_id)
+                self._counters["memory_hits"] += 1
+                return buffer
+
+        if session_id:
+            buffer = self._load(user_id, session_id)
+            with self._lock:
+                self._counters["loads"] += 1
+        else:
+            buffer = _UserBuffer(None)
+
+        with self._lock:
+            # 読み込み中に別スレッドが追加していればそちらを使う
+            current = self._buffers.get(user_id)
+            if current is not None and current.session_id == session_id:
+                return current
+            self._buffers[user_id] = buffer
+            self._buffers.move_to_end(user_id)
+            while len(self._buffers) > self.max_users:
+                self._buffers.popitem(last=False)
+            return buffer
+
+    def recent(self, user_id: str, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """直近の会話（古い順、上限内）"""
+        buffer = self._get_buffer(user_id, session_id)
+        with self._lock:
+            return [{k: v for k, v in turn.items() if k != "tokens"} for turn in buffer.turns]
+
+    def prompt_context(self, user_id: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        プロンプト用の履歴（要約 + 直近のターン）をトークン予算内で返す
+
+        Returns:
+            {"summary": str, "history": [{"user", "agent", "timestamp"}, ...], "tokens": int}
+        """
+        buffer = self._get_buffer(user_id, session_id)
+        with self._lock:
+            summary = truncate_to_tokens(buffer.summary, CONVERSATION_SUMMARY_MAX_TOKENS)
+            turns = list(buffer.turns)
+
+        used = estimate_tokens(summary)
+        history = []
+        # 新しいターンから予算に収まるだけ入れる
+        for turn in reversed(turns):
+            if history and used + turn["tokens"] > self.budget_tokens:
+                break
+            history.append({k: v for k, v in turn.items() if k != "tokens"})
+            used += turn["tokens"]
+        history.reverse()
+        return {"summary": summary, "history": history, "tokens": used}
+
+    def append(self, user_id: str, session_id: Optional[str], user_message: str,
+               agent_message: str, extra: Optional[Dict[str, Any]] = None):
+        """
+        1ターンを記録する
+
+        Args:
+            extra: Firestoreの記録にだけ含める項目（drink_context など）
+        """
+        # Firestore の記録と同じ時刻を持たせ、要約済みの範囲（summary_through）と比較できるようにする
+        now = datetime.now(timezone.utc)
+        turn = {
+            "user": user_message or "",
+            "agent": agent_message or "",
+            "timestamp": now.isoformat()
+        }
+        turn["tokens"] = _turn_tokens(turn)
+
+        buffer = self._get_buffer(user_id, session_id)
+        with self._lock:
+            buffer.append(turn, self.max_turns, self.max_tokens)
+            self._counters["appends"] += 1
+            schedule = not buffer.summarizing and len(buffer.unsummarized) >= self.summary_every
+            if schedule:
+                buffer.summarizing = True
+        if schedule:
+            self._executor.submit(self._refresh_summary, user_id, buffer)
+
+        if not session_id:
+            return
+        doc_path = f"users/{user_id}/sessions/{session_id}/conversations/{uuid.uuid4().hex}"
+        record = {
+            "timestamp": now,
+            "user_message": turn["user"],
+            "agent_message": turn["agent"],
+            "agent_type": "bartender",
+            **(extra or {})
+        }
+        # 保存できなくてもメモリの履歴で会話は続けられる
+        if not self.writer.offer(doc_path, "set", record):
+            logging.warning(f"Conversation write buffer is full, dropping history write for {user_id}")
+            with self._lock:
+                self._counters["persist_dropped"] += 1
+
+    def _refresh_summary(self, user_id: str, buffer: _UserBuffer):
+        """押し出されたターンを要約に畳み込み、セッションドキュメントに保存する"""
+        with self._lock:
+            summary = buffer.summary
+            turns = list(buffer.unsummarized)
+        try:
+            new_summary = truncate_to_tokens(self.summarizer(summary, turns), CONVERSATION_SUMMARY_MAX_TOKENS)
+        except Exception as e:
+            # 未要約のターンは残し、次の押し出しで再試行する
+            logging.warning(f"Conversation summarization failed: {e}")
+            with self._lock:
+                buffer.summarizing = False
+                self._counters["summary_failures"] += 1
+            return
+
+        with self._lock:
+            buffer.summary = new_summary
+            # 要約中に押し出されたターンは次回に回す
+            done = {id(t) for t in turns}
+            buffer.unsummarized = [t for t in buffer.unsummarized if id(t) not in done]
+            buffer.summarizing = False
+            self._counters["summaries"] += 1
+
+        if buffer.session_id:
+            update = {
+                "conversation_summary": new_summary,
+                "conversation_summary_updated_at": firestore.SERVER_TIMESTAMP
+            }
+            # 要約に含めた最後のターンの時刻（読み込み時にこれより後を未要約として扱う）
+            through = _parse_timestamp(turns[-1].get("timestamp")) if turns else None
+            if through is not None:
+                update["conversation_summary_through"] = through
+            self.writer.offer(f"users/{user_id}/sessions/{buffer.session_id}", "update", update)
+
+    def forget(self, user_id: str):
+        with self._lock:
+            self._buffers.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._counters,
+                "users": len(self._buffers),
+                "persistence": self.writer.stats()
+            }
+
+
+# シングルトンインスタンス
+_memory_instance = None
+_memory_lock = threading.Lock()
+
+
+def get_conversation_memory() -> ConversationMemory:
+    """プロセス共有の会話履歴を取得"""
+    global _memory_instance
+    if _memory_instance is None:
+        with _memory_lock:
+            if _memory_instance is None:
+                _memory_instance = ConversationMemory()
+    return _memory_instance
@@ -1,11 +1,14 @@
 """
 Drinking Coach Agent - 飲酒ペース管理とアドバイスを提供するエージェント
 """
+import asyncio
 import logging
 from typing import Dict, Any, Optional, List
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 import json
-from firebase_admin import firestore
+
+from clients import get_firestore
+from session_aggregate import get_session_stats
 
 # ログ設定
 logging.basicConfig(level=logging.INFO)
@@ -17,7 +20,7 @@ class DrinkingCoachAgent:
     
     def __init__(self):
         self.agent_id = "drinking_coach"
-        self.db = firestore.client()
+        self.db = get_firestore()
         
         # 飲酒ペース基準（1時間あたりの純アルコール量）
         self.PACE_THRESHOLDS = {
@@ -35,26 +38,22 @@ class DrinkingCoachAgent:
             "excessive": 60    # 60g超過：過度
         }
     
-    async def analyze_drinking_session(self, user_id: str, session_id: str) -> Dict[str, Any]:
-        """飲酒セッションを総合的に分析"""
+    async def analyze_drinking_session(self, user_id: str, session_id: str,
+                                       stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """飲酒セッションを総合的に分析（statsを渡すとFirestoreを読まない）"""
         try:
-            # セッションデータ取得
-            session_ref = self.db.collection('users').document(user_id)\
-                .collection('sessions').document(session_id)
-            session_data = session_ref.get().to_dict()
+            # セッション集計を取得（drinksサブコレクションは走査しない）
+            if stats is None:
+                stats = await asyncio.to_thread(get_session_stats, user_id, session_id)
             
-            if not session_data:
+            if not stats:
                 return self._create_error_response("Session not found")
             
-            # 飲酒履歴取得
-            drinks_ref = session_ref.collection('drinks')
-            drinks = [doc.to_dict() for doc in drinks_ref.stream()]
-            
             # 分析実行
             analysis = {
-                "pace_analysis": self._analyze_drinking_pace(session_data, drinks),
-                "total_analysis": self._analyze_total_consumption(session_data),
-                "pattern_analysis": self._analyze_drinking_pattern(drinks),
+                "pace_analysis": self._analyze_drinking_pace(stats),
+                "total_analysis": self._analyze_total_consumption(stats),
+                "pattern_analysis": self._analyze_drinking_pattern(stats),
                 "recommendations": [],
                 "intervention_level": "none"
             }
@@ -64,7 +63,7 @@ class DrinkingCoachAgent:
             analysis["intervention_level"] = self._determine_intervention_level(analysis)
             
             # 特別なイベント検出
-            analysis["special_events"] = self._detect_special_events(drinks, session_data)
+            analysis["special_events"] = self._detect_special_events(stats)
             
             return {
                 "success": True,
@@ -76,30 +75,28 @@ class DrinkingCoachAgent:
             logger.error(f"Error analyzing drinking session: {e}")
             return self._create_error_response(str(e))
     
-    def _analyze_drinking_pace(self, session_data: Dict, drinks: List[Dict]) -> Dict[str, Any]:
+    def assess_pace(self, stats: Dict) -> Dict[str, Any]:
+        """1時間あたりの純アルコール量でペースを評価（Guardianのルール判定からも使う）"""
+        return self._analyze_drinking_pace(stats)
+    
+    def _analyze_drinking_pace(self, stats: Dict) -> Dict[str, Any]:
         """飲酒ペースを分析"""
-        if not drinks:
+        if not stats.get('drink_count'):
             return {"status": "no_drinks", "current_pace": 0}
         
         # セッション開始時刻
-        start_time = session_data.get('start_time')
-        if hasattr(start_time, 'seconds'):
-            start_dt = datetime.fromtimestamp(start_time.seconds, tz=timezone.utc)
-        else:
-            start_dt = start_time or datetime.now(timezone.utc)
+        start_dt = self._to_datetime(stats.get('start_time'))
         
         # 経過時間（時間）
         duration_hours = (datetime.now(timezone.utc) - start_dt).total_seconds() / 3600
         duration_hours = max(duration_hours, 0.1)  # 最小0.1時間
         
         # 現在のペース（g/h）
-        total_alcohol = session_data.get('total_alcohol_g', 0)
+        total_alcohol = stats.get('total_alcohol_g', 0)
         current_pace = total_alcohol / duration_hours
         
         # 最近1時間のペース
-        one_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
-        recent_drinks = [d for d in drinks if self._get_drink_time(d) > one_hour_ago]
-        recent_alcohol = sum(d.get('alcohol_g', 0) for d in recent_drinks)
+        recent_alcohol = stats.get('window_summary', {}).get('last_60min', {}).get('alcohol_g', 0)
         
         # ペース評価
         if current_pace <= self.PACE_THRESHOLDS["safe"]:
@@ -123,9 +120,9 @@ class DrinkingCoachAgent:
             "message": message
         }
     
-    def _analyze_total_consumption(self, session_data: Dict) -> Dict[str, Any]:
+    def _analyze_total_consumption(self, stats: Dict) -> Dict[str, Any]:
         """総飲酒量を分析"""
-        total_alcohol = session_data.get('total_alcohol_g', 0)
+        total_alcohol = stats.get('total_alcohol_g', 0)
         
         if total_alcohol <= self.TOTAL_THRESHOLDS["light"]:
             status = "light"
@@ -150,30 +147,23 @@ class DrinkingCoachAgent:
             "message": message
         }
     
-    def _analyze_drinking_pattern(self, drinks: List[Dict]) -> Dict[str, Any]:
+    def _analyze_drinking_pattern(self, stats: Dict) -> Dict[str, Any]:
         """飲酒パターンを分析"""
-        if not drinks:
+        drink_count = stats.get('drink_count', 0)
+        if not drink_count:
             return {"pattern": "none", "drink_intervals": []}
         
-        # 飲み物の種類をカウント
-        drink_types = {}
-        for drink in drinks:
-            drink_type = drink.get('drink_type', 'unknown')
-            drink_types[drink_type] = drink_types.get(drink_type, 0) + 1
+        # 飲み物の種類ごとの杯数
+        drink_types = stats.get('drink_type_counts') or {}
         
-        # 飲酒間隔を計算
-        intervals = []
-        sorted_drinks = sorted(drinks, key=lambda d: self._get_drink_time(d))
-        
-        for i in range(1, len(sorted_drinks)):
-            prev_time = self._get_drink_time(sorted_drinks[i-1])
-            curr_time = self._get_drink_time(sorted_drinks[i])
-            interval = (curr_time - prev_time).total_seconds() / 60  # 分単位
-            intervals.append(interval)
+        # 平均飲酒間隔 = (最後の一杯 - 最初の一杯) / 間隔の数
+        avg_interval = 0
+        if drink_count >= 2:
+            first_time = self._to_datetime(stats.get('first_drink_at'))
+            last_time = self._to_datetime(stats.get('last_drink_at'))
+            avg_interval = (last_time - first_time).total_seconds() / 60 / (drink_count - 1)  # 分単位
         
         # パターン判定
-        avg_interval = sum(intervals) / len(intervals) if intervals else 0
-        
         if avg_interval < 10:
             pattern = "rapid"
             message = "非常に短い間隔で飲んでいます"
@@ -257,32 +247,28 @@ class DrinkingCoachAgent:
         else:
             return "none"
     
-    def _detect_special_events(self, drinks: List[Dict], session_data: Dict) -> List[Dict]:
+    def _detect_special_events(self, stats: Dict) -> List[Dict]:
         """特別なイベントを検出"""
         events = []
+        drink_count = stats.get('drink_count', 0)
         
         # 初めての飲酒
-        if len(drinks) == 1:
+        if drink_count == 1:
             events.append({
                 "type": "first_drink",
                 "message": "今日の飲み会スタート！楽しんでくださいね"
             })
         
         # 3杯目の節目
-        if len(drinks) == 3:
+        if drink_count == 3:
             events.append({
                 "type": "milestone",
                 "message": "3杯目ですね。水も飲みましょう"
             })
         
         # 長時間飲酒（3時間以上）
-        start_time = session_data.get('start_time')
-        if start_time:
-            if hasattr(start_time, 'seconds'):
-                start_dt = datetime.fromtimestamp(start_time.seconds, tz=timezone.utc)
-            else:
-                start_dt = start_time
-            
+        if stats.get('start_time'):
+            start_dt = self._to_datetime(stats['start_time'])
             duration = (datetime.now(timezone.utc) - start_dt).total_seconds() / 3600
             if duration > 3:
                 events.append({
@@ -292,11 +278,12 @@ class DrinkingCoachAgent:
         
         return events
     
-    def _get_drink_time(self, drink: Dict) -> datetime:
-        """飲酒記録から時刻を取得"""
-        timestamp = drink.get('timestamp')
+    def _to_datetime(self, timestamp: Any) -> datetime:
+        """Firestoreのタイムスタンプ等をUTCのdatetimeに変換"""
         if hasattr(timestamp, 'seconds'):
             return datetime.fromtimestamp(timestamp.seconds, tz=timezone.utc)
+        elif isinstance(timestamp, datetime):
+            return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
         elif isinstance(timestamp, str):
             return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
         else:
@@ -1,312 +1,276 @@
 """
-Guardian Agent - Google ADK実装
+Guardian Agent - 飲酒状況の判定（ルール）とLLMによる助言
 """
+import asyncio
 import logging
-from typing import Dict, Any, List
-from datetime import datetime, timedelta
-import json
+import os
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+from datetime import datetime
 
-from google.adk.agents import Agent
-from google.adk.tools import Tool
-from google.adk.messages import Message
-from firebase_admin import firestore
-import vertexai
-from vertexai.generative_models import GenerativeModel
+from vertexai.generative_models import GenerationConfig, GenerativeModel
 
-# Firestore client
-db = firestore.client()
+from agents.guardian_schema import GUARDIAN_RESPONSE_SCHEMA, GuardianAssessment, parse_guardian_response
+from agents.registry import get_drinking_coach
+from clients import init_vertexai
+from guardian_analysis_cache import get_analysis_cache
+from guardian_state import evaluate_level
+from session_aggregate import get_session_stats
 
-# Guardian用のカスタムツール
-async def calculate_alcohol_intake(drinks: List[Dict]) -> float:
-    """純アルコール量を計算"""
-    total = 0
-    for drink in drinks:
-        # 純アルコール量（g）= 飲酒量(ml) × アルコール度数(%) ÷ 100 × 0.8
-        volume = drink.get('volume_ml', 0)
-        percentage = drink.get('alcohol_percentage', 0)
-        total += volume * (percentage / 100) * 0.8
-    return total
+# hybrid: ルールで即時判定 + LLMは助言文のみ非同期 / llm: 従来のLLM判定
+GUARDIAN_MODE = os.getenv("GUARDIAN_MODE", "hybrid")
+GUARDIAN_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-001")
+GUARDIAN_LLM_NARRATIVE = os.getenv("GUARDIAN_LLM_NARRATIVE", "true").lower() == "true"
+GUARDIAN_NARRATIVE_TIMEOUT_SECONDS = float(os.getenv("GUARDIAN_NARRATIVE_TIMEOUT", "20"))
+GUARDIAN_NARRATIVE_CACHE_SIZE = 512
 
-async def assess_drinking_pace(drinks: List[Dict], time_window_minutes: int = 30) -> str:
-    """飲酒ペースを評価"""
-    if len(drinks) == 0:
-        return "safe"
-    elif len(drinks) == 1:
-        return "moderate"
-    elif len(drinks) >= 2:
-        return "fast"
-    else:
-        return "dangerous"
 
-async def get_session_data(user_id: str, session_id: str) -> Dict:
-    """セッションデータを取得"""
-    try:
-        session_ref = db.collection('users').document(user_id).collection('sessions').document(session_id)
-        session_doc = session_ref.get()
-        
-        if session_doc.exists:
-            return session_doc.to_dict()
-    except Exception as e:
-        logging.error(f"Error getting session data: {e}")
-    
-    return {"total_alcohol_g": 0, "drinks": []}
+class GuardianService:
+    """
+    Guardianエージェントのサービスラッパー
 
-async def generate_health_recommendations(alcohol_g: float, pace: str) -> List[str]:
-    """健康的な推奨事項を生成"""
-    recommendations = []
+    hybridモード（既定）: 警告レベルと拒否権はルールで同期的に判定し、
+    LLMは助言文の生成にだけ非同期で使う（結果は (セッション, 杯数) ごとにキャッシュ）
+    llmモード: LLMのJSON出力（スキーマ検証済み）から判定し、検証に失敗したらルール判定に戻す
+    """
     
-    if alcohol_g > 30:
-        recommendations.extend([
-            "これ以上の飲酒は控えてください",
-            "水を500ml以上飲んでください",
-            "タクシーでの帰宅をお勧めします"
-        ])
-    elif alcohol_g > 20:
-        recommendations.extend([
-            "そろそろペースを落としましょう",
-            "水分補給を忘れずに",
-            "おつまみを食べながら飲みましょう"
-        ])
+    # 推奨値
+    DAILY_LIMIT_G = 20  # 純アルコール20g
+    PACE_LIMIT_30MIN = 1  # 30分に1杯
     
-    if pace in ["fast", "dangerous"]:
-        recommendations.append("飲むペースが速すぎます。ゆっくり楽しみましょう")
+    # ルールの判定キー -> ADK互換の警告レベル
+    SEVERITY_LEVELS = {
+        "safe": {"severity": "safe", "color": "green", "message": "適正なペースです"},
+        "caution": {"severity": "caution", "color": "yellow", "message": "ペースに注意してください"},
+        "warning": {"severity": "warning", "color": "orange", "message": "飲み過ぎです。水分補給をしてください"},
+        "danger": {"severity": "danger", "color": "red", "message": "直ちに飲酒を中止してください"}
+    }
+    SEVERITY_ORDER = ["safe", "caution", "warning", "danger"]
+    RULE_TO_SEVERITY = {"ok": "safe", "caution": "caution", "warning": "warning", "stop": "danger"}
+    COLOR_TO_SEVERITY = {"green": "safe", "yellow": "caution", "orange": "warning", "red": "danger"}
+    # DrinkingCoachAgent のペース評価（g/h）による引き上げ
+    PACE_TO_SEVERITY = {"fast": "caution", "dangerous": "warning"}
+    # g/h は開始直後だと1杯でも大きくなるため、経過時間と杯数が揃うまで引き上げに使わない
+    PACE_MIN_HOURS = 0.5
+    PACE_MIN_DRINKS = 2
     
-    if not recommendations:
-        recommendations.append("適度なペースで楽しんでいますね")
+    def __init__(self, mode: str = None):
+        # 判定・助言用のモデル（スキーマ指定のJSON出力）
+        init_vertexai()
+        self.model = GenerativeModel(
+            GUARDIAN_MODEL,
+            generation_config=GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=GUARDIAN_RESPONSE_SCHEMA
+            )
+        )
+        self.monitoring_sessions = {}
+        self.mode = mode or GUARDIAN_MODE
+        
+        self._narratives = OrderedDict()  # (user_id, session_id, drink_count) -> 助言文
+        self._narrative_tasks = {}  # 同上 -> 生成中のTask
     
-    return recommendations
-
-# ADKツール定義
-alcohol_calc_tool = Tool(
-    name="calculate_alcohol_intake",
-    description="Calculate total pure alcohol intake from drinks list",
-    function=calculate_alcohol_intake,
-    parameters={
-        "type": "object",
-        "properties": {
-            "drinks": {
-                "type": "array",
-                "description": "List of drinks with volume_ml and alcohol_percentage"
-            }
-        },
-        "required": ["drinks"]
-    }
-)
-
-pace_assessment_tool = Tool(
-    name="assess_drinking_pace",
-    description="Assess drinking pace based on recent drinks",
-    function=assess_drinking_pace,
-    parameters={
-        "type": "object",
-        "properties": {
-            "drinks": {
-                "type": "array",
-                "description": "List of recent drinks"
-            },
-            "time_window_minutes": {
-                "type": "integer",
-                "description": "Time window to consider (default: 30)"
-            }
-        },
-        "required": ["drinks"]
-    }
-)
-
-session_data_tool = Tool(
-    name="get_session_data",
-    description="Get drinking session data from database",
-    function=get_session_data,
-    parameters={
-        "type": "object",
-        "properties": {
-            "user_id": {"type": "string"},
-            "session_id": {"type": "string"}
-        },
-        "required": ["user_id", "session_id"]
-    }
-)
-
-recommendations_tool = Tool(
-    name="generate_health_recommendations",
-    description="Generate health recommendations based on alcohol intake and pace",
-    function=generate_health_recommendations,
-    parameters={
-        "type": "object",
-        "properties": {
-            "alcohol_g": {
-                "type": "number",
-                "description": "Total alcohol in grams"
-            },
-            "pace": {
-                "type": "string",
-                "enum": ["safe", "moderate", "fast", "dangerous"]
-            }
-        },
-        "required": ["alcohol_g", "pace"]
-    }
-)
-
-
-def create_guardian_agent() -> Agent:
-    """ADKを使用してGuardianエージェントを作成"""
+    async def analyze_drinking_pattern(self, user_id: str, session_id: str,
+                                       stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        飲酒パターンを分析（statsを渡すとFirestoreを読まない）
+        
+        同じセッションバージョン（次の飲酒記録まで）の結果はキャッシュから返す
+        """
+        if stats is None:
+            stats = await asyncio.to_thread(get_session_stats, user_id, session_id) or {}
+        
+        version = stats.get("version")
+        # LLM判定はインスタンス間でも共有し、ルール判定は再計算の方が安いのでプロセス内だけ
+        shared = self.mode == "llm"
+        cache = get_analysis_cache()
+        if version is not None:
+            # 共有キャッシュはFirestoreを読むので、イベントループを止めないようスレッドで実行
+            cached = await asyncio.to_thread(cache.get, user_id, session_id, version, shared=shared)
+            if cached is not None:
+                return {**cached, "cached": True}
+        
+        if self.mode == "llm":
+            result = await self._analyze_with_llm(user_id, session_id, stats)
+        else:
+            result = self._analyze_with_rules(user_id, session_id, stats)
+        
+        # ルールへのフォールバックや助言文の生成待ちは確定した結果ではないので保存しない
+        if (version is not None and result["mode"] != "rules_fallback"
+                and not result.get("narrative_pending")):
+            await asyncio.to_thread(cache.put, user_id, session_id, version, result, stats, shared=shared)
+        return {**result, "cached": False}
     
-    instruction = """あなたは「Guardian AI」として、ユーザーの健康的な飲酒をサポートするエージェントです。
-
-# 役割
-- リアルタイムで飲酒量とペースを監視
-- 健康リスクを評価し、適切な警告を発行
-- Bartenderエージェントと連携して飲み過ぎを防ぐ
-- エビデンスに基づいた健康アドバイスを提供
-
-# 監視基準
-- 1日の適正量: 純アルコール20g以下（ビール500ml、日本酒1合程度）
-- 30分あたりの推奨: 1杯以下
-- 警告レベル:
-  - 緑（適正）: 20g以下、ペース適正
-  - 黄（注意）: 20-30g、またはペースが速い
-  - 橙（警告）: 30-40g、飲み過ぎ
-  - 赤（危険）: 40g以上、直ちに中止すべき
-
-# ツール使用方針
-- 常に最新のセッションデータを取得
-- 純アルコール量を正確に計算
-- ペース評価は直近30分を基準に
-- 状況に応じた具体的な推奨事項を生成
-
-# A2A連携
-- Bartenderからdrink.suggestedを受信したら即座に評価
-- 警告レベルが橙以上の場合、guardian.vetoを発行
-- 全エージェントにsession.statsを定期的に配信
-"""
+    def _analyze_with_rules(self, user_id: str, session_id: str, stats: Dict[str, Any]) -> Dict[str, Any]:
+        """hybridモード: ルールで判定し、助言文はキャッシュかバックグラウンド生成"""
+        result = self.evaluate_rules(stats)
+        
+        # 助言文はキャッシュがあれば使い、なければバックグラウンドで生成する
+        key = (user_id, session_id, stats.get("drink_count", 0))
+        narrative = self._narratives.get(key)
+        if narrative is None:
+            self._schedule_narrative(key, result, stats)
+        
+        return {
+            **result,
+            "analysis": narrative or self._rule_summary(result),
+            # 生成中の場合だけ未確定とする（無効・失敗時はルールの要約で確定）
+            "narrative_pending": key in self._narrative_tasks,
+            "tools_used": [],
+            "timestamp": datetime.now().isoformat()
+        }
     
-    guardian_agent = Agent(
-        name="guardian",
-        model="gemini-2.0-flash",
-        instruction=instruction,
-        description="飲酒の健康リスクを監視し、適切な介入を行うGuardian AI",
-        tools=[
-            alcohol_calc_tool,
-            pace_assessment_tool,
-            session_data_tool,
-            recommendations_tool
-        ],
-        # A2A設定
-        a2a_config={
-            "publishes": [
-                "guardian.veto",
-                "guardian.alert",
-                "session.stats",
-                "health.warning"
-            ],
-            "subscribes": [
-                "drink.added",
-                "drink.suggested",
-                "session.started",
-                "bartender.chat"
-            ]
+    def evaluate_rules(self, stats: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        GuardianAgent / DrinkingCoachAgent の閾値で警告レベルと拒否権を判定（LLMなし）
+        """
+        # 総量・30分ペース（飲酒追加時に計算済みの判定があればそれを使う）
+        precomputed = stats.get("guardian_level")
+        if precomputed:
+            rule_key = precomputed["level"]
+        else:
+            pace_drinks = stats.get("window_summary", {}).get("last_30min", {}).get("drinks", 0)
+            rule_key = evaluate_level(stats.get("total_alcohol_g", 0), pace_drinks)
+        severity = self.RULE_TO_SEVERITY[rule_key]
+        
+        # 1時間あたりの純アルコール量によるペース評価
+        pace = get_drinking_coach().assess_pace(stats)
+        pace_status = pace.get("status")
+        if (pace.get("duration_hours", 0) < self.PACE_MIN_HOURS
+                or stats.get("drink_count", 0) < self.PACE_MIN_DRINKS):
+            # 開始直後は30分あたりの杯数（evaluate_level）だけで判定する
+            pace_status = None
+        pace_severity = self.PACE_TO_SEVERITY.get(pace_status)
+        if pace_severity and self.SEVERITY_ORDER.index(pace_severity) > self.SEVERITY_ORDER.index(severity):
+            severity = pace_severity
+        
+        level = dict(self.SEVERITY_LEVELS[severity])
+        total_alcohol = stats.get("total_alcohol_g", 0)
+        return {
+            "level": level,
+            "veto": severity in ["warning", "danger"],
+            "total_alcohol_g": total_alcohol,
+            "pace": pace,
+            "recommendations": self._rule_recommendations(total_alcohol, pace_status),
+            "mode": "rules"
         }
-    )
     
-    return guardian_agent
-
-
-class GuardianService:
-    """Guardianエージェントのサービスラッパー"""
+    @staticmethod
+    def _rule_recommendations(alcohol_g: float, pace: str) -> List[str]:
+        # generate_health_recommendations と同じ基準（同期版）
+        recommendations = []
+        if alcohol_g > 30:
+            recommendations.extend([
+                "これ以上の飲酒は控えてください",
+                "水を500ml以上飲んでください",
+                "タクシーでの帰宅をお勧めします"
+            ])
+        elif alcohol_g > 20:
+            recommendations.extend([
+                "そろそろペースを落としましょう",
+                "水分補給を忘れずに",
+                "おつまみを食べながら飲みましょう"
+            ])
+        if pace in ["fast", "dangerous"]:
+            recommendations.append("飲むペースが速すぎます。ゆっくり楽しみましょう")
+        if not recommendations:
+            recommendations.append("適度なペースで楽しんでいますね")
+        return recommendations
     
-    # 推奨値
-    DAILY_LIMIT_G = 20  # 純アルコール20g
-    PACE_LIMIT_30MIN = 1  # 30分に1杯
+    @staticmethod
+    def _rule_summary(result: Dict[str, Any]) -> str:
+        return f"{result['level']['message']}（純アルコール {result['total_alcohol_g']:.1f}g）"
     
-    def __init__(self):
-        self.agent = create_guardian_agent()
-        self.monitoring_sessions = {}
-        
-    async def analyze_drinking_pattern(self, user_id: str, session_id: str) -> Dict[str, Any]:
-        """飲酒パターンをADKエージェントで分析"""
-        
-        # エージェントに分析を依頼
-        analysis_request = f"""
-ユーザー {user_id} のセッション {session_id} の飲酒状況を分析してください。
+    def _schedule_narrative(self, key, result: Dict[str, Any], stats: Dict[str, Any]):
+        """LLMによる助言文の生成をイベントループ上で開始（同じキーは1回だけ）"""
+        if not GUARDIAN_LLM_NARRATIVE or key in self._narrative_tasks:
+            return
+        try:
+            task = asyncio.get_running_loop().create_task(self._generate_narrative(key, result, stats))
+        except RuntimeError:
+            return
+        self._narrative_tasks[key] = task
+        task.add_done_callback(lambda _, key=key: self._narrative_tasks.pop(key, None))
+    
+    async def _generate_narrative(self, key, result: Dict[str, Any], stats: Dict[str, Any]):
+        try:
+            assessment = await asyncio.wait_for(
+                self._assess_with_llm(stats, result), GUARDIAN_NARRATIVE_TIMEOUT_SECONDS
+            )
+        except Exception as e:
+            logging.warning(f"Guardian narrative generation failed: {e}")
+            # 同じ杯数では再生成せず、ルールの要約を助言文として使う
+            self._narratives[key] = self._rule_summary(result)
+        else:
+            self._narratives[key] = assessment.advice
+        while len(self._narratives) > GUARDIAN_NARRATIVE_CACHE_SIZE:
+            self._narratives.popitem(last=False)
+    
+    def _assessment_prompt(self, stats: Dict[str, Any], rules: Dict[str, Any]) -> str:
+        window = stats.get("window_summary", {})
+        return f"""
+あなたは「Guardian AI」です。以下のセッション状況から健康リスクを評価し、指定のJSONスキーマで回答してください。
 
-以下の手順で分析を実行:
-1. get_session_dataでセッションデータを取得
-2. calculate_alcohol_intakeで純アルコール量を計算
-3. assess_drinking_paceでペースを評価
-4. generate_health_recommendationsで推奨事項を生成
-5. 総合的な健康リスク評価を提供
+# 監視基準
+- 1日の適正量: 純アルコール20g以下、30分あたり1杯以下
+- level: green（適正）/ yellow（注意: 20-30gまたはペースが速い）/ orange（警告: 30-40g）/ red（危険: 40g以上）
+- pace: safe / moderate / fast / dangerous
+- veto: Bartenderがこれ以上お酒を勧めるべきでない場合は true
+- advice: ユーザーへの短い助言（2文以内）
 
-出力形式:
-- 警告レベル（緑/黄/橙/赤）
-- 純アルコール量
-- ペース評価
-- 推奨事項リスト
-- Bartenderへの拒否権発動の必要性
+# セッション状況
+- 杯数: {stats.get('drink_count', 0)}杯
+- 純アルコール量: {stats.get('total_alcohol_g', 0):.1f}g
+- 直近30分: {window.get('last_30min', {}).get('drinks', 0)}杯 / 直近60分: {window.get('last_60min', {}).get('drinks', 0)}杯
+- 1時間あたりのペース: {rules['pace'].get('current_pace', 0)}g/時
 """
+    
+    async def _assess_with_llm(self, stats: Dict[str, Any], rules: Dict[str, Any]) -> GuardianAssessment:
+        """スキーマ指定のJSON出力でLLMに評価させる"""
+        response = await self.model.generate_content_async(self._assessment_prompt(stats, rules))
+        return parse_guardian_response(response.text)
+    
+    async def _analyze_with_llm(self, user_id: str, session_id: str,
+                                stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """飲酒パターンをLLMの構造化出力で分析（検証に失敗したらルール判定に戻す）"""
+        if stats is None:
+            stats = await asyncio.to_thread(get_session_stats, user_id, session_id) or {}
+        rules = self.evaluate_rules(stats)
         
-        response = await self.agent.chat(
-            message=analysis_request,
-            context={"user_id": user_id, "session_id": session_id}
-        )
-        
-        # レスポンスから構造化データを抽出
-        # TODO: より洗練された解析
-        level = self._extract_warning_level(response.text)
+        try:
+            assessment = await self._assess_with_llm(stats, rules)
+        except Exception as e:
+            logging.warning(f"Guardian LLM assessment rejected, using rules: {e}")
+            return {
+                **rules,
+                "analysis": self._rule_summary(rules),
+                "mode": "rules_fallback",
+                "tools_used": [],
+                "timestamp": datetime.now().isoformat()
+            }
         
-        # 警告レベルに応じてA2Aメッセージを発行
-        if level["severity"] in ["warning", "danger"]:
-            alert_message = Message(
-                type="guardian.alert",
-                from_agent="guardian",
-                to_agent="all",
-                payload={
-                    "user_id": user_id,
-                    "level": level,
-                    "message": response.text
-                }
-            )
-            # TODO: メッセージブローカーに発行
-            
+        level = dict(self.SEVERITY_LEVELS[self.COLOR_TO_SEVERITY[assessment.level]])
         return {
             "level": level,
-            "analysis": response.text,
-            "tools_used": response.tools_used if hasattr(response, 'tools_used') else [],
+            "veto": assessment.veto,
+            "total_alcohol_g": assessment.alcohol_g,
+            "pace": {**rules["pace"], "status": assessment.pace},
+            "recommendations": assessment.recommendations,
+            "analysis": assessment.advice,
+            "assessment": assessment.to_dict(),
+            "mode": "llm",
+            "tools_used": [],
             "timestamp": datetime.now().isoformat()
         }
     
-    def _extract_warning_level(self, analysis_text: str) -> Dict:
-        """分析テキストから警告レベルを抽出"""
-        # 簡易的な実装
-        if "赤" in analysis_text or "危険" in analysis_text:
-            return {
-                "severity": "danger",
-                "color": "red",
-                "message": "直ちに飲酒を中止してください"
-            }
-        elif "橙" in analysis_text or "警告" in analysis_text:
-            return {
-                "severity": "warning",
-                "color": "orange",
-                "message": "飲み過ぎです。水分補給をしてください"
-            }
-        elif "黄" in analysis_text or "注意" in analysis_text:
-            return {
-                "severity": "caution",
-                "color": "yellow",
-                "message": "ペースに注意してください"
-            }
-        else:
-            return {
-                "severity": "safe",
-                "color": "green",
-                "message": "適正なペースです"
-            }
-    
-    async def check_veto(self, user_id: str, session_id: str) -> Dict[str, Any]:
+    async def check_veto(self, user_id: str, session_id: str,
+                         stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Bartenderへの拒否権チェック"""
-        analysis = await self.analyze_drinking_pattern(user_id, session_id)
+        analysis = await self.analyze_drinking_pattern(user_id, session_id, stats)
         
-        if analysis["level"]["severity"] in ["warning", "danger"]:
+        if analysis["veto"]:
+            from agents.a2a_broker import Message
+
             # A2Aメッセージ: Bartenderに拒否権を発動
             veto_message = Message(
                 type="guardian.veto",
@@ -330,8 +294,10 @@ class GuardianService:
             "reason": None
         }
     
-    async def handle_a2a_message(self, message: Message):
+    async def handle_a2a_message(self, message):
         """A2Aメッセージを処理"""
+        from agents.a2a_broker import Message
+
         if message.type == "drink.added":
             # 新しい飲み物が追加されたら即座に分析
             user_id = message.payload["user_id"]
@@ -1,6 +1,7 @@
 """
 Guardian Agent - ADKベースの実装
 """
+import asyncio
 import logging
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
@@ -12,9 +13,10 @@ try:
 except ImportError:
     logging.warning("Google ADK not available, using conceptual implementation")
     
-from firebase_admin import firestore
 from vertexai.generative_models import GenerativeModel
 
+from clients import get_firestore, init_vertexai
+
 
 class GuardianAgent:
     """ADKスタイルのGuardianエージェント"""
@@ -25,8 +27,9 @@ class GuardianAgent:
     
     def __init__(self, model_name: str = "gemini-2.0-flash"):
         self.agent_id = "guardian"
+        init_vertexai()
         self.model = GenerativeModel(model_name)
-        self.db = firestore.client()
+        self.db = get_firestore()
         
         # エージェントの能力定義
         self.capabilities = {
@@ -56,7 +59,7 @@ class GuardianAgent:
         
         # Geminiによる高度な分析
         analysis_prompt = self._build_analysis_prompt(session_data, recent_drinks)
-        response = self.model.generate_content(analysis_prompt)
+        response = await self.model.generate_content_async(analysis_prompt)
         
         # AI分析結果をパース
         ai_analysis = self._parse_ai_response(response.text)
@@ -236,7 +239,7 @@ Bartenderが以下の提案をしています:
 不適切な場合は理由を説明してください。
 """
         
-        response = self.model.generate_content(evaluation_prompt)
+        response = await self.model.generate_content_async(evaluation_prompt)
         logging.info(f"Drink suggestion evaluation: {response.text}")
     
     async def _handle_session_started(self, message: Dict):
@@ -279,7 +282,7 @@ Bartenderが以下の提案をしています:
     async def _get_session_data(self, user_id: str, session_id: str) -> Dict:
         """Firestoreからセッションデータを取得"""
         session_ref = self.db.collection('users').document(user_id).collection('sessions').document(session_id)
-        session_doc = session_ref.get()
+        session_doc = await asyncio.to_thread(session_ref.get)
         
         if session_doc.exists:
             return session_doc.to_dict()
@@ -291,7 +294,7 @@ Bartenderが以下の提案をしています:
         
         # 時間でフィルタリング
         time_threshold = datetime.now() - timedelta(minutes=minutes)
-        recent_drinks = drinks_ref.where('timestamp', '>=', time_threshold).get()
+        recent_drinks = await asyncio.to_thread(drinks_ref.where('timestamp', '>=', time_threshold).get)
         
         return [drink.to_dict() for drink in recent_drinks]
     
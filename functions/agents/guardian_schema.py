@@ -0,0 +1,93 @@
+"""
+Guardian Schema - Guardian LLM分析の構造化出力
+Geminiに response_schema 付きでJSONを出力させ、1パスで検証して型付きの結果にする
+"""
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List
+
+LEVEL_COLORS = ["green", "yellow", "orange", "red"]
+PACE_STATUSES = ["safe", "moderate", "fast", "dangerous"]
+
+# Vertex AI の response_schema（OpenAPIのサブセット）
+GUARDIAN_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "level": {"type": "string", "enum": LEVEL_COLORS},
+        "alcohol_g": {"type": "number"},
+        "pace": {"type": "string", "enum": PACE_STATUSES},
+        "recommendations": {"type": "array", "items": {"type": "string"}},
+        "veto": {"type": "boolean"},
+        "advice": {"type": "string"}
+    },
+    "required": ["level", "alcohol_g", "pace", "recommendations", "veto", "advice"]
+}
+
+
+class GuardianResponseError(ValueError):
+    """LLMの出力がスキーマに合わない"""
+
+
+@dataclass(frozen=True)
+class GuardianAssessment:
+    """Guardian LLM分析の結果"""
+    level: str  # green / yellow / orange / red
+    alcohol_g: float
+    pace: str  # safe / moderate / fast / dangerous
+    veto: bool
+    advice: str
+    recommendations: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _require(data: Dict[str, Any], name: str, types, choices=None):
+    value = data.get(name)
+    # bool は int のサブクラスなので数値としては受け付けない
+    if value is None or not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+        raise GuardianResponseError(f"'{name}' is missing or has the wrong type: {value!r}")
+    if choices is not None and value not in choices:
+        raise GuardianResponseError(f"'{name}' must be one of {choices}: {value!r}")
+    return value
+
+
+def parse_guardian_response(text: str) -> GuardianAssessment:
+    """
+    LLMのJSON出力を検証して GuardianAssessment にする
+
+    Raises:
+        GuardianResponseError: JSONでない、または必須項目・型・列挙値が合わない場合
+    """
+    if not text:
+        raise GuardianResponseError("Empty response")
+
+    body = text.strip()
+    # response_schema 非対応のモデルがコードブロックで返した場合に備える
+    if body.startswith("```"):
+        body = body.strip("`")
+        body = body[body.index("\n") + 1:] if "\n" in body else body
+
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        raise GuardianResponseError(f"Response is not JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise GuardianResponseError("Response is not a JSON object")
+
+    recommendations = _require(data, "recommendations", (list,))
+    if not all(isinstance(item, str) for item in recommendations):
+        raise GuardianResponseError("'recommendations' must be a list of strings")
+
+    alcohol_g = float(_require(data, "alcohol_g", (int, float)))
+    if alcohol_g < 0:
+        raise GuardianResponseError(f"'alcohol_g' must not be negative: {alcohol_g}")
+
+    return GuardianAssessment(
+        level=_require(data, "level", (str,), LEVEL_COLORS),
+        alcohol_g=alcohol_g,
+        pace=_require(data, "pace", (str,), PACE_STATUSES),
+        veto=_require(data, "veto", (bool,)),
+        advice=_require(data, "advice", (str,)),
+        recommendations=list(recommendations)
+    )
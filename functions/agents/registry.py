@@ -0,0 +1,177 @@
+"""
+Agent Registry - エージェント/サービスのプロセス内シングルトン管理
+ADKのAgent・ツール定義・Firestoreクライアントをリクエストごとに作り直さないよう、
+各サービスを初回利用時に1度だけ生成して共有する
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Optional
+
+
+def _create_bartender_service():
+    from agents.bartender_adk import create_bartender_service
+    return create_bartender_service()
+
+
+def _create_guardian_service():
+    from agents.guardian_adk import create_guardian_service
+    return create_guardian_service()
+
+
+def _create_drinking_coach():
+    from agents.drinking_coach_agent import create_drinking_coach
+    return create_drinking_coach()
+
+
+def _create_rule_guardian():
+    from guardian import GuardianAgent
+    return GuardianAgent()
+
+
+DEFAULT_FACTORIES = {
+    "bartender": _create_bartender_service,
+    "guardian": _create_guardian_service,
+    "drinking_coach": _create_drinking_coach,
+    "rule_guardian": _create_rule_guardian,
+}
+
+
+class AgentRegistry:
+    """名前ごとにサービスを遅延生成して保持するスレッドセーフなレジストリ"""
+
+    def __init__(self, factories: Optional[Dict[str, Callable[[], Any]]] = None):
+        self._factories = dict(factories or {})
+        self._instances = {}  # name -> instance
+        self._locks = {name: threading.Lock() for name in self._factories}
+        self._stats = {name: self._empty_stats() for name in self._factories}
+        self._registry_lock = threading.Lock()
+
+    @staticmethod
+    def _empty_stats() -> Dict[str, Any]:
+        return {
+            "initialized": False,
+            "init_seconds": None,
+            "initialized_at": None,
+            "hits": 0,
+            "last_error": None
+        }
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        """ファクトリーを登録（既存のインスタンスは破棄される）"""
+        with self._registry_lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+            self._instances.pop(name, None)
+            self._stats[name] = self._empty_stats()
+
+    def get(self, name: str) -> Any:
+        """サービスを取得（未生成なら生成する）"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            self._stats[name]["hits"] += 1
+            return instance
+
+        if name not in self._factories:
+            raise KeyError(f"Unknown agent: {name}")
+
+        with self._locks[name]:
+            # 別スレッドが生成済みの場合はそれを使う
+            instance = self._instances.get(name)
+            if instance is None:
+                instance = self._create(name)
+            self._stats[name]["hits"] += 1
+            return instance
+
+    def _create(self, name: str) -> Any:
+        stats = self._stats[name]
+        started = time.perf_counter()
+        try:
+            instance = self._factories[name]()
+        except Exception as e:
+            stats["last_error"] = f"{type(e).__name__}: {e}"
+            logging.error(f"Failed to initialize agent '{name}': {e}")
+            raise
+
+        stats.update({
+            "initialized": True,
+            "init_seconds": round(time.perf_counter() - started, 4),
+            "initialized_at": datetime.now(timezone.utc).isoformat(),
+            "last_error": None
+        })
+        self._instances[name] = instance
+        logging.info(f"Agent '{name}' initialized in {stats['init_seconds']}s")
+        return instance
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> Dict[str, bool]:
+        """
+        コールドスタート時に事前生成する
+
+        Returns:
+            name -> 生成に成功したか
+        """
+        results = {}
+        for name in names or list(self._factories):
+            try:
+                self.get(name)
+                results[name] = True
+            except Exception:
+                results[name] = False
+        return results
+
+    def reset(self, name: Optional[str] = None):
+        """インスタンスを破棄（テスト・設定変更用）"""
+        with self._registry_lock:
+            names = [name] if name else list(self._factories)
+            for n in names:
+                self._instances.pop(n, None)
+                self._stats[n] = self._empty_stats()
+
+    def status(self) -> Dict[str, Any]:
+        """ヘルスチェック/デバッグ用の状態"""
+        return {
+            "agents": {name: dict(stats) for name, stats in self._stats.items()},
+            "healthy": all(stats["last_error"] is None for stats in self._stats.values()),
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+
+
+# シングルトンインスタンス
+_registry_instance = None
+_registry_instance_lock = threading.Lock()
+
+
+def get_registry() -> AgentRegistry:
+    """プロセス共有のレジストリを取得"""
+    global _registry_instance
+    if _registry_instance is None:
+        with _registry_instance_lock:
+            if _registry_instance is None:
+                _registry_instance = AgentRegistry(DEFAULT_FACTORIES)
+    return _registry_instance
+
+
+def get_bartender_service():
+    """共有のBartenderServiceを取得"""
+    return get_registry().get("bartender")
+
+
+def get_guardian_service():
+    """共有のGuardianServiceを取得"""
+    return get_registry().get("guardian")
+
+
+def get_drinking_coach():
+    """共有のDrinkingCoachAgentを取得"""
+    return get_registry().get("drinking_coach")
+
+
+def get_rule_guardian():
+    """共有のルールベースGuardianAgentを取得"""
+    return get_registry().get("rule_guardian")
+
+
+def warm_up(names: Optional[Iterable[str]] = None) -> Dict[str, bool]:
+    """コールドスタート時のウォームアップフック"""
+    return get_registry().warm_up(names)
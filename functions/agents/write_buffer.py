@@ -0,0 +1,247 @@
+"""
+Firestore 書き込みのライトビハインドバッファ
+A2Aメッセージ・会話履歴の永続化で共有する（google.adk に依存しない）
+"""
+import atexit
+import logging
+import os
+import signal
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+# ライトビハインドの設定
+A2A_BATCH_SIZE = min(int(os.getenv("A2A_BATCH_SIZE", "100")), 500)  # Firestoreのバッチ上限は500件
+A2A_FLUSH_INTERVAL_SECONDS = float(os.getenv("A2A_FLUSH_INTERVAL", "1.0"))
+A2A_MAX_PENDING = int(os.getenv("A2A_MAX_PENDING", "1000"))
+# バッファが空かない場合に呼び出し側で書き込むまでの待機秒数
+A2A_ENQUEUE_TIMEOUT_SECONDS = 5.0
+A2A_MAX_WRITE_ATTEMPTS = 3
+
+
+# SIGTERM でフラッシュするバッファ（Cloud Run はインスタンス停止前に SIGTERM を送る）
+_open_buffers = []
+_signal_lock = threading.RLock()  # シグナルハンドラから再入されても詰まらない
+_previous_sigterm_handler = None
+_sigterm_installed = False
+
+
+def _close_all_buffers():
+    with _signal_lock:
+        buffers = list(_open_buffers)
+    for buffer in buffers:
+        try:
+            buffer.close()
+        except Exception as e:
+            logging.error(f"{buffer.name} write-behind close failed: {e}")
+
+
+def _on_sigterm(signum, frame):
+    """残りを書き込んでから、元のハンドラに処理を渡す"""
+    _close_all_buffers()
+    previous = _previous_sigterm_handler
+    if callable(previous):
+        previous(signum, frame)
+    elif previous in (signal.SIG_DFL, None):
+        # 既定の動作（プロセス終了）に戻して同じシグナルを送り直す
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
+def _install_sigterm_handler():
+    """SIGTERM ハンドラを一度だけ設定する（メインスレッドでしか設定できない）"""
+    global _previous_sigterm_handler, _sigterm_installed
+    with _signal_lock:
+        if _sigterm_installed or threading.current_thread() is not threading.main_thread():
+            return
+        try:
+            _previous_sigterm_handler = signal.signal(signal.SIGTERM, _on_sigterm)
+            _sigterm_installed = True
+        except (ValueError, OSError) as e:
+            logging.warning(f"Could not install SIGTERM handler for write-behind buffers: {e}")
+
+
+def _register_buffer(buffer):
+    """atexit に加えて SIGTERM でもフラッシュされるようにする"""
+    with _signal_lock:
+        _open_buffers.append(buffer)
+    _install_sigterm_handler()
+
+
+# バッファはリクエスト処理中（ワーカースレッド）に作られることが多いので、import 時にも設定しておく
+_install_sigterm_handler()
+atexit.register(_close_all_buffers)
+
+def _merge_write(older: Dict[str, Any], newer: Dict[str, Any]) -> Dict[str, Any]:
+    """同じドキュメントへの書き込みを1件にまとめる（set後のupdateはsetに合流）"""
+    if newer["op"] == "set":
+        return newer
+    return {
+        "op": older["op"],
+        "data": {**older["data"], **newer["data"]},
+        "attempts": older["attempts"]
+    }
+
+
+class MessageWriteBuffer:
+    """
+    Firestore への書き込みをまとめるライトビハインドバッファ（A2Aメッセージ・会話履歴）
+
+    - ドキュメントIDごとにset/updateを合流させ、件数または間隔でバッチ書き込みする
+    - 書き込みはバックグラウンドスレッドで行い、イベントループを塞がない
+    - 上限件数に達したら offer() は False を返し、put() は空きを待つ（バックプレッシャー）
+    - プロセス終了時（atexit・SIGTERM）に残りをフラッシュする
+    """
+
+    def __init__(self, db, collection, batch_size: int = A2A_BATCH_SIZE,
+                 flush_interval: float = A2A_FLUSH_INTERVAL_SECONDS,
+                 max_pending: int = A2A_MAX_PENDING, name: str = "a2a"):
+        self.db = db
+        # collection に Client を渡すと doc_id をドキュメントのフルパスとして扱える
+        self.collection = collection
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending = OrderedDict()  # doc_id -> {"op", "data", "attempts"}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # フラッシュは同時に1つだけ（書き込み順を保つ）
+        self._thread = None
+        self._closed = False
+        self._counters = {
+            "enqueued": 0,
+            "coalesced": 0,
+            "batches": 0,
+            "written": 0,
+            "failed_batches": 0,
+            "dropped": 0,
+            "backpressure_waits": 0
+        }
+        _register_buffer(self)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+            self._thread.start()
+
+    def _enqueue_locked(self, doc_id: str, op: str, data: Dict[str, Any]):
+        write = {"op": op, "data": data, "attempts": 0}
+        if doc_id in self._pending:
+            self._pending[doc_id] = _merge_write(self._pending[doc_id], write)
+            self._counters["coalesced"] += 1
+        else:
+            self._pending[doc_id] = write
+        self._counters["enqueued"] += 1
+        if len(self._pending) >= self.batch_size:
+            self._cond.notify_all()
+
+    def offer(self, doc_id: str, op: str, data: Dict[str, Any]) -> bool:
+        """ブロックせずに追加する（満杯ならFalse）"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} write buffer is closed")
+            if len(self._pending) >= self.max_pending and doc_id not in self._pending:
+                return False
+            self._ensure_thread()
+            self._enqueue_locked(doc_id, op, data)
+            return True
+
+    def put(self, doc_id: str, op: str, data: Dict[str, Any], timeout: float = A2A_ENQUEUE_TIMEOUT_SECONDS):
+        """空きを待って追加する。timeout 内に空かなければ呼び出し側のスレッドでフラッシュする"""
+        deadline = time.monotonic() + timeout
+        while not self.offer(doc_id, op, data):
+            with self._cond:
+                self._counters["backpressure_waits"] += 1
+                self._cond.notify_all()
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(min(remaining, self.flush_interval))
+                    continue
+            self.flush()
+            deadline = time.monotonic() + timeout
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"{self.name} write-behind flush failed: {e}")
+
+    def _take_batch(self):
+        with self._cond:
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                batch.append(self._pending.popitem(last=False))
+            return batch
+
+    def _requeue(self, writes):
+        """失敗したバッチを、後から積まれた書き込みより前に戻す"""
+        with self._cond:
+            for doc_id, write in reversed(writes):
+                write["attempts"] += 1
+                if write["attempts"] >= A2A_MAX_WRITE_ATTEMPTS:
+                    self._counters["dropped"] += 1
+                    logging.error(f"Dropping {self.name} write after {write['attempts']} attempts: {doc_id}")
+                    continue
+                newer = self._pending.pop(doc_id, None)
+                self._pending[doc_id] = _merge_write(write, newer) if newer else write
+                self._pending.move_to_end(doc_id, last=False)
+
+    def flush(self) -> int:
+        """溜まっている書き込みをすべてバッチで書き込む。書き込んだ件数を返す"""
+        written = 0
+        with self._flush_lock:
+            while True:
+                writes = self._take_batch()
+                if not writes:
+                    break
+
+                batch = self.db.batch()
+                for doc_id, write in writes:
+                    ref = self.collection.document(doc_id)
+                    if write["op"] == "set":
+                        batch.set(ref, write["data"])
+                    else:
+                        # 作成側の書き込みが失敗していてもバッチ全体を失敗させないよう merge で書く
+                        batch.set(ref, write["data"], merge=True)
+
+                try:
+                    batch.commit()
+                except Exception as e:
+                    logging.error(f"{self.name} batch write failed ({len(writes)} writes): {e}")
+                    with self._cond:
+                        self._counters["failed_batches"] += 1
+                    self._requeue(writes)
+                    break
+
+                written += len(writes)
+                with self._cond:
+                    self._counters["batches"] += 1
+                    self._counters["written"] += len(writes)
+                    # 空きを待っている put() を起こす
+                    self._cond.notify_all()
+        return written
+
+    def close(self):
+        """バックグラウンドスレッドを止め、残りをフラッシュする"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {**self._counters, "pending": len(self._pending)}
@@ -0,0 +1,200 @@
+"""
+ASGI App - 全エンドポイントを1つの並行アプリとして配信する
+Cloud Functions では1インスタンス1リクエストだが、このアプリは1プロセスで複数のリクエストを同時に処理する。
+ハンドラは Cloud Functions と同じ同期関数を使い、イベントループから上限付きのスレッドプールで実行する
+（Gemini・TTS・Firestore の応答待ちの間も他のリクエストを受け付ける）。SSEの応答はチャンクごとに送る
+
+    uvicorn asgi_app:app --workers 2
+    python asgi_app.py --stub --threads 64 --workers 1
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# 1プロセスで同時に処理するリクエスト数
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "32"))
+# true ならネットワークに出ないインメモリのバックエンドで動かす（ローカル負荷試験用）
+USE_STUB_BACKENDS = os.getenv("USE_STUB_BACKENDS", "false").lower() == "true"
+
+_SENTINEL = object()
+
+
+def _wsgi_environ(scope, body):
+    """ASGIのHTTPスコープからWSGIのenviron を作る"""
+    import io
+
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif key != "CONTENT_LENGTH":
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def create_flask_app():
+    """main_imports の全エンドポイントを /<名前> にマウントしたFlaskアプリ"""
+    from flask import Flask, jsonify, request
+
+    if USE_STUB_BACKENDS:
+        from fake_backends import install_fake_backends
+        install_fake_backends()
+
+    import clients
+    import main_imports
+
+    flask_app = Flask(__name__)
+
+    def mount(name, handler):
+        def view():
+            return flask_app.make_response(handler(request))
+        flask_app.add_url_rule(f"/{name}", name, view, methods=["GET", "POST", "OPTIONS"])
+
+    for name in main_imports.__all__:
+        mount(name, getattr(main_imports, name))
+
+    @flask_app.route("/health")
+    def health():
+        import fake_backends
+        from agents.registry import get_registry
+        return jsonify({
+            "status": "healthy",
+            "service": "alco-guardian-backend",
+            "threads": ASGI_THREADS,
+            "stub_backends": USE_STUB_BACKENDS,
+            "clients": clients.stats()["initialized"],
+            "backends": fake_backends.stats(),
+            "agents": get_registry().status()
+        })
+
+    return flask_app
+
+
+class AsgiApp:
+    """同期ハンドラをスレッドプールで実行するASGIアプリ"""
+
+    def __init__(self, threads=ASGI_THREADS):
+        self.threads = threads
+        self._executor = None
+        self._flask_app = None
+
+    def _startup(self):
+        if self._flask_app is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="asgi-handler")
+            self._flask_app = create_flask_app()
+            logging.info(f"ASGI app ready ({self.threads} handler threads)")
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    self._startup()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self._shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        # lifespan を送らないサーバー向け
+        self._startup()
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        environ = _wsgi_environ(scope, b"".join(chunks))
+
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+
+        body = await loop.run_in_executor(self._executor, self._flask_app.wsgi_app, environ, start_response)
+        body_iter = iter(body)
+        try:
+            await send({"type": "http.response.start", "status": started["status"], "headers": started["headers"]})
+            while True:
+                # SSEのジェネレータは生成に時間がかかるため、1チャンクずつスレッドで取り出す
+                chunk = await loop.run_in_executor(self._executor, next, body_iter, _SENTINEL)
+                if chunk is _SENTINEL:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if hasattr(body, "close"):
+                await loop.run_in_executor(self._executor, body.close)
+
+
+app = AsgiApp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve all endpoints as one ASGI app")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=1, help="プロセス数")
+    parser.add_argument("--threads", type=int, default=ASGI_THREADS, help="プロセスごとの同時処理数")
+    parser.add_argument("--stub", action="store_true", help="インメモリのバックエンド（fake_backends）で動かす")
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError:
+        logging.error("uvicorn is required to serve the ASGI app: pip install uvicorn")
+        sys.exit(1)
+
+    # ワーカープロセスは asgi_app を import し直すので設定は環境変数で渡す
+    os.environ["ASGI_THREADS"] = str(args.threads)
+    if args.stub:
+        os.environ["USE_STUB_BACKENDS"] = "true"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    uvicorn.run("asgi_app:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Async Runner - プロセス共有のイベントループと同期→非同期ブリッジ
+Cloud Functionsの同期ハンドラからエージェントのコルーチンを実行するために使う
+ループは全リクエストで共有されるため、コルーチン内の同期クライアント呼び出し（Firestore・Gemini）は
+asyncio.to_thread で実行すること（ループ上で直接呼ぶと他のステージが止まり、タイムアウトも効かない）
+"""
+import asyncio
+import logging
+import os
+import threading
+
+# 各ステージ（ブローカー発行・Guardian分析など）のタイムアウト秒数
+STAGE_TIMEOUT_SECONDS = float(os.getenv("AGENT_STAGE_TIMEOUT", "20"))
+
+_loop = None
+_loop_thread = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_event_loop():
+    """バックグラウンドスレッドで動く共有イベントループを取得（プロセスごとに1つ）"""
+    global _loop, _loop_thread, _loop_pid
+
+    # fork後の子プロセスでは親のループを使わない
+    if _loop is not None and _loop_pid == os.getpid() and _loop_thread.is_alive():
+        return _loop
+
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid() or not _loop_thread.is_alive():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=_run_loop, args=(loop,), name="async-runner", daemon=True
+            )
+            thread.start()
+            _loop, _loop_thread, _loop_pid = loop, thread, os.getpid()
+            logging.info("Shared event loop started")
+    return _loop
+
+
+def run_async(coro, timeout=None):
+    """
+    コルーチンを共有イベントループで実行し、結果を同期的に返す
+
+    Args:
+        coro: 実行するコルーチン
+        timeout: 待機する最大秒数（Noneなら無制限）
+
+    Raises:
+        TimeoutError: timeout 内に完了しなかった場合（コルーチンはキャンセルされる）
+    """
+    loop = get_event_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_async cannot be called from the shared event loop thread")
+
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+
+async def _run_stage(name, coro, timeout):
+    try:
+        return await asyncio.wait_for(coro, timeout)
+    except asyncio.TimeoutError:
+        logging.warning(f"Stage '{name}' timed out after {timeout}s")
+        return TimeoutError(f"{name} timed out after {timeout}s")
+    except Exception as e:
+        logging.error(f"Stage '{name}' failed: {e}")
+        return e
+
+
+async def gather_stages(stages, timeout=STAGE_TIMEOUT_SECONDS):
+    """独立したステージを並行実行し、ステージ名 -> 結果（失敗時は例外オブジェクト）を返す"""
+    names = list(stages.keys())
+    results = await asyncio.gather(
+        *(_run_stage(name, stages[name], timeout) for name in names)
+    )
+    return dict(zip(names, results))
+
+
+def run_stages(stages, timeout=STAGE_TIMEOUT_SECONDS):
+    """
+    独立したコルーチンを共有イベントループ上で並行実行する
+
+    全体の所要時間は最も遅いステージ（最大 timeout 秒）に収まる。
+
+    Args:
+        stages: ステージ名 -> コルーチン の辞書
+        timeout: ステージごとのタイムアウト秒数
+
+    Returns:
+        ステージ名 -> 結果 の辞書。失敗・タイムアウトしたステージは例外オブジェクトが入る
+    """
+    # 各ステージは gather_stages 内でタイムアウトするため、外側は少し余裕を持たせる
+    return run_async(gather_stages(stages, timeout), timeout + 5)
@@ -0,0 +1,142 @@
+"""
+Auth Cache - Firebase IDトークン検証結果のキャッシュ
+検証済みトークンを exp クレームまでプロセス内LRUに保持し、
+同じトークンの同時リクエストは1回の検証を共有する（シングルフライト）
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from firebase_admin import auth
+
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "4096"))
+# 期限ぎりぎりのトークンを返さないための余裕（秒）
+AUTH_CACHE_EXPIRY_SKEW_SECONDS = 30
+# 認証なし・検証失敗時に使うデモユーザー（ハッカソン用）
+DEMO_USER_ID = "demo_user_001"
+
+_cache = OrderedDict()  # トークンのダイジェスト -> (decoded, 期限のUNIX秒)
+_inflight = {}  # トークンのダイジェスト -> Future
+_lock = threading.Lock()
+_counters = {
+    "hits": 0,
+    "misses": 0,
+    "coalesced": 0,
+    "verifications": 0,
+    "failures": 0,
+    "verify_seconds_total": 0.0
+}
+
+
+def _digest(id_token):
+    # トークン文字列そのものはメモリに保持しない
+    return hashlib.sha256(id_token.encode()).hexdigest()
+
+
+def _cache_get(key, now):
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    decoded, expires_at = entry
+    if expires_at <= now:
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    return decoded
+
+
+def _cache_put(key, decoded):
+    expires_at = decoded.get("exp", 0) - AUTH_CACHE_EXPIRY_SKEW_SECONDS
+    if expires_at <= time.time():
+        return
+    _cache[key] = (decoded, expires_at)
+    _cache.move_to_end(key)
+    while len(_cache) > AUTH_CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+
+
+def verify_id_token(id_token):
+    """
+    auth.verify_id_token のキャッシュ付き版
+
+    Raises:
+        auth.verify_id_token と同じ例外（失敗はキャッシュしない）
+    """
+    key = _digest(id_token)
+
+    with _lock:
+        decoded = _cache_get(key, time.time())
+        if decoded is not None:
+            _counters["hits"] += 1
+            return decoded
+
+        _counters["misses"] += 1
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            _inflight[key] = future
+        else:
+            _counters["coalesced"] += 1
+
+    # 他のリクエストが検証中ならその結果を待つ
+    if not leader:
+        return future.result()
+
+    started = time.perf_counter()
+    try:
+        decoded = auth.verify_id_token(id_token)
+    except Exception as e:
+        with _lock:
+            _counters["verifications"] += 1
+            _counters["failures"] += 1
+            _counters["verify_seconds_total"] += time.perf_counter() - started
+            _inflight.pop(key, None)
+        future.set_exception(e)
+        raise
+
+    with _lock:
+        _counters["verifications"] += 1
+        _counters["verify_seconds_total"] += time.perf_counter() - started
+        _cache_put(key, decoded)
+        _inflight.pop(key, None)
+    future.set_result(decoded)
+    return decoded
+
+
+def get_user_id(request, default=DEMO_USER_ID):
+    """Authorization ヘッダーからユーザーIDを取得（なければ default）"""
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        try:
+            token = auth_header.split('Bearer ')[1]
+            return verify_id_token(token)['uid']
+        except Exception as e:
+            logging.debug(f"ID token verification failed: {e}")
+    return default
+
+
+def stats():
+    """ヒット率と検証レイテンシ"""
+    with _lock:
+        lookups = _counters["hits"] + _counters["misses"]
+        verifications = _counters["verifications"]
+        return {
+            **_counters,
+            "entries": len(_cache),
+            "hit_rate": _counters["hits"] / lookups if lookups else 0.0,
+            "avg_verify_ms": (
+                _counters["verify_seconds_total"] / verifications * 1000
+                if verifications else 0.0
+            )
+        }
+
+
+def clear():
+    """キャッシュを破棄（テスト・鍵ローテーション時用）"""
+    with _lock:
+        _cache.clear()
@@ -5,9 +5,13 @@ import random
 from datetime import datetime, timezone
 
 import functions_framework
-import vertexai
-from firebase_admin import auth, initialize_app
-from vertexai.preview.generative_models import GenerativeModel
+from firebase_admin import initialize_app
+
+from auth_cache import verify_id_token
+from clients import GEMINI_MODEL, LazyClient, get_generative_model
+from agents.guardian_schema import LEVEL_COLORS
+from response_cache import get_response_cache, response_cache_key
+from tts_cache import get_audio_url
 
 # Firebase Admin SDK初期化
 try:
@@ -17,12 +21,8 @@ except ValueError:
     pass
 
 # ---------- 初期化 ----------
-PROJECT = os.getenv("GCP_PROJECT")
-GEMINI_LOCATION = os.getenv("GEMINI_LOCATION", "us-central1")
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-001")
-
-vertexai.init(project=PROJECT, location=GEMINI_LOCATION)
-model = GenerativeModel(GEMINI_MODEL)
+# Vertex AI の初期化とモデル生成は初回の生成時まで遅らせる
+model = LazyClient(lambda: get_generative_model(GEMINI_MODEL))
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 logging.basicConfig(level=LOG_LEVEL)
@@ -68,7 +68,8 @@ def get_current_context():
     
     return {
         "current_time": now.strftime("%H:%M"),
-        "day_of_week": days[now.weekday()]
+        "day_of_week": days[now.weekday()],
+        "hour": now.hour
     }
 
 
@@ -87,7 +88,7 @@ def bartender(request):
         
         if id_token:
             try:
-                uid = auth.verify_id_token(id_token)["uid"]
+                uid = verify_id_token(id_token)["uid"]
             except Exception:
                 logging.warning("Invalid ID token provided. Using test mode.")
                 uid = "test-user"
@@ -114,38 +115,80 @@ def bartender(request):
                 400
             )
         
+        # 音声生成（スタンドアロン版は既定でオフ）
+        enable_tts = request_json.get("enableTTS", False)
+        guardian_level = request_json.get("guardianLevel") or "green"
+        # プロンプトとキャッシュキーに使うので既知の色だけ受け付ける
+        if guardian_level not in LEVEL_COLORS:
+            return add_cors_headers(
+                json.dumps({"code": "BAD_REQUEST", "message": f"guardianLevel must be one of {LEVEL_COLORS}"}),
+                400
+            )
+        
         # コンテキスト情報の取得
         context = get_current_context()
         
-        # プロンプトの構築
-        system_prompt = BARTENDER_PROMPT.format(**context)
+        # 定型メッセージは時間帯・Guardianレベルごとのキャッシュから返す（Gemini・TTSを省略）
+        response_cache = get_response_cache()
+        cache_key = response_cache_key(user_message, context["hour"], guardian_level)
+        cached = response_cache.get(cache_key)
+        audio_url = None
         
-        # Geminiでレスポンス生成
-        try:
-            prompt = f"{system_prompt}\n\nユーザー: {user_message}\n\nBartender:"
-            response = model.generate_content(prompt)
+        if cached:
+            bartender_response = cached["message"]
+            if enable_tts:
+                audio_url = cached["audio_url"]
+                if not audio_url:
+                    # 音声なしで保存された応答: 合成して（TTSキャッシュ経由）次回から使う
+                    try:
+                        audio_url = get_audio_url(bartender_response)
+                        response_cache.attach_audio(cache_key, bartender_response, audio_url)
+                    except Exception as e:
+                        logging.error(f"Error generating TTS audio: {e}")
+        else:
+            # プロンプトの構築
+            system_prompt = BARTENDER_PROMPT.format(**context)
+            if guardian_level != "green":
+                system_prompt += f"- Guardianの警告レベル: {guardian_level}（優しく飲酒を控えるよう促す）\n"
             
-            if not response or not response.text:
-                raise Exception("Empty response from Gemini")
+            # Geminiでレスポンス生成
+            try:
+                prompt = f"{system_prompt}\n\nユーザー: {user_message}\n\nBartender:"
+                response = model.generate_content(prompt)
+                
+                if not response or not response.text:
+                    raise Exception("Empty response from Gemini")
+                
+                bartender_response = response.text.strip()
+                
+            except Exception as e:
+                logging.error(f"Error generating response: {e}")
+                # フォールバック応答（キャッシュしない）
+                bartender_response = "すみません、ちょっと聞き取れませんでした。もう一度お願いできますか？"
+                cache_key = None
             
-            bartender_response = response.text.strip()
+            if enable_tts:
+                try:
+                    audio_url = get_audio_url(bartender_response)
+                except Exception as e:
+                    logging.error(f"Error generating TTS audio: {e}")
             
-        except Exception as e:
-            logging.error(f"Error generating response: {e}")
-            # フォールバック応答
-            bartender_response = "すみません、ちょっと聞き取れませんでした。もう一度お願いできますか？"
+            response_cache.put(cache_key, bartender_response, audio_url)
         
         # ランダムな画像IDを生成（1-10）
         image_id = random.randint(1, 10)
         
-        # レスポンスの構築（音声なし版）
+        # レスポンスの構築
         response_data = {
             "success": True,
             "message": bartender_response,
             "imageId": image_id,
             "timestamp": datetime.now(timezone.utc).isoformat(),
-            "agent": "bartender"
+            "agent": "bartender",
+            "cached": cached is not None
         }
+        if audio_url:
+            response_data["audioUrl"] = audio_url
         
         return add_cors_headers(
             json.dumps(response_data, ensure_ascii=False),
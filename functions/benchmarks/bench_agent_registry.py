@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+エージェント生成コストのマイクロベンチマーク
+リクエストごとに create_*() する従来方式と、レジストリ経由で共有する方式を比較する
+
+    python benchmarks/bench_agent_registry.py --iterations 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import firebase_admin
+
+if not firebase_admin._apps:
+    firebase_admin.initialize_app()
+
+from agents.registry import DEFAULT_FACTORIES, AgentRegistry
+
+
+def _measure(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def _summary(samples):
+    ordered = sorted(samples)
+    return {
+        "mean_ms": statistics.mean(ordered),
+        "p50_ms": ordered[len(ordered) // 2],
+        "max_ms": ordered[-1]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent construction benchmark")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    registry = AgentRegistry(DEFAULT_FACTORIES)
+
+    print(f"{'agent':<16}{'mode':<12}{'mean(ms)':>10}{'p50(ms)':>10}{'max(ms)':>10}")
+    print("-" * 58)
+    for name, factory in DEFAULT_FACTORIES.items():
+        # 従来方式: リクエストごとに生成
+        before = _summary(_measure(factory, args.iterations))
+        # レジストリ方式: 初回のみ生成、以降は共有インスタンス
+        after = _summary(_measure(lambda: registry.get(name), args.iterations))
+
+        for mode, result in (("per-request", before), ("registry", after)):
+            print(f"{name:<16}{mode:<12}{result['mean_ms']:>10.3f}{result['p50_ms']:>10.3f}{result['max_ms']:>10.3f}")
+
+    print("\nRegistry status:")
+    for name, stats in registry.status()["agents"].items():
+        print(f"  {name}: init {stats['init_seconds']}s, hits {stats['hits']}")
+
+
+if __name__ == "__main__":
+    main()
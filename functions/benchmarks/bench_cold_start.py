@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+コールドスタートのベンチマーク
+main_imports の各エンドポイントについて、新しいプロセスで
+「モジュールの import」と「最初のリクエスト」にかかる時間を測定する
+（Cloud Functions のインスタンス起動直後と同じ状態を毎回作るため、1回ごとにサブプロセスを起動する）
+
+    python benchmarks/bench_cold_start.py --repeat 3
+    python benchmarks/bench_cold_start.py --endpoints get_drinks_master chat --token $ID_TOKEN
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# エンドポイントごとの最初のリクエスト（method, path, JSONボディ）
+SAMPLE_REQUESTS = {
+    "transcribe": ("POST", "/transcribe", None),
+    "chat": ("POST", "/chat", {"message": "こんにちは"}),
+    "get_drinks_master": ("GET", "/get_drinks_master", None),
+    "add_drink": ("POST", "/add_drink", {"drink_id": "beer"}),
+    "start_session": ("POST", "/start_session", {}),
+    "end_session": ("POST", "/end_session", {}),
+    "get_current_session": ("GET", "/get_current_session", None),
+    "guardian_check": ("GET", "/guardian_check", None),
+    "drink": ("POST", "/drink", {"drinkType": "beer", "alcoholPercentage": 5, "volume": 350}),
+    "bartender": ("POST", "/bartender", {"message": "こんにちは"}),
+    "guardian_monitor": ("POST", "/guardian_monitor", {}),
+    "drinking_coach_analyze": ("POST", "/drinking_coach_analyze", {}),
+    "tts": ("POST", "/tts", {"text": "こんにちは"}),
+    # 形式の正しい未生成のトークン: 待たずに 202（pending）を返す
+    "tts_audio": ("GET", "/tts_audio?token=tts/cold-start/0000000000000000.mp3&wait=0", None),
+}
+
+# multipart でアップロードするファイル（フォーム名 file）
+SAMPLE_UPLOADS = {
+    "transcribe": ("voice.m4a", os.path.join(FUNCTIONS_DIR, "tests", "test_audio.m4a")),
+}
+
+# アクティブなセッションが必要なエンドポイント（計測前に別プロセスで start_session を呼ぶ）
+SESSION_REQUIRED = {"end_session"}
+
+
+def request_context_args(endpoint):
+    """test_request_context に渡す (path, キーワード引数)"""
+    method, path, body = SAMPLE_REQUESTS[endpoint]
+    if endpoint in SAMPLE_UPLOADS:
+        filename, file_path = SAMPLE_UPLOADS[endpoint]
+        with open(file_path, "rb") as f:
+            content = f.read()
+        return path, {
+            "method": method,
+            "data": {"file": (io.BytesIO(content), filename)},
+            "content_type": "multipart/form-data"
+        }
+    return path, {"method": method, "json": body}
+
+
+def is_success(status):
+    return status is not None and 200 <= status < 300
+
+
+def _child(endpoint, token):
+    """サブプロセス側: import と最初のリクエストを測定して JSON を出力する"""
+    sys.path.insert(0, FUNCTIONS_DIR)
+
+    started = time.perf_counter()
+    import main_imports
+    import_seconds = time.perf_counter() - started
+
+    from flask import Flask
+    import clients
+
+    handler = getattr(main_imports, endpoint)
+    path, request_args = request_context_args(endpoint)
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+    app = Flask(__name__)
+    status = None
+    error = None
+    started = time.perf_counter()
+    with app.test_request_context(path, headers=headers, **request_args):
+        from flask import request
+        try:
+            result = handler(request)
+            # SSEなどのジェネレータは最後まで読み切る
+            response = app.make_response(result)
+            response.get_data()
+            status = response.status_code
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    first_request_seconds = time.perf_counter() - started
+
+    print(json.dumps({
+        "endpoint": endpoint,
+        "import_seconds": import_seconds,
+        "first_request_seconds": first_request_seconds,
+        "status": status,
+        "error": error,
+        "clients": clients.stats()["initialized"]
+    }))
+
+
+def _run_once(endpoint, token):
+    command = [sys.executable, os.path.abspath(__file__), "--child", endpoint]
+    if token:
+        command += ["--token", token]
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=FUNCTIONS_DIR)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        raise RuntimeError(f"{endpoint}: child process failed\n{completed.stderr[-2000:]}")
+    result = json.loads(lines[-1])
+    # 4xx/5xx の応答はエラー処理の速さしか測れないので失敗として扱う
+    if not is_success(result["status"]):
+        raise RuntimeError(f"{endpoint}: request failed (status={result['status']}, error={result['error']})")
+    return result
+
+
+def _measure(endpoint, token):
+    if endpoint in SESSION_REQUIRED:
+        _run_once("start_session", token)
+    return _run_once(endpoint, token)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark")
+    parser.add_argument("--endpoints", nargs="*", default=list(SAMPLE_REQUESTS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--token", default=os.getenv("ID_TOKEN"), help="Firebase ID token（未指定なら未認証リクエスト）")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.token)
+        return
+
+    results = []
+    for endpoint in args.endpoints:
+        runs = [_measure(endpoint, args.token) for _ in range(args.repeat)]
+        import_ms = [run["import_seconds"] * 1000 for run in runs]
+        request_ms = [run["first_request_seconds"] * 1000 for run in runs]
+        results.append({
+            "endpoint": endpoint,
+            "import_ms": statistics.median(import_ms),
+            "first_request_ms": statistics.median(request_ms),
+            "total_ms": statistics.median(i + r for i, r in zip(import_ms, request_ms)),
+            "status": runs[-1]["status"],
+            "error": runs[-1]["error"],
+            "clients": runs[-1]["clients"]
+        })
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'endpoint':<24}{'import(ms)':>12}{'1st req(ms)':>13}{'total(ms)':>11}{'status':>8}  clients")
+    print("-" * 100)
+    for result in results:
+        status = result["status"] if result["status"] is not None else "ERR"
+        print(f"{result['endpoint']:<24}{result['import_ms']:>12.1f}{result['first_request_ms']:>13.1f}"
+              f"{result['total_ms']:>11.1f}{status:>8}  {', '.join(result['clients']) or '-'}")
+    print(f"\n(median of {args.repeat} fresh processes per endpoint)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+/drink のレイテンシを Guardian のモードごとに比較する
+llmモード（毎回LLMのJSON出力で判定）と hybridモード（ルール判定 + 助言文は非同期）で、
+フェイクバックエンド上の実際の drink ハンドラを呼び、応答時間を比較する
+Gemini の応答時間は FAKE_GEMINI_LATENCY_MS で与える（Guardian 以外のLLM呼び出しも同じ遅延になる）
+
+    python benchmarks/bench_guardian_modes.py --iterations 30 --model-latency-ms 1500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODES = ("llm", "hybrid")
+DRINK_BODY = {"drinkType": "beer", "alcoholPercentage": 5, "volume": 350, "ttsMode": "deferred"}
+# 同じユーザーに続けて記録する杯数（判定が danger に張り付かないようユーザーを替える）
+DRINKS_PER_USER = 5
+
+
+def _child(mode, iterations):
+    """サブプロセス側: GUARDIAN_MODE を設定した状態で /drink を繰り返し呼ぶ"""
+    sys.path.insert(0, FUNCTIONS_DIR)
+
+    from fake_backends import install_fake_backends
+    install_fake_backends()
+
+    from asgi_app import create_flask_app
+    client = create_flask_app().test_client()
+
+    def post_drink(user):
+        started = time.perf_counter()
+        response = client.post("/drink", json=DRINK_BODY, headers={"Authorization": f"Bearer {user}"})
+        response.get_data()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if not 200 <= response.status_code < 300:
+            raise SystemExit(f"/drink returned {response.status_code} in {mode} mode: {response.get_data(as_text=True)}")
+        return elapsed_ms
+
+    # import やクライアント生成を計測に含めない
+    post_drink(f"bench-{mode}-warmup")
+
+    samples = [post_drink(f"bench-{mode}-{i // DRINKS_PER_USER}") for i in range(iterations)]
+    print(json.dumps({"mode": mode, "samples_ms": samples}))
+
+
+def _run_mode(mode, iterations, model_latency_ms):
+    env = {
+        **os.environ,
+        "GUARDIAN_MODE": mode,
+        "FAKE_GEMINI_LATENCY_MS": str(model_latency_ms),
+    }
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, "--iterations", str(iterations)],
+        cwd=FUNCTIONS_DIR, env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise SystemExit(f"{mode} run failed:\n{completed.stderr.strip() or completed.stdout.strip()}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])["samples_ms"]
+
+
+def _summary(samples):
+    ordered = sorted(samples)
+    return {
+        "mean_ms": statistics.mean(ordered),
+        "p50_ms": ordered[len(ordered) // 2],
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Guardian hybrid vs LLM benchmark (/drink end to end)")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--model-latency-ms", type=float, default=1500)
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, args.iterations)
+        return
+
+    print(f"{'mode':<10}{'mean(ms)':>12}{'p50(ms)':>12}{'p95(ms)':>12}")
+    print("-" * 46)
+    for mode in MODES:
+        result = _summary(_run_mode(mode, args.iterations, args.model_latency_ms))
+        print(f"{mode:<10}{result['mean_ms']:>12.3f}{result['p50_ms']:>12.3f}{result['p95_ms']:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+transcribe のアップロード受信処理のベンチマーク
+一時ファイルに保存して読み戻す従来方式と、メモリバッファで直接受ける方式を比較する
+（Gemini呼び出しは含まない。multipart解析〜bytes取得までを計測）
+
+    python benchmarks/bench_transcribe_upload.py --sizes 64K,512K,2M,8M --iterations 20
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+
+from upload_buffer import read_upload, use_memory_uploads
+
+# ベンチマークでは最大サイズのクリップも通す
+BENCH_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _parse_size(value):
+    units = {"K": 1024, "M": 1024 * 1024}
+    value = value.strip().upper()
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def _build_request(payload):
+    builder = EnvironBuilder(
+        method="POST",
+        path="/transcribe",
+        data={"file": (io.BytesIO(payload), "clip.webm", "audio/webm")}
+    )
+    return Request(builder.get_environ())
+
+
+def tempfile_path(request):
+    """従来方式: NamedTemporaryFile に保存 → read_bytes → unlink"""
+    request_file = request.files["file"]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=Path(request_file.filename).suffix) as tmp:
+        request_file.save(tmp.name)
+        audio_bytes = Path(tmp.name).read_bytes()
+        tmp_file_path = tmp.name
+    Path(tmp_file_path).unlink()
+    return audio_bytes
+
+
+def memory_path(request):
+    """新方式: メモリバッファで受けてそのまま返す"""
+    use_memory_uploads(request, max_bytes=BENCH_MAX_BYTES)
+    return read_upload(request.files["file"], max_bytes=BENCH_MAX_BYTES)
+
+
+def _measure(func, payload, iterations):
+    samples = []
+    peaks = []
+    for _ in range(iterations):
+        request = _build_request(payload)
+        tracemalloc.start()
+        started = time.perf_counter()
+        audio_bytes = func(request)
+        samples.append((time.perf_counter() - started) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        assert len(audio_bytes) == len(payload)
+    return statistics.mean(samples), sorted(samples)[len(samples) // 2], max(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe upload path benchmark")
+    parser.add_argument("--sizes", default="64K,512K,2M,8M", help="comma separated clip sizes")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'size':>8}  {'mode':<10}{'mean(ms)':>10}{'p50(ms)':>10}{'peak(KB)':>12}")
+    print("-" * 52)
+    for size_label in args.sizes.split(","):
+        payload = os.urandom(_parse_size(size_label))
+        for mode, func in (("tempfile", tempfile_path), ("memory", memory_path)):
+            mean_ms, p50_ms, peak = _measure(func, payload, args.iterations)
+            print(f"{size_label:>8}  {mode:<10}{mean_ms:>10.3f}{p50_ms:>10.3f}{peak / 1024:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
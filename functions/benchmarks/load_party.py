@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+飲み会シナリオの負荷試験
+多数のユーザーが同時に start_session → 数分おきの drink・chat・状態確認・音声入力 を行う負荷を
+目標RPSで発生させ、エンドポイントごとの p50/p95/p99 レイテンシ・スループット・エラー率・
+1リクエストあたりの外部呼び出し数を表とJSONで出力する
+
+    # ローカルサーバー（asgi_app.py --stub / local_server.py など）に対して実行
+    python benchmarks/load_party.py --url http://localhost:8080 --users 50 --rps 20 --duration 60
+
+    # サーバーを立てずにプロセス内のフェイクバックエンドで実行
+    python benchmarks/load_party.py --in-process --users 50 --rps 20 --duration 60 --output report.json
+
+リクエストは予定時刻どおりに送り（オープンループ）、レイテンシは予定時刻から応答完了までを測る。
+サーバーが詰まったときの待ち時間も結果に含まれる
+"""
+import argparse
+import heapq
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(FUNCTIONS_DIR)
+
+# ユーザー1人あたりの平均間隔（秒、実時間の飲み会を想定）
+ACTION_INTERVALS = {
+    "drink": 180,
+    "chat": 90,
+    "get_current_session": 20,
+    "guardian_check": 45,
+    "transcribe": 150,
+}
+PER_USER_RATE = sum(1 / interval for interval in ACTION_INTERVALS.values())
+
+DRINKS = [
+    {"drinkType": "ビール", "alcoholPercentage": 5, "volume": 350},
+    {"drinkType": "ハイボール", "alcoholPercentage": 7, "volume": 350},
+    {"drinkType": "日本酒", "alcoholPercentage": 15, "volume": 180},
+    {"drinkType": "ワイン", "alcoholPercentage": 12, "volume": 120},
+    {"drinkType": "烏龍茶", "alcoholPercentage": 0, "volume": 300},
+]
+CHAT_MESSAGES = [
+    "こんにちは",
+    "おすすめのお酒はありますか？",
+    "ビールに合うおつまみは？",
+    "そろそろペースを落とした方がいいかな",
+    "次は何を飲もうかな",
+]
+AUDIO_PATH = os.path.join(FUNCTIONS_DIR, "tests", "test_audio.m4a")
+BACKENDS = ("firestore", "storage", "tts", "gemini")
+
+
+# ---------- 送信先 ----------
+
+class HttpTransport:
+    """HTTPでローカルサーバーなどに送る"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def backend_stats(self):
+        """asgi_app の /health が返すフェイクバックエンドの統計（なければ None）"""
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/health", timeout=self.timeout) as response:
+                return json.loads(response.read()).get("backends") or None
+        except Exception:
+            return None
+
+    def send(self, method, path, headers, json_body=None, upload=None):
+        data = None
+        headers = dict(headers)
+        if upload is not None:
+            boundary = uuid.uuid4().hex
+            filename, content = upload
+            data = (
+                f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+                f"Content-Type: application/octet-stream\r\n\r\n"
+            ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+            headers["Content-Type"] = f"multipart/form-data; boundary={boundary}"
+        elif json_body is not None:
+            data = json.dumps(json_body, ensure_ascii=False).encode()
+            headers["Content-Type"] = "application/json"
+
+        request = urllib.request.Request(f"{self.base_url}{path}", data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status, None
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, None
+
+
+class InProcessTransport:
+    """サーバーを立てずに、フェイクバックエンド上の実ハンドラを直接呼ぶ"""
+
+    def __init__(self):
+        from fake_backends import install_fake_backends
+        install_fake_backends()
+
+        from asgi_app import create_flask_app
+        self.app = create_flask_app()
+        self._local = threading.local()
+
+    def backend_stats(self):
+        import fake_backends
+        return fake_backends.stats()
+
+    def send(self, method, path, headers, json_body=None, upload=None):
+        from fake_backends import count_calls
+
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+
+        kwargs = {"method": method, "headers": headers}
+        if upload is not None:
+            filename, content = upload
+            kwargs["data"] = {"file": (io.BytesIO(content), filename)}
+            kwargs["content_type"] = "multipart/form-data"
+        elif json_body is not None:
+            kwargs["json"] = json_body
+        with count_calls() as calls:
+            response = client.open(path, **kwargs)
+            response.get_data()
+        return response.status_code, calls
+
+
+# ---------- 集計 ----------
+
+def percentile(ordered, fraction):
+    """昇順のリストから最近傍順位法でパーセンタイルを取る"""
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, latency_ms, status, calls):
+        with self._lock:
+            entry = self._endpoints.setdefault(endpoint, {
+                "latencies": [], "errors": 0, "statuses": {}, "calls": {}, "counted": 0
+            })
+            entry["latencies"].append(latency_ms)
+            entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+            if status == 0 or status >= 400:
+                entry["errors"] += 1
+            if calls is not None:
+                entry["counted"] += 1
+                for backend, count in calls.items():
+                    entry["calls"][backend] = entry["calls"].get(backend, 0) + count
+
+    def report(self, elapsed):
+        endpoints = {}
+        with self._lock:
+            for endpoint, entry in sorted(self._endpoints.items()):
+                ordered = sorted(entry["latencies"])
+                count = len(ordered)
+                endpoints[endpoint] = {
+                    "requests": count,
+                    "throughput_rps": count / elapsed if elapsed else 0.0,
+                    "error_rate": entry["errors"] / count if count else 0.0,
+                    "statuses": entry["statuses"],
+                    "p50_ms": percentile(ordered, 0.50),
+                    "p95_ms": percentile(ordered, 0.95),
+                    "p99_ms": percentile(ordered, 0.99),
+                    "max_ms": ordered[-1] if ordered else 0.0,
+                    "external_calls_per_request": {
+                        backend: count / entry["counted"] for backend, count in entry["calls"].items()
+                    } if entry["counted"] else None
+                }
+        return endpoints
+
+
+# ---------- シナリオ ----------
+
+class PartyScenario:
+    """ユーザーごとの予定表（次に何をいつ行うか）を管理する"""
+
+    def __init__(self, users, rps, ramp_up, seed, stream_chat):
+        self.rng = random.Random(seed)
+        self.stream_chat = stream_chat
+        # 目標RPSになるように飲み会の時間を縮める（何倍速で進めるか）
+        self.time_scale = rps / (users * PER_USER_RATE)
+        self.users = [f"load-user-{i:04d}" for i in range(users)]
+        self._queue = []
+        self._seq = 0
+        for user in self.users:
+            self._push(self.rng.uniform(0, ramp_up), user, "start_session")
+        try:
+            with open(AUDIO_PATH, "rb") as f:
+                self.audio = f.read()
+        except OSError:
+            self.audio = bytes(16 * 1024)
+
+    def _push(self, due, user, action):
+        self._seq += 1
+        heapq.heappush(self._queue, (due, self._seq, user, action))
+
+    def _next_interval(self, action):
+        # ポアソン到着（平均間隔 / 倍速）
+        return self.rng.expovariate(self.time_scale / ACTION_INTERVALS[action])
+
+    def pop(self, until):
+        """until 秒より前の次のイベント（なければ None）。定期的な操作は次回分を予約する"""
+        if not self._queue or self._queue[0][0] >= until:
+            return None
+        due, _, user, action = heapq.heappop(self._queue)
+        if action == "start_session":
+            for periodic in ACTION_INTERVALS:
+                self._push(due + self._next_interval(periodic), user, periodic)
+        else:
+            self._push(due + self._next_interval(action), user, action)
+        return due, user, action
+
+    def build(self, action):
+        """操作 -> (method, path, json_body, upload)"""
+        if action == "start_session":
+            return "POST", "/start_session", {}, None
+        if action == "drink":
+            return "POST", "/drink", {**self.rng.choice(DRINKS), "ttsMode": "deferred"}, None
+        if action == "chat":
+            body = {"message": self.rng.choice(CHAT_MESSAGES), "ttsMode": "deferred"}
+            if self.stream_chat:
+                body["stream"] = True
+            return "POST", "/chat", body, None
+        if action == "transcribe":
+            return "POST", "/transcribe", None, ("voice.m4a", self.audio)
+        if action == "end_session":
+            return "POST", "/end_session", {}, None
+        return "GET", f"/{action}", None, None
+
+
+def run_load(transport, scenario, duration, concurrency, token=None, end_sessions=True):
+    recorder = Recorder()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load")
+
+    def execute(user, action, scheduled):
+        method, path, json_body, upload = scenario.build(action)
+        headers = {"Authorization": f"Bearer {token or user}"}
+        try:
+            status, calls = transport.send(method, path, headers, json_body, upload)
+        except Exception:
+            status, calls = 0, None
+        recorder.record(action, (time.perf_counter() - scheduled) * 1000, status, calls)
+
+    before = transport.backend_stats()
+    started = time.perf_counter()
+    futures = []
+    while True:
+        event = scenario.pop(duration)
+        if event is None:
+            break
+        due, user, action = event
+        scheduled = started + due
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        futures.append(executor.submit(execute, user, action, scheduled))
+
+    for future in futures:
+        future.result()
+
+    if end_sessions:
+        now = time.perf_counter()
+        for future in [executor.submit(execute, user, "end_session", now) for user in scenario.users]:
+            future.result()
+    executor.shutdown()
+    elapsed = time.perf_counter() - started
+
+    after = transport.backend_stats()
+    return recorder, elapsed, _backend_delta(before, after)
+
+
+def _backend_delta(before, after):
+    """実行前後のフェイクバックエンドの呼び出し回数の差（バックグラウンド処理も含む）"""
+    if not before or not after:
+        return None
+    return {
+        name: {
+            "calls": after[name]["calls"] - before.get(name, {}).get("calls", 0),
+            "injected_errors": after[name]["injected_errors"] - before.get(name, {}).get("injected_errors", 0)
+        }
+        for name in after
+    }
+
+
+def build_report(args, scenario, recorder, elapsed, backend_calls):
+    endpoints = recorder.report(elapsed)
+    total = sum(entry["requests"] for entry in endpoints.values())
+    errors = sum(entry["requests"] * entry["error_rate"] for entry in endpoints.values())
+    return {
+        "config": {
+            "target": args.url or "in-process",
+            "users": args.users,
+            "target_rps": args.rps,
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "time_scale": scenario.time_scale,
+            "stream_chat": args.stream_chat
+        },
+        "elapsed_s": elapsed,
+        "requests": total,
+        "throughput_rps": total / elapsed if elapsed else 0.0,
+        "error_rate": errors / total if total else 0.0,
+        "endpoints": endpoints,
+        # 全リクエスト（end_session を含む）に対する外部呼び出しの合計
+        "backend_calls": backend_calls,
+        "backend_calls_per_request": {
+            name: counts["calls"] / total for name, counts in backend_calls.items()
+        } if backend_calls and total else None
+    }
+
+
+def print_report(report):
+    config = report["config"]
+    print(f"target={config['target']} users={config['users']} target_rps={config['target_rps']} "
+          f"duration={config['duration_s']}s (party time x{config['time_scale']:.1f})")
+    print(f"{'endpoint':<22}{'reqs':>7}{'rps':>8}{'err%':>7}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}"
+          f"{'max(ms)':>10}  calls/req ({'/'.join(BACKENDS)})")
+    print("-" * 120)
+    for endpoint, entry in report["endpoints"].items():
+        calls = entry["external_calls_per_request"]
+        calls_text = "/".join(f"{calls.get(b, 0):.1f}" for b in BACKENDS) if calls is not None else "-"
+        print(f"{endpoint:<22}{entry['requests']:>7}{entry['throughput_rps']:>8.2f}{entry['error_rate'] * 100:>7.1f}"
+              f"{entry['p50_ms']:>10.1f}{entry['p95_ms']:>10.1f}{entry['p99_ms']:>10.1f}{entry['max_ms']:>10.1f}"
+              f"  {calls_text}")
+    print("-" * 120)
+    print(f"{'total':<22}{report['requests']:>7}{report['throughput_rps']:>8.2f}{report['error_rate'] * 100:>7.1f}")
+    if report["backend_calls_per_request"]:
+        per_request = ", ".join(f"{name}={value:.2f}" for name, value in report["backend_calls_per_request"].items())
+        print(f"\nBackend calls per request (including background work): {per_request}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Party scenario load generator")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="送信先のベースURL（例: http://localhost:8080）")
+    target.add_argument("--in-process", action="store_true", help="プロセス内のフェイクバックエンドで実行")
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--rps", type=float, default=10.0, help="目標リクエスト数/秒")
+    parser.add_argument("--duration", type=float, default=60.0, help="負荷をかける秒数")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="全ユーザーが start_session するまでの秒数")
+    parser.add_argument("--concurrency", type=int, default=64, help="同時に送るリクエストの上限")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--token", help="全ユーザー共通のIDトークン（未指定ならユーザーIDをトークンとして送る）")
+    parser.add_argument("--stream-chat", action="store_true", help="chat をSSEで受け取る")
+    parser.add_argument("--no-end-sessions", action="store_true", help="最後に end_session を送らない")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="結果をJSONで標準出力に出す")
+    parser.add_argument("--output", help="結果のJSONを保存するパス")
+    args = parser.parse_args()
+
+    transport = HttpTransport(args.url, args.timeout) if args.url else InProcessTransport()
+    scenario = PartyScenario(args.users, args.rps, args.ramp_up, args.seed, args.stream_chat)
+    recorder, elapsed, backend_calls = run_load(
+        transport, scenario, args.duration, args.concurrency, args.token, not args.no_end_sessions
+    )
+    report = build_report(args, scenario, recorder, elapsed, backend_calls)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+コールドスタートのプロファイラ
+main_imports の各エンドポイントを新しいプロセス（python -X importtime）で起動し、
+フェーズ別の時間・モジュールごとの import コスト・クライアント生成コスト・起動完了時のメモリを記録する。
+Googleのクライアントはインメモリのフェイク（fake_backends）に置き換えるため、オフラインでも実行できる
+
+    python benchmarks/profile_cold_start.py                       # 表を出力
+    python benchmarks/profile_cold_start.py --write-baseline      # ベースラインを保存
+    python benchmarks/profile_cold_start.py --compare             # ベースラインとの差分（悪化したら終了コード1）
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_cold_start import FUNCTIONS_DIR, SAMPLE_REQUESTS, SESSION_REQUIRED, is_success, request_context_args
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cold_start_baseline.json")
+PROFILE_USER_ID = "cold-start-profile"
+PROFILE_SESSION_ID = "cold-start-session"
+
+# 差分を追跡するモジュール（cumulative の import コスト）
+TRACKED_MODULES = ("main", "drink", "tts", "agents")
+
+# `import time:       self [us] |   cumulative | imported package`
+IMPORTTIME_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+# ---------- サブプロセス側 ----------
+
+def _max_rss_mb():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _seed_active_session(firestore_client):
+    """フェイクの Firestore にアクティブなセッションを直接書き込む（アプリのモジュールは import しない）"""
+    from datetime import datetime, timezone
+
+    user_ref = firestore_client.collection("users").document(PROFILE_USER_ID)
+    user_ref.collection("sessions").document(PROFILE_SESSION_ID).set({
+        "start_time": datetime.now(timezone.utc),
+        "end_time": None,
+        "total_alcohol_g": 0,
+        "status": "active",
+        "guardian_warnings": [],
+        "drink_count": 0
+    })
+    user_ref.set({"active_session_id": PROFILE_SESSION_ID})
+
+
+def _child(endpoint, offline):
+    sys.path.insert(0, FUNCTIONS_DIR)
+    phases = {}
+
+    started = time.perf_counter()
+    if offline:
+        from fake_backends import install_fake_backends
+        fakes = install_fake_backends(PROFILE_USER_ID, import_real_libraries=True)
+    phases["stubs_ms"] = (time.perf_counter() - started) * 1000
+    if offline and endpoint in SESSION_REQUIRED:
+        _seed_active_session(fakes["firestore"])
+
+    # Functions Framework と同じく main.py を読み込む（main_imports は main を再エクスポートするだけ）
+    started = time.perf_counter()
+    import main_imports
+    phases["import_ms"] = (time.perf_counter() - started) * 1000
+    rss_ready_mb = _max_rss_mb()
+
+    from flask import Flask
+    import clients
+
+    path, request_args = request_context_args(endpoint)
+    app = Flask(__name__)
+    status = None
+    error = None
+    started = time.perf_counter()
+    with app.test_request_context(path, headers={"Authorization": f"Bearer {PROFILE_USER_ID}"}, **request_args):
+        from flask import request
+        try:
+            response = app.make_response(getattr(main_imports, endpoint)(request))
+            response.get_data()
+            status = response.status_code
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    phases["first_request_ms"] = (time.perf_counter() - started) * 1000
+
+    print(json.dumps({
+        "endpoint": endpoint,
+        "phases": phases,
+        "status": status,
+        "error": error,
+        "rss_ready_mb": rss_ready_mb,
+        "rss_after_request_mb": _max_rss_mb(),
+        "clients": {name: seconds * 1000 for name, seconds in clients.stats()["init_seconds"].items()}
+    }))
+
+
+# ---------- 親プロセス側 ----------
+
+def parse_importtime(stderr):
+    """-X importtime の出力を {モジュール: {"self_us", "cumulative_us", "parent"}} にまとめる"""
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_PATTERN.match(line)
+        if match:
+            entries.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3))))
+
+    # 子は親より先に、より深いインデントで出力されるので、逆順にたどって親を求める
+    modules = {}
+    ancestors = []
+    for name, self_us, cumulative_us, depth in reversed(entries):
+        while ancestors and ancestors[-1][0] >= depth:
+            ancestors.pop()
+        modules[name] = {
+            "self_us": self_us,
+            "cumulative_us": cumulative_us,
+            "parent": ancestors[-1][1] if ancestors else None
+        }
+        ancestors.append((depth, name))
+    return modules
+
+
+def _tracked_cost(modules):
+    """追跡対象モジュールの cumulative コスト（agents は入れ子を重複させずにパッケージ全体を合計）"""
+    def in_package(name, package):
+        return name == package or name.startswith(package + ".")
+
+    tracked = {}
+    for package in TRACKED_MODULES:
+        tracked[package] = sum(
+            cost["cumulative_us"] for module, cost in modules.items()
+            if in_package(module, package) and not (cost["parent"] and in_package(cost["parent"], package))
+        ) / 1000
+    return tracked
+
+
+def profile_endpoint(endpoint, offline):
+    command = [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child", endpoint]
+    if not offline:
+        command.append("--online")
+        if endpoint in SESSION_REQUIRED:
+            # 実際のバックエンドでは、計測前に別プロセスでセッションを開始しておく
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--child", "start_session", "--online"],
+                           capture_output=True, cwd=FUNCTIONS_DIR, check=True)
+    started = time.perf_counter()
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=FUNCTIONS_DIR)
+    wall_ms = (time.perf_counter() - started) * 1000
+
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        raise RuntimeError(f"{endpoint}: child process failed\n{completed.stderr[-2000:]}")
+
+    result = json.loads(lines[-1])
+    # 4xx/5xx の応答はエラー処理の速さしか測れないので失敗として扱う
+    if not is_success(result["status"]):
+        raise RuntimeError(f"{endpoint}: request failed (status={result['status']}, error={result['error']})")
+    modules = parse_importtime(completed.stderr)
+    result["wall_ms"] = wall_ms
+    result["tracked_modules_ms"] = _tracked_cost(modules)
+    result["modules"] = modules
+    return result
+
+
+def _merge_runs(runs):
+    """複数回の計測から各値の最小値を取る（ノイズの影響を減らす）"""
+    merged = dict(runs[-1])
+    merged["wall_ms"] = min(run["wall_ms"] for run in runs)
+    merged["phases"] = {key: min(run["phases"][key] for run in runs) for key in runs[0]["phases"]}
+    merged["tracked_modules_ms"] = {
+        key: min(run["tracked_modules_ms"][key] for run in runs) for key in TRACKED_MODULES
+    }
+    merged["rss_ready_mb"] = min(run["rss_ready_mb"] for run in runs)
+    return merged
+
+
+def _print_report(results, top):
+    print(f"{'endpoint':<24}{'wall(ms)':>10}{'import(ms)':>12}{'1st req(ms)':>13}{'rss(MB)':>9}{'status':>8}")
+    print("-" * 76)
+    for result in sorted(results, key=lambda r: r["wall_ms"], reverse=True):
+        status = result["status"] if result["status"] is not None else "ERR"
+        print(f"{result['endpoint']:<24}{result['wall_ms']:>10.1f}{result['phases']['import_ms']:>12.1f}"
+              f"{result['phases']['first_request_ms']:>13.1f}{result['rss_ready_mb']:>9.1f}{status:>8}")
+
+    # import はどのエンドポイントでも main.py 経由で同じなので、最も重い実行の内訳を出す
+    slowest = max(results, key=lambda r: r["wall_ms"])
+    print(f"\nTop {top} modules by self import time ({slowest['endpoint']}):")
+    ranked = sorted(slowest["modules"].items(), key=lambda item: item[1]["self_us"], reverse=True)
+    for module, cost in ranked[:top]:
+        print(f"  {module:<48}{cost['self_us'] / 1000:>9.1f} ms  (cumulative {cost['cumulative_us'] / 1000:.1f} ms)")
+
+    print("\nClient construction (first use):")
+    clients = {}
+    for result in results:
+        for name, ms in result["clients"].items():
+            clients[name] = max(clients.get(name, 0.0), ms)
+    for name, ms in sorted(clients.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name:<48}{ms:>9.1f} ms")
+    if not clients:
+        print("  (none)")
+
+
+def _baseline_view(results):
+    """ベースラインに保存する値（モジュール一覧は追跡対象の集計だけ残す）"""
+    return {
+        "python": sys.version.split()[0],
+        "endpoints": {
+            result["endpoint"]: {
+                "wall_ms": result["wall_ms"],
+                "import_ms": result["phases"]["import_ms"],
+                "first_request_ms": result["phases"]["first_request_ms"],
+                "rss_ready_mb": result["rss_ready_mb"],
+                "tracked_modules_ms": result["tracked_modules_ms"],
+                "clients": sorted(result["clients"])
+            }
+            for result in results
+        }
+    }
+
+
+def compare_with_baseline(current, baseline, max_regression):
+    """ベースラインとの差分を出力し、閾値を超えて悪化した項目の数を返す"""
+    regressions = 0
+    print(f"\n{'endpoint':<24}{'metric':<26}{'baseline':>10}{'current':>10}{'diff':>9}")
+    print("-" * 79)
+    for endpoint, now in current["endpoints"].items():
+        before = baseline["endpoints"].get(endpoint)
+        if before is None:
+            print(f"{endpoint:<24}(new endpoint)")
+            continue
+
+        metrics = [(key, before[key], now[key]) for key in ("wall_ms", "import_ms", "first_request_ms", "rss_ready_mb")]
+        metrics += [(f"import:{module}", before["tracked_modules_ms"].get(module, 0.0), ms)
+                    for module, ms in now["tracked_modules_ms"].items()]
+        for metric, old, new in metrics:
+            change = (new - old) / old * 100 if old else 0.0
+            flag = ""
+            if change > max_regression:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{endpoint:<24}{metric:<26}{old:>10.1f}{new:>10.1f}{change:>+8.0f}%{flag}")
+
+        added = sorted(set(now["clients"]) - set(before["clients"]))
+        if added:
+            print(f"{endpoint:<24}{'clients':<26}new at first request: {', '.join(added)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start profiler")
+    parser.add_argument("--endpoints", nargs="*", default=list(SAMPLE_REQUESTS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=20, help="表示する重いモジュールの数")
+    parser.add_argument("--online", action="store_true", help="スタブを使わず実際のクライアントを生成する")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--write-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="悪化とみなす増加率（%%）")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child, offline=not args.online)
+        return
+
+    results = []
+    for endpoint in args.endpoints:
+        runs = [profile_endpoint(endpoint, offline=not args.online) for _ in range(args.repeat)]
+        results.append(_merge_runs(runs))
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        _print_report(results, args.top)
+
+    current = _baseline_view(results)
+    if args.write_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"\nBaseline written to {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(current, baseline, args.max_regression)
+        if regressions:
+            print(f"\n{regressions} metric(s) regressed by more than {args.max_regression:.0f}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Chat Stream - Bartender応答のServer-Sent Events配信
+Geminiのストリーミング出力をトークン（チャンク）ごとに送り、
+文が完結するたびにその文の音声合成をバックグラウンドで開始する
+
+イベント:
+    token    {"text"}                                       生成されたテキストの断片
+    sentence {"index", "text", "audioToken"?, "audioStatus"?, "audioUrl"?}  完結した文
+    done     {"success", "message", ...extra}               応答全体
+    error    {"code", "message"}                            生成中のエラー
+
+外部サービスに依存しない（音声合成は submit 関数を渡す）ので、ローカルサーバーのスタブモデルでも使える
+"""
+import json
+import logging
+import re
+from datetime import datetime, timezone
+
+# 文末記号（連続する「！？」や閉じ括弧まで含めて1文とする）
+SENTENCE_END_PATTERN = re.compile(r"[。！？!?\n]+[」』）)]*")
+
+SSE_HEADERS = {
+    "Content-Type": "text/event-stream; charset=utf-8",
+    "Cache-Control": "no-cache",
+    # プロキシにバッファさせない
+    "X-Accel-Buffering": "no",
+    "Access-Control-Allow-Origin": "*",
+}
+
+
+def sse_event(event, data):
+    """SSEの1イベント分の文字列"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class SentenceSplitter:
+    """ストリームの断片を受け取り、完結した文を順に取り出す"""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text):
+        """断片を追加し、完結した文のリストを返す"""
+        self._buffer += text
+        sentences = []
+        last_end = 0
+        for match in SENTENCE_END_PATTERN.finditer(self._buffer):
+            # 記号がバッファ末尾にある場合は続きの「！」などを待つ
+            if match.end() == len(self._buffer):
+                break
+            sentence = self._buffer[last_end:match.end()].strip()
+            if sentence:
+                sentences.append(sentence)
+            last_end = match.end()
+        self._buffer = self._buffer[last_end:]
+        return sentences
+
+    def flush(self):
+        """残りを最後の文として返す"""
+        sentence = self._buffer.strip()
+        self._buffer = ""
+        return [sentence] if sentence else []
+
+
+def gemini_text_chunks(model, prompt):
+    """GenerativeModel のストリーミング出力からテキスト断片を取り出す"""
+    for chunk in model.generate_content(prompt, stream=True):
+        try:
+            text = chunk.text
+        except (ValueError, AttributeError):
+            # 安全フィルタ等でテキストのないチャンク
+            continue
+        if text:
+            yield text
+
+
+def stream_chat_events(chunks, submit=None, extra=None, on_complete=None, fallback_message=None):
+    """
+    テキスト断片のイテラブルからSSEイベントを生成する
+
+    Args:
+        chunks: テキスト断片のイテラブル（gemini_text_chunks など）
+        submit: 文ごとの音声合成を開始する関数 submit(text) -> dict（None なら音声なし）
+        extra: done イベントに含める追加フィールド
+        on_complete: 応答全体を受け取るコールバック（会話履歴の保存など）
+        fallback_message: 何も生成されなかった場合の応答
+    """
+    splitter = SentenceSplitter()
+    parts = []
+    index = 0
+
+    def sentence_events(sentences):
+        nonlocal index
+        for sentence in sentences:
+            payload = {"index": index, "text": sentence}
+            if submit is not None:
+                try:
+                    payload.update(submit(sentence))
+                except Exception as e:
+                    logging.error(f"Error starting sentence TTS: {e}")
+            index += 1
+            yield sse_event("sentence", payload)
+
+    try:
+        for text in chunks:
+            parts.append(text)
+            yield sse_event("token", {"text": text})
+            yield from sentence_events(splitter.feed(text))
+    except Exception as e:
+        logging.error(f"Error while streaming chat response: {e}")
+        if not parts and not fallback_message:
+            yield sse_event("error", {"code": "STREAM_FAILED", "message": str(e)})
+            return
+        # 途中まで生成できていればそこまでを応答とする
+
+    if not parts and fallback_message:
+        parts.append(fallback_message)
+        yield sse_event("token", {"text": fallback_message})
+        yield from sentence_events(splitter.feed(fallback_message))
+    yield from sentence_events(splitter.flush())
+
+    message = "".join(parts).strip()
+    if on_complete is not None and message:
+        try:
+            on_complete(message)
+        except Exception as e:
+            logging.warning(f"Chat stream completion callback failed: {e}")
+
+    yield sse_event("done", {
+        "success": True,
+        "message": message,
+        "sentences": index,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        **(extra or {})
+    })
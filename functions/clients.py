@@ -0,0 +1,156 @@
+"""
+Clients - クラウドクライアントの遅延生成
+Firestore・Cloud Storage・Text-to-Speech・Vertex AI のクライアントを初回利用時に1度だけ生成し、
+全モジュールで共有する。重いライブラリの import も初回利用時まで遅らせるため、
+クライアントを使わないエンドポイント（get_drinks_master など）はその初期化コストを払わない
+"""
+import logging
+import os
+import threading
+import time
+
+PROJECT = os.getenv("GCP_PROJECT")
+# Vertex AI API を呼び出す際の推奨ロケーション (Geminiモデル用)
+GEMINI_LOCATION = os.getenv("GEMINI_LOCATION", "us-central1")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-001")
+
+_instances = {}  # 名前 -> クライアント
+_init_seconds = {}  # 名前 -> 生成にかかった秒数
+_locks = {}  # 名前 -> 生成用ロック
+_locks_lock = threading.Lock()
+
+
+def _get_or_create(name, factory):
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+
+    with _locks_lock:
+        lock = _locks.setdefault(name, threading.Lock())
+    with lock:
+        # 別スレッドが生成済みの場合はそれを使う
+        instance = _instances.get(name)
+        if instance is None:
+            started = time.perf_counter()
+            instance = factory()
+            _init_seconds[name] = time.perf_counter() - started
+            _instances[name] = instance
+            logging.info(f"Client '{name}' initialized in {_init_seconds[name]:.4f}s")
+    return instance
+
+
+def ensure_firebase_app():
+    """Firebase Admin SDKを初期化（済みなら何もしない）"""
+    import firebase_admin
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app()
+
+
+def _create_firestore():
+    ensure_firebase_app()
+    from firebase_admin import firestore
+    return firestore.client()
+
+
+def _create_storage():
+    from google.cloud import storage
+    return storage.Client()
+
+
+def _create_tts():
+    from google.cloud import texttospeech
+    return texttospeech.TextToSpeechClient()
+
+
+def _init_vertexai():
+    import vertexai
+    # Cloud Functionsのデプロイリージョンとは別にVertex AIの処理リージョンを指定
+    vertexai.init(project=PROJECT, location=GEMINI_LOCATION)
+    return True
+
+
+def _create_generative_model(model_name):
+    init_vertexai()
+    from vertexai.generative_models import GenerativeModel
+    return GenerativeModel(model_name)
+
+
+# 名前 -> 生成関数（use_factories で差し替えられる）
+_factories = {
+    "firestore": _create_firestore,
+    "storage": _create_storage,
+    "texttospeech": _create_tts,
+    "vertexai": _init_vertexai,
+    "generative_model": _create_generative_model,
+}
+
+
+def use_factories(**factories):
+    """
+    クライアントの生成関数を差し替える（fake_backends などのローカル実行用）
+
+    生成済みのクライアントは破棄され、次の利用時に新しい生成関数で作り直される。
+    モジュールが GenerativeModel などを import 時に束縛する場合に備え、main などの import 前に呼ぶこと
+    """
+    unknown = set(factories) - set(_factories)
+    if unknown:
+        raise ValueError(f"Unknown client factories: {sorted(unknown)}")
+    with _locks_lock:
+        _factories.update(factories)
+        for name in list(_instances):
+            base = "generative_model" if name.startswith("model:") else name
+            if base in factories:
+                del _instances[name]
+                _init_seconds.pop(name, None)
+
+
+def get_firestore():
+    """共有のFirestoreクライアント"""
+    return _get_or_create("firestore", _factories["firestore"])
+
+
+def get_storage_client():
+    """共有のCloud Storageクライアント"""
+    return _get_or_create("storage", _factories["storage"])
+
+
+def get_tts_client():
+    """共有のText-to-Speechクライアント"""
+    return _get_or_create("texttospeech", _factories["texttospeech"])
+
+
+def init_vertexai():
+    """vertexai.init を1度だけ実行（GenerativeModel を直接作るモジュール用）"""
+    _get_or_create("vertexai", _factories["vertexai"])
+
+
+def get_generative_model(model_name=GEMINI_MODEL):
+    """モデル名ごとに共有のGenerativeModel（初回に vertexai.init も行う）"""
+    return _get_or_create(f"model:{model_name}", lambda: _factories["generative_model"](model_name))
+
+
+class LazyClient:
+    """
+    属性に初めて触れたときにクライアントを生成するプロキシ
+
+    モジュール変数として `db = LazyClient(get_firestore)` のように置き、
+    既存の `db.collection(...)` などの呼び出しをそのまま使えるようにする
+    """
+
+    def __init__(self, getter):
+        self._getter = getter
+
+    def __getattr__(self, name):
+        return getattr(self._getter(), name)
+
+
+# Firestore client（各モジュールは `from clients import db` で共有する）
+db = LazyClient(get_firestore)
+
+
+def stats():
+    """生成済みのクライアントと生成にかかった時間"""
+    return {
+        "initialized": sorted(_instances),
+        "init_seconds": dict(_init_seconds)
+    }
@@ -14,7 +14,21 @@ gcloud config set project $PROJECT_ID
 
 # 共通オプション
 COMMON_OPTS="--runtime $RUNTIME --region $REGION --memory 1GB --timeout 60s --trigger-http --allow-unauthenticated --no-gen2"
-ENV_VARS="UPLOAD_BUCKET=${PROJECT_ID}.appspot.com,GEMINI_LOCATION=us-central1,GEMINI_MODEL=gemini-2.0-flash-001"
+ENV_VARS="UPLOAD_BUCKET=${PROJECT_ID}.appspot.com,STORAGE_BUCKET=${PROJECT_ID}.appspot.com,GEMINI_LOCATION=us-central1,GEMINI_MODEL=gemini-2.0-flash-001"
+
+# 書き起こし・Guardian分析キャッシュの期限切れドキュメントを自動削除する（TTLポリシー）
+gcloud firestore fields ttls update expires_at \
+  --collection-group=transcript_cache --enable-ttl --async \
+  || echo "⚠️  Failed to enable TTL policy for transcript_cache"
+gcloud firestore fields ttls update expires_at \
+  --collection-group=guardian_cache --enable-ttl --async \
+  || echo "⚠️  Failed to enable TTL policy for guardian_cache"
+
+# 固定フレーズの音声を事前合成し、マニフェストを関数に同梱する
+echo ""
+echo "🔊 Pre-synthesizing static phrases..."
+STORAGE_BUCKET=${PROJECT_ID}.appspot.com python prewarm_tts.py \
+  || echo "⚠️  TTS prewarm failed; continuing without manifest"
 
 echo ""
 echo "1️⃣ Deploying transcribe..."
@@ -23,12 +23,14 @@ FUNCTIONS=(
   "get_drinks_master"
   "add_drink"
   "start_session"
+  "end_session"
   "get_current_session"
   "guardian_check"
   "bartender"
   "guardian_monitor"
   "drinking_coach_analyze"
   "tts"
+  "tts_audio"
 )
 
 # デプロイ実行
@@ -2,14 +2,23 @@ import json
 import logging
 import os
 from datetime import datetime, timezone
-import hashlib
 import random
 from datetime import timedelta
 
 import functions_framework
 import firebase_admin
-from firebase_admin import auth, firestore
-from google.cloud import texttospeech, storage
+from firebase_admin import firestore
+
+from async_runner import run_stages
+from phrases import (
+    PARTY_BASE_MESSAGES,
+    PARTY_CONTEXT_MESSAGES,
+    PARTY_FIRST_DRINK_MESSAGES,
+    PARTY_LEVEL_MESSAGES,
+    format_phrase,
+)
+from tts_cache import get_audio_url
+from tts_jobs import submit_speech
 
 # Initialize Firebase Admin SDK
 if not firebase_admin._apps:
@@ -19,16 +28,11 @@ if not firebase_admin._apps:
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 logging.basicConfig(level=LOG_LEVEL)
 
-# Firestore client
-db = firestore.client()
-
-# Cloud Storage設定
-BUCKET_NAME = os.getenv("STORAGE_BUCKET", "alco-guardian.appspot.com")
-storage_client = storage.Client()
-bucket = storage_client.bucket(BUCKET_NAME)
+# セッション解決・集計（Firebase初期化後に読み込む）
+from auth_cache import get_user_id
+from active_session import record_drink_in_active_session
 
-# TTS設定
-tts_client = texttospeech.TextToSpeechClient()
+# TTS設定（クライアントとバケットは tts_cache で共有）
 VOICE_NAME = "ja-JP-Neural2-B"  # 日本語男性音声
 
 
@@ -44,72 +48,6 @@ def add_cors_headers(response_data, status_code, content_type="application/json"
     return (response_data, status_code, headers)
 
 
-def get_user_id(request):
-    """Extract user ID from request (mock for hackathon)"""
-    # For hackathon, use anonymous ID if no auth
-    auth_header = request.headers.get('Authorization', '')
-    if auth_header.startswith('Bearer '):
-        try:
-            token = auth_header.split('Bearer ')[1]
-            decoded = auth.verify_id_token(token)
-            return decoded['uid']
-        except:
-            pass
-    
-    # Return demo user for hackathon
-    return "demo_user_001"
-
-
-def synthesize_speech(text, voice_name=VOICE_NAME):
-    """テキストを音声に変換"""
-    synthesis_input = texttospeech.SynthesisInput(text=text)
-    
-    voice = texttospeech.VoiceSelectionParams(
-        language_code="ja-JP",
-        name=voice_name
-    )
-    
-    audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.MP3,
-        speaking_rate=1.0,
-        pitch=0.0
-    )
-    
-    response = tts_client.synthesize_speech(
-        input=synthesis_input,
-        voice=voice,
-        audio_config=audio_config
-    )
-    
-    return response.audio_content
-
-
-def upload_audio_to_storage(audio_content, filename):
-    """音声データをCloud Storageにアップロード"""
-    blob = bucket.blob(filename)
-    
-    # 既存チェック
-    if blob.exists():
-        logging.info(f"Audio file already exists: {filename}")
-        blob.make_public()
-        return blob.public_url
-    
-    # アップロード
-    blob.upload_from_string(
-        audio_content,
-        content_type="audio/mpeg"
-    )
-    
-    # キャッシュ設定
-    blob.cache_control = "public, max-age=86400"
-    blob.patch()
-    
-    # 公開設定
-    blob.make_public()
-    
-    return blob.public_url
-
-
 def get_image_id_from_context(drink_type, alcohol_g, guardian_level):
     """コンテキストに基づいて画像IDを決定"""
     # 画像IDマッピング
@@ -137,105 +75,38 @@ def get_image_id_from_context(drink_type, alcohol_g, guardian_level):
 
 
 def generate_party_style_message(drink_type, volume, guardian_result, session_stats, conversation_context=None):
-    """飲み会風の応答メッセージを生成"""
+    """飲み会風の応答メッセージを生成（テンプレートは phrases.py）"""
     
     # 会話コンテキストを考慮
     if conversation_context and conversation_context.get("message"):
         user_msg = conversation_context["message"].lower()
         
         # ユーザーの発言に応じたカスタマイズ
-        if "つかれ" in user_msg or "疲れ" in user_msg:
-            return f"お疲れ様！{drink_type}でリフレッシュだね！{volume}ml記録したよ〜"
-        elif "楽し" in user_msg or "最高" in user_msg:
-            return f"イェーイ！その調子！{drink_type}{volume}mlでさらに盛り上がろう！"
-        elif "おかわり" in user_msg or "もう一杯" in user_msg:
-            return f"おかわりきた〜！{drink_type}{volume}mlいっちゃう？いいね〜！"
-    base_messages = [
-        f"おっ！{drink_type}いいね〜！{volume}mlね、記録したよ！",
-        f"{drink_type}キター！{volume}ml追加っと！",
-        f"いえーい！{drink_type}{volume}ml入りました〜！",
-        f"よっしゃ！{drink_type}で乾杯〜！{volume}ml記録！"
-    ]
+        for keywords, template in PARTY_CONTEXT_MESSAGES:
+            if any(keyword in user_msg for keyword in keywords):
+                return format_phrase(template, drink_type, volume)
     
     level_color = guardian_result.get("level", {}).get("color", "green")
     
-    if level_color == "red":
-        return random.choice([
-            f"{drink_type}{volume}ml...って、ちょっと待って！今日はもう結構飲んでるよ？水飲も水！",
-            f"おーい、{drink_type}はちょっとストップ！今は水タイムにしよ？体大事だよ〜",
-            f"ま、まてまて！{drink_type}より水がいいって！明日のこと考えよ？"
-        ])
-    elif level_color == "orange":
-        return random.choice([
-            f"{drink_type}{volume}mlね...そろそろペース落とさない？楽しく飲もうぜ〜",
-            f"お、{drink_type}か〜。でもちょっとペース早くない？ゆっくり楽しもう！",
-            f"{volume}mlっと...今日は長く楽しみたいよね？ちょっと休憩入れよ！"
-        ])
-    elif level_color == "yellow":
-        return random.choice([
-            f"{drink_type}いいね！でも{volume}mlの後は、ちょっと水も飲んどこ？",
-            f"おっけー{drink_type}{volume}ml！いいペースだけど、無理しないでね〜",
-            f"{drink_type}記録！でもそろそろつまみも食べよ？胃に優しくね！"
-        ])
+    if level_color in PARTY_LEVEL_MESSAGES:
+        templates = PARTY_LEVEL_MESSAGES[level_color]
     else:
         # 飲み始めかペースが良い時
         total_drinks = session_stats.get("total_drinks", 0)
-        if total_drinks == 0:
-            return random.choice([
-                f"今日の一杯目！{drink_type}で乾杯〜！楽しい夜にしようぜ！",
-                f"よーし飲み会スタート！{drink_type}{volume}mlからいくぞ〜！",
-                f"待ってました！{drink_type}で始まり始まり〜！"
-            ])
-        else:
-            return random.choice(base_messages)
+        templates = PARTY_FIRST_DRINK_MESSAGES if total_drinks == 0 else PARTY_BASE_MESSAGES
+    
+    return format_phrase(random.choice(templates), drink_type, volume)
 
 
 def generate_audio_response(text, voice_name=VOICE_NAME):
     """テキストから音声URLを生成（キャッシュ対応）"""
-    # ファイル名をハッシュで生成
-    content_hash = hashlib.md5(f"{text}_{voice_name}".encode()).hexdigest()
-    filename = f"tts/{voice_name}/{content_hash}.mp3"
-    
-    # Cloud Storageに既存チェック
-    blob = bucket.blob(filename)
-    if blob.exists():
-        logging.info(f"Using cached audio: {filename}")
-        blob.make_public()
-        return blob.public_url
-    
-    # 新規生成
     try:
-        audio_content = synthesize_speech(text, voice_name)
-        audio_url = upload_audio_to_storage(audio_content, filename)
-        return audio_url
+        return get_audio_url(text, voice_name)
     except Exception as e:
         logging.error(f"TTS generation error: {e}")
         return None
 
 
-def get_or_create_session(user_id):
-    """Get active session or create new one"""
-    sessions_ref = db.collection('users').document(user_id).collection('sessions')
-    
-    # Check for active session
-    active_sessions = sessions_ref.where('status', '==', 'active').limit(1).get()
-    
-    if active_sessions:
-        return active_sessions[0].id
-    
-    # Create new session
-    session_data = {
-        'start_time': firestore.SERVER_TIMESTAMP,
-        'end_time': None,
-        'total_alcohol_g': 0,
-        'status': 'active',
-        'guardian_warnings': []
-    }
-    
-    doc_ref = sessions_ref.add(session_data)
-    return doc_ref[1].id
-
-
 @functions_framework.http
 def drink(request):
     """飲酒記録エンドポイント（フロントエンド仕様対応）"""
@@ -312,9 +183,6 @@ def drink(request):
         # 純アルコール量（g）= 飲酒量(ml) × アルコール度数(%) ÷ 100 × 0.8
         alcohol_g = volume * (alcohol_percentage / 100) * 0.8
         
-        # セッション取得または作成
-        session_id = get_or_create_session(user_id)
-        
         # 飲酒記録をFirestoreに保存
         drink_record = {
             'drink_type': drink_type,
@@ -324,49 +192,22 @@ def drink(request):
             'timestamp': firestore.SERVER_TIMESTAMP
         }
         
-        # Firestore に記録
-        session_ref = db.collection('users').document(user_id).collection('sessions').document(session_id)
-        drinks_ref = session_ref.collection('drinks')
-        doc_ref = drinks_ref.add(drink_record)
-        drink_id = doc_ref[1].id
-        
-        # セッションの総アルコール量を更新
-        session_ref.update({
-            'total_alcohol_g': firestore.Increment(alcohol_g)
-        })
+        # アクティブなセッション（なければ作成）に記録（セッション集計も同じトランザクションで更新）
+        session_id, drink_id, aggregate = record_drink_in_active_session(user_id, drink_record)
         
-        # セッション統計を取得（応答生成用）
-        session_data = session_ref.get().to_dict()
-        drinks_count = len(list(drinks_ref.stream()))
+        # セッション統計（応答生成用）
         session_stats = {
-            "total_alcohol_g": session_data.get("total_alcohol_g", alcohol_g),
-            "total_drinks": drinks_count,
-            "start_time": session_data.get("start_time")
+            "total_alcohol_g": aggregate["total_alcohol_g"],
+            "total_drinks": aggregate["drink_count"],
+            "start_time": aggregate["start_time"]
         }
         
-        # 会話履歴をFirestoreに保存
-        if user_message:
-            conversation_record = {
-                "timestamp": firestore.SERVER_TIMESTAMP,
-                "user_message": user_message,
-                "drink_context": {
-                    "drink_type": drink_type,
-                    "volume": volume,
-                    "alcohol_g": alcohol_g
-                }
-            }
-            
-            # 会話履歴コレクションに追加
-            conversation_ref = session_ref.collection('conversations')
-            conversation_ref.add(conversation_record)
-        
         # Guardian分析を実行
         guardian_result = None
         coach_analysis = None
         try:
             from agents.a2a_broker import get_broker, Message
-            from agents.guardian_adk import create_guardian_service
-            from agents.drinking_coach_agent import create_drinking_coach
+            from agents.registry import get_drinking_coach, get_guardian_service
             
             broker = get_broker()
             
@@ -383,23 +224,24 @@ def drink(request):
                 }
             )
             
-            # 同期的に実行
-            import asyncio
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(broker.publish(drink_added_msg))
+            guardian = get_guardian_service()
+            coach = get_drinking_coach()
             
-            # Guardian分析を実行
-            guardian = create_guardian_service()
-            guardian_result = loop.run_until_complete(
-                guardian.analyze_drinking_pattern(user_id, session_id)
-            )
+            # A2A発行・Guardian分析・Coach分析は互いに独立しているため共有ループで並行実行
+            # （Guardian・Coachには記録時の集計を渡して再読み込みを省く）
+            results = run_stages({
+                "broker": broker.publish(drink_added_msg),
+                "guardian": guardian.analyze_drinking_pattern(user_id, session_id, stats=aggregate),
+                "coach": coach.analyze_drinking_session(user_id, session_id, stats=aggregate)
+            })
             
-            # Drinking Coach分析も実行
-            coach = create_drinking_coach()
-            coach_analysis = loop.run_until_complete(
-                coach.analyze_drinking_session(user_id, session_id)
-            )
+            coach_analysis = results["coach"]
+            if isinstance(coach_analysis, Exception):
+                coach_analysis = {"success": False, "error": str(coach_analysis)}
+            
+            guardian_result = results["guardian"]
+            if isinstance(guardian_result, Exception):
+                raise guardian_result
         except Exception as e:
             logging.error(f"ADK Guardian error: {e}")
             # Guardian分析エラーでも飲酒記録は成功とする
@@ -407,17 +249,22 @@ def drink(request):
                 "level": {"color": "green", "message": "監視中"},
                 "analysis": "Guardian分析でエラーが発生しました"
             }
-            coach_analysis = {"success": False, "error": str(e)}
+            if coach_analysis is None:
+                coach_analysis = {"success": False, "error": str(e)}
         
         # 飲み会風のレスポンスメッセージを生成
         response_message = generate_party_style_message(
             drink_type, volume, guardian_result, session_stats, conversation_context
         )
         
-        # 音声レスポンスを生成
+        # 音声レスポンスを生成（ttsMode="deferred" なら音声は /tts_audio で後から取得）
         audio_url = None
+        audio_job = None
         try:
-            audio_url = generate_audio_response(response_message)
+            if request_json.get("ttsMode", "sync") == "deferred":
+                audio_job = submit_speech(response_message, VOICE_NAME)
+            else:
+                audio_url = generate_audio_response(response_message)
         except Exception as e:
             logging.error(f"Audio generation error: {e}")
             # 音声生成エラーでも処理は継続
@@ -461,20 +308,25 @@ def drink(request):
         # 音声URLがある場合は追加
         if audio_url:
             response_data["audioUrl"] = audio_url
+        if audio_job:
+            response_data.update(audio_job)
         
-        # 会話履歴にレスポンスを記録
+        # 会話履歴に発話と応答を1ターンとして記録（Firestoreへはライトビハインド）
         if user_message and response_message:
-            # レスポンスも保存
             try:
-                response_record = {
-                    "timestamp": firestore.SERVER_TIMESTAMP,
-                    "agent_message": response_message,
-                    "agent_type": "bartender",
-                    "image_id": image_id,
-                    "guardian_level": guardian_result.get("level", {}).get("color", "green")
-                }
-                conversation_ref = session_ref.collection('conversations')
-                conversation_ref.add(response_record)
+                from agents.conversation_memory import get_conversation_memory
+                get_conversation_memory().append(
+                    user_id, session_id, user_message, response_message,
+                    extra={
+                        "drink_context": {
+                            "drink_type": drink_type,
+                            "volume": volume,
+                            "alcohol_g": alcohol_g
+                        },
+                        "image_id": image_id,
+                        "guardian_level": guardian_result.get("level", {}).get("color", "green")
+                    }
+                )
             except Exception as e:
                 logging.warning(f"Failed to save response to conversation history: {e}")
         
@@ -0,0 +1,960 @@
+"""
+Fake Backends - Firestore・Cloud Storage・Text-to-Speech・Gemini のインメモリ実装
+main.py / drink.py / tts.py などの実ハンドラをそのまま動かし、ネットワークなしで負荷試験するために使う。
+各バックエンドは遅延とエラー率を注入できる（環境変数 FAKE_<BACKEND>_LATENCY_MS / _JITTER_MS / _ERROR_RATE）
+
+    from fake_backends import install_fake_backends
+    install_fake_backends()   # main などを import する前に呼ぶ
+    import main
+"""
+import asyncio
+import copy
+import hashlib
+import importlib.abc
+import importlib.util
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    from google.api_core.exceptions import AlreadyExists, Aborted, NotFound, ServiceUnavailable
+except ImportError:
+    class AlreadyExists(Exception):
+        pass
+
+    class Aborted(Exception):
+        pass
+
+    class NotFound(Exception):
+        pass
+
+    class ServiceUnavailable(Exception):
+        pass
+
+FAKE_USER_ID = os.getenv("FAKE_USER_ID", "local-user")
+FAKE_GEMINI_REPLY = os.getenv("FAKE_GEMINI_REPLY", "いらっしゃいませ。今日はゆっくり楽しみましょう。")
+# ストリーミング時の1チャンクの文字数と間隔
+FAKE_GEMINI_CHUNK_CHARS = int(os.getenv("FAKE_GEMINI_CHUNK_CHARS", "8"))
+FAKE_GEMINI_CHUNK_MS = float(os.getenv("FAKE_GEMINI_CHUNK_MS", "0"))
+FAKE_BUCKET_URL = "https://storage.googleapis.com"
+# main.py の transcribe が import 時に読むアップロード先（未設定だと500を返す）
+FAKE_UPLOAD_BUCKET = "test-bucket"
+# トランザクションの競合時の再試行回数（実際の Firestore と同じ）
+TRANSACTION_MAX_ATTEMPTS = 5
+
+
+# ---------- 遅延・エラーの注入 ----------
+
+_call_counts = threading.local()
+
+
+@contextmanager
+def count_calls():
+    """
+    このスレッドで発生したバックエンド呼び出しをバックエンド名ごとに数える（負荷試験のリクエスト単位の集計用）
+
+    バックグラウンドのスレッド（音声合成ジョブ・共有イベントループ）での呼び出しは含まれない
+    """
+    previous = getattr(_call_counts, "counts", None)
+    counts = {}
+    _call_counts.counts = counts
+    try:
+        yield counts
+    finally:
+        _call_counts.counts = previous
+
+
+class FaultInjector:
+    """呼び出しごとに遅延を入れ、一定の確率でエラーを発生させる"""
+
+    def __init__(self, name, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=None):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "injected_errors": 0}
+
+    @classmethod
+    def from_env(cls, name):
+        prefix = f"FAKE_{name.upper()}"
+        seed = os.getenv("FAKE_BACKEND_SEED")
+        return cls(
+            name,
+            latency_ms=float(os.getenv(f"{prefix}_LATENCY_MS", "0")),
+            jitter_ms=float(os.getenv(f"{prefix}_JITTER_MS", "0")),
+            error_rate=float(os.getenv(f"{prefix}_ERROR_RATE", "0")),
+            seed=f"{seed}:{name}" if seed is not None else None
+        )
+
+    def _draw(self):
+        """この呼び出しの遅延（ミリ秒）と失敗するかどうかを決める"""
+        counts = getattr(_call_counts, "counts", None)
+        if counts is not None:
+            counts[self.name] = counts.get(self.name, 0) + 1
+        with self._lock:
+            self._counters["calls"] += 1
+            delay_ms = self.latency_ms + (self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            if failed:
+                self._counters["injected_errors"] += 1
+        return delay_ms, failed
+
+    def inject(self, operation):
+        """遅延を入れ、エラー率に応じて ServiceUnavailable を送出する"""
+        delay_ms, failed = self._draw()
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+        if failed:
+            raise ServiceUnavailable(f"Injected {self.name} failure: {operation}")
+
+    async def inject_async(self, operation):
+        """inject のコルーチン版（イベントループを止めずに待つ）"""
+        delay_ms, failed = self._draw()
+        if delay_ms > 0:
+            await asyncio.sleep(delay_ms / 1000)
+        if failed:
+            raise ServiceUnavailable(f"Injected {self.name} failure: {operation}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counters,
+                "latency_ms": self.latency_ms,
+                "jitter_ms": self.jitter_ms,
+                "error_rate": self.error_rate
+            }
+
+
+# ---------- Firestore ----------
+
+class _Sentinel:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+SERVER_TIMESTAMP = _Sentinel("SERVER_TIMESTAMP")
+DELETE_FIELD = _Sentinel("DELETE_FIELD")
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class ArrayRemove:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class FieldFilter:
+    def __init__(self, field_path, op_string, value=None):
+        self.field_path = field_path
+        self.op_string = op_string
+        self.value = value
+
+
+class Query:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+
+_MISSING = object()
+
+
+def _get_field(data, field_path):
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _resolve(value, current, now):
+    """書き込み値の変換（SERVER_TIMESTAMP・Increment など）を解決する"""
+    if value is SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        return base + value.value
+    if isinstance(value, ArrayUnion):
+        merged = list(current) if isinstance(current, list) else []
+        merged.extend(v for v in value.values if v not in merged)
+        return merged
+    if isinstance(value, ArrayRemove):
+        return [v for v in current if v not in value.values] if isinstance(current, list) else []
+    if isinstance(value, dict):
+        base = current if isinstance(current, dict) else {}
+        return {k: _resolve(v, base.get(k), now) for k, v in value.items() if v is not DELETE_FIELD}
+    if isinstance(value, (list, tuple)):
+        return [_resolve(v, None, now) for v in value]
+    return copy.deepcopy(value)
+
+
+def _merge(target, data, now):
+    """set(merge=True): ネストした辞書は再帰的にマージする"""
+    for key, value in data.items():
+        if value is DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            child = target.get(key)
+            if not isinstance(child, dict):
+                child = target[key] = {}
+            _merge(child, value, now)
+        else:
+            target[key] = _resolve(value, target.get(key), now)
+
+
+def _update(target, data, now):
+    """update(): キーはドット区切りのフィールドパス"""
+    for field_path, value in data.items():
+        parts = field_path.split(".")
+        parent = target
+        for part in parts[:-1]:
+            if not isinstance(parent.get(part), dict):
+                parent[part] = {}
+            parent = parent[part]
+        if value is DELETE_FIELD:
+            parent.pop(parts[-1], None)
+        else:
+            parent[parts[-1]] = _resolve(value, parent.get(parts[-1]), now)
+
+
+def _matches(data, field_path, op, expected):
+    value = _get_field(data, field_path)
+    if value is _MISSING:
+        return False
+    try:
+        if op == "==":
+            return value == expected
+        if op == "!=":
+            return value != expected
+        if op == "<":
+            return value < expected
+        if op == "<=":
+            return value <= expected
+        if op == ">":
+            return value > expected
+        if op == ">=":
+            return value >= expected
+        if op == "in":
+            return value in expected
+        if op == "not-in":
+            return value not in expected
+        if op == "array_contains":
+            return isinstance(value, list) and expected in value
+        if op == "array_contains_any":
+            return isinstance(value, list) and any(v in value for v in expected)
+    except TypeError:
+        # 型の違う値同士の比較は一致しない扱い
+        return False
+    raise ValueError(f"Unsupported operator: {op}")
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None, version=0):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self._version = version  # 読み取り時点のバージョン（トランザクションの競合検出用）
+        self.create_time = create_time
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = _get_field(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class _BaseQuery:
+    def __init__(self, client, path, filters=(), orders=(), limit=None, offset=0):
+        self._client = client
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._offset = offset
+
+    def _copy(self, **changes):
+        state = {
+            "filters": self._filters, "orders": self._orders,
+            "limit": self._limit, "offset": self._offset
+        }
+        state.update(changes)
+        return _BaseQuery(self._client, self._path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=Query.ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, str(direction).upper() == Query.DESCENDING),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def offset(self, count):
+        return self._copy(offset=count)
+
+    def _run(self, transaction=None):
+        snapshots = self._client._query(self._path, self._filters, self._orders, self._limit, self._offset)
+        if transaction is not None:
+            transaction._record_reads(snapshots)
+        return snapshots
+
+    def stream(self, transaction=None):
+        self._client.faults.inject("query")
+        return iter(self._run(transaction))
+
+    def get(self, transaction=None):
+        self._client.faults.inject("query")
+        return self._run(transaction)
+
+
+class CollectionReference(_BaseQuery):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path.rsplit("/", 1)[-1]
+        self.path = path
+
+    @property
+    def parent(self):
+        if "/" not in self.path:
+            return None
+        return DocumentReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, f"{self.path}/{document_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return datetime.now(timezone.utc), ref
+
+    def list_documents(self):
+        return [self.document(doc_id) for doc_id in self._client._document_ids(self.path)]
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit("/", 1)[0])
+
+    def collection(self, collection_id):
+        return CollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def get(self, field_paths=None, transaction=None):
+        self._client.faults.inject("get")
+        snapshot = self._client._snapshot(self.path)
+        if transaction is not None:
+            transaction._record_reads([snapshot])
+        return snapshot
+
+    def set(self, document_data, merge=False):
+        return self._client._write_now(("set", self.path, document_data, merge))
+
+    def update(self, field_updates):
+        return self._client._write_now(("update", self.path, field_updates, False))
+
+    def create(self, document_data):
+        return self._client._write_now(("create", self.path, document_data, False))
+
+    def delete(self):
+        return self._client._write_now(("delete", self.path, None, False))
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("set", reference.path, document_data, merge))
+        return self
+
+    def update(self, reference, field_updates):
+        self._writes.append(("update", reference.path, field_updates, False))
+        return self
+
+    def create(self, reference, document_data):
+        self._writes.append(("create", reference.path, document_data, False))
+        return self
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference.path, None, False))
+        return self
+
+    def commit(self):
+        self._client.faults.inject("commit")
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+
+class Transaction(WriteBatch):
+    """楽観的トランザクション（読み取ったドキュメントがコミット前に更新されていたら再試行）"""
+
+    def __init__(self, client):
+        super().__init__(client)
+        self.id = uuid.uuid4().hex
+        self._read_versions = {}
+
+    def _record_reads(self, snapshots):
+        for snapshot in snapshots:
+            self._read_versions.setdefault(snapshot.reference.path, snapshot._version)
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, DocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def _reset(self):
+        self._writes = []
+        self._read_versions = {}
+
+    def _commit_transaction(self):
+        self._client.faults.inject("commit")
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes, self._read_versions)
+
+
+def transactional(to_wrap):
+    """@firestore.transactional の代わり（競合時は最大 TRANSACTION_MAX_ATTEMPTS 回再試行）"""
+    def wrapper(transaction, *args, **kwargs):
+        for attempt in range(TRANSACTION_MAX_ATTEMPTS):
+            transaction._reset()
+            result = to_wrap(transaction, *args, **kwargs)
+            try:
+                transaction._commit_transaction()
+                return result
+            except Aborted:
+                if attempt == TRANSACTION_MAX_ATTEMPTS - 1:
+                    raise
+        return None
+    return wrapper
+
+
+class FakeFirestore:
+    """Firestore クライアントのインメモリ実装（コレクション・クエリ・バッチ・トランザクション）"""
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector.from_env("firestore")
+        self._lock = threading.Lock()
+        self._docs = {}  # ドキュメントパス -> データ
+        self._meta = {}  # ドキュメントパス -> (version, create_time, update_time)
+        self._children = {}  # コレクションパス -> {ドキュメントID}
+        self._clock = 0  # 書き込みごとに増えるバージョン
+
+    # ---------- 公開API ----------
+
+    def collection(self, *path):
+        return CollectionReference(self, "/".join(path))
+
+    def document(self, *path):
+        return DocumentReference(self, "/".join(path))
+
+    def collections(self):
+        with self._lock:
+            return [CollectionReference(self, path) for path in self._children if "/" not in path]
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        return [ref.get(transaction=transaction) for ref in references]
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return Transaction(self)
+
+    def stats(self):
+        with self._lock:
+            documents = len(self._docs)
+        return {"documents": documents, **self.faults.stats()}
+
+    # ---------- 内部 ----------
+
+    def _snapshot(self, path):
+        with self._lock:
+            data = self._docs.get(path)
+            meta = self._meta.get(path)
+            snapshot_data = copy.deepcopy(data) if data is not None else None
+        return DocumentSnapshot(
+            DocumentReference(self, path), snapshot_data,
+            create_time=meta[1] if meta and data is not None else None,
+            update_time=meta[2] if meta and data is not None else None,
+            version=meta[0] if meta else 0
+        )
+
+    def _document_ids(self, collection_path):
+        with self._lock:
+            return sorted(self._children.get(collection_path, ()))
+
+    def _query(self, collection_path, filters, orders, limit, offset):
+        with self._lock:
+            rows = []
+            for doc_id in self._children.get(collection_path, ()):
+                path = f"{collection_path}/{doc_id}"
+                data = self._docs[path]
+                if all(_matches(data, field, op, value) for field, op, value in filters):
+                    rows.append((path, copy.deepcopy(data), self._meta[path]))
+
+        for field_path, descending in reversed(orders):
+            # 並べ替えのフィールドを持たないドキュメントは結果に含まれない
+            rows = [row for row in rows if _get_field(row[1], field_path) is not _MISSING]
+            try:
+                rows.sort(key=lambda row: _get_field(row[1], field_path), reverse=descending)
+            except TypeError:
+                rows.sort(key=lambda row: str(_get_field(row[1], field_path)), reverse=descending)
+        if not orders:
+            rows.sort(key=lambda row: row[0])
+        rows = rows[offset:]
+        if limit is not None:
+            rows = rows[:limit]
+        return [
+            DocumentSnapshot(DocumentReference(self, path), data,
+                             create_time=meta[1], update_time=meta[2], version=meta[0])
+            for path, data, meta in rows
+        ]
+
+    def _write_now(self, write):
+        self.faults.inject(write[0])
+        return self._commit([write])[0]
+
+    def _commit(self, writes, read_versions=None):
+        """書き込みをまとめて適用する（前提条件の確認が全て通った場合のみ反映）"""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            for path, version in (read_versions or {}).items():
+                meta = self._meta.get(path)
+                if (meta[0] if meta else 0) != version:
+                    raise Aborted(f"Transaction conflict on {path}")
+
+            staged = {}
+            for kind, path, data, merge in writes:
+                current = staged[path] if path in staged else self._docs.get(path)
+                if kind == "create":
+                    if current is not None:
+                        raise AlreadyExists(f"Document already exists: {path}")
+                    staged[path] = _resolve(data, None, now)
+                elif kind == "set":
+                    if merge and current is not None:
+                        updated = copy.deepcopy(current)
+                        _merge(updated, data, now)
+                        staged[path] = updated
+                    else:
+                        staged[path] = _resolve(data, None, now)
+                elif kind == "update":
+                    if current is None:
+                        raise NotFound(f"No document to update: {path}")
+                    updated = copy.deepcopy(current)
+                    _update(updated, data, now)
+                    staged[path] = updated
+                elif kind == "delete":
+                    staged[path] = None
+
+            for path, data in staged.items():
+                self._clock += 1
+                collection_path, doc_id = path.rsplit("/", 1)
+                if data is None:
+                    self._docs.pop(path, None)
+                    self._meta[path] = (self._clock, None, now)
+                    self._children.get(collection_path, set()).discard(doc_id)
+                else:
+                    previous = self._meta.get(path)
+                    created = previous[1] if previous and previous[1] and path in self._docs else now
+                    self._docs[path] = data
+                    self._meta[path] = (self._clock, created, now)
+                    self._children.setdefault(collection_path, set()).add(doc_id)
+        return [now for _ in writes]
+
+
+# ---------- Cloud Storage ----------
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.cache_control = None
+        self.content_type = None
+        self.size = None
+
+    @property
+    def public_url(self):
+        return f"{FAKE_BUCKET_URL}/{self.bucket.name}/{self.name}"
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket._faults.inject("upload")
+        if isinstance(data, str):
+            data = data.encode()
+        self.content_type = content_type
+        self.size = len(data)
+        self.bucket._put(self.name, bytes(data), content_type, self.cache_control)
+
+    def download_as_bytes(self):
+        self.bucket._faults.inject("download")
+        data = self.bucket._get(self.name)
+        if data is None:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        return data
+
+    def exists(self):
+        self.bucket._faults.inject("exists")
+        return self.bucket._get(self.name) is not None
+
+    def make_public(self):
+        self.bucket._faults.inject("make_public")
+
+    def delete(self):
+        self.bucket._faults.inject("delete")
+        self.bucket._delete(self.name)
+
+
+class FakeBucket:
+    def __init__(self, name, faults):
+        self.name = name
+        self._faults = faults
+        self._objects = {}  # オブジェクト名 -> (データ, content_type, cache_control)
+        self._lock = threading.Lock()
+
+    def blob(self, blob_name):
+        return FakeBlob(self, blob_name)
+
+    def get_blob(self, blob_name):
+        self._faults.inject("get_blob")
+        with self._lock:
+            entry = self._objects.get(blob_name)
+        if entry is None:
+            return None
+        blob = FakeBlob(self, blob_name)
+        blob.size, blob.content_type, blob.cache_control = len(entry[0]), entry[1], entry[2]
+        return blob
+
+    def list_blobs(self, prefix=None):
+        self._faults.inject("list_blobs")
+        with self._lock:
+            names = sorted(name for name in self._objects if not prefix or name.startswith(prefix))
+        return [self.get_blob(name) for name in names]
+
+    def _put(self, name, data, content_type, cache_control):
+        with self._lock:
+            self._objects[name] = (data, content_type, cache_control)
+
+    def _get(self, name):
+        with self._lock:
+            entry = self._objects.get(name)
+        return entry[0] if entry else None
+
+    def _delete(self, name):
+        with self._lock:
+            self._objects.pop(name, None)
+
+
+class FakeStorageClient:
+    """Cloud Storage クライアントのインメモリ実装（バケットはプロセス内で共有）"""
+
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector.from_env("storage")
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, bucket_name):
+        with self._lock:
+            if bucket_name not in self._buckets:
+                self._buckets[bucket_name] = FakeBucket(bucket_name, self.faults)
+            return self._buckets[bucket_name]
+
+    def stats(self):
+        with self._lock:
+            objects = sum(len(bucket._objects) for bucket in self._buckets.values())
+        return {"objects": objects, **self.faults.stats()}
+
+
+# ---------- Text-to-Speech ----------
+
+# MPEG-1 Layer III 128kbps 44.1kHz のフレーム（約26ms、417バイト）
+_MP3_FRAME_HEADER = b"\xff\xfb\x90\x64"
+_MP3_FRAME_BYTES = 417
+# 1文字あたりのフレーム数（日本語の読み上げでおよそ1文字150ms）
+_MP3_FRAMES_PER_CHAR = 6
+
+
+def fake_mp3(text):
+    """テキストから決定的に作る無音のMP3（長さは文字数に比例）"""
+    digest = hashlib.sha256(text.encode()).digest()
+    # フレームの末尾にハッシュを入れ、テキストごとに内容が異なるようにする
+    frame_body = bytes(_MP3_FRAME_BYTES - len(_MP3_FRAME_HEADER) - len(digest)) + digest
+    frame = _MP3_FRAME_HEADER + frame_body
+    return frame * max(1, len(text) * _MP3_FRAMES_PER_CHAR)
+
+
+class _SynthesizeSpeechResponse:
+    def __init__(self, audio_content):
+        self.audio_content = audio_content
+
+
+class FakeTextToSpeechClient:
+    def __init__(self, faults=None):
+        self.faults = faults or FaultInjector.from_env("tts")
+
+    def synthesize_speech(self, request=None, *, input=None, voice=None, audio_config=None, **kwargs):
+        self.faults.inject("synthesize_speech")
+        synthesis_input = input if input is not None else (request or {}).get("input")
+        return _SynthesizeSpeechResponse(fake_mp3(getattr(synthesis_input, "text", "") or ""))
+
+    def stats(self):
+        return self.faults.stats()
+
+
+# ---------- Gemini ----------
+
+class FakeGenerationConfig:
+    """vertexai.generative_models.GenerationConfig の代わり（引数をそのまま保持する）"""
+
+    def __init__(self, **kwargs):
+        self.response_mime_type = kwargs.pop("response_mime_type", None)
+        self.response_schema = kwargs.pop("response_schema", None)
+        self.options = kwargs
+
+
+def schema_example(schema, text=FAKE_GEMINI_REPLY):
+    """response_schema を満たす最小の値（列挙は先頭、文字列は固定の返答）"""
+    if "enum" in schema:
+        return schema["enum"][0]
+    kind = schema.get("type", "string").lower()
+    if kind == "object":
+        return {name: schema_example(prop, text) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return []
+    if kind in ("number", "integer"):
+        return 0
+    if kind == "boolean":
+        return False
+    return text
+
+
+class _FakeGenerationResponse:
+    def __init__(self, text):
+        self.text = text
+        self.candidates = []
+
+
+class FakeGenerativeModel:
+    """GenerativeModel の代わり（固定の返答。JSON出力指定時はスキーマに合う値を返す）"""
+
+    faults = None  # install_fake_backends が全モデル共通の FaultInjector を設定する
+
+    def __init__(self, model_name=None, generation_config=None, system_instruction=None, **kwargs):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        if FakeGenerativeModel.faults is None:
+            FakeGenerativeModel.faults = FaultInjector.from_env("gemini")
+
+    def _reply(self, generation_config):
+        config = generation_config or self.generation_config
+        if config is not None and getattr(config, "response_mime_type", None) == "application/json":
+            schema = getattr(config, "response_schema", None) or {"type": "object"}
+            return json.dumps(schema_example(schema), ensure_ascii=False)
+        return FAKE_GEMINI_REPLY
+
+    def _stream(self, text):
+        for start in range(0, len(text), FAKE_GEMINI_CHUNK_CHARS):
+            if FAKE_GEMINI_CHUNK_MS and start:
+                time.sleep(FAKE_GEMINI_CHUNK_MS / 1000)
+            yield _FakeGenerationResponse(text[start:start + FAKE_GEMINI_CHUNK_CHARS])
+
+    async def _stream_async(self, text):
+        for start in range(0, len(text), FAKE_GEMINI_CHUNK_CHARS):
+            if FAKE_GEMINI_CHUNK_MS and start:
+                await asyncio.sleep(FAKE_GEMINI_CHUNK_MS / 1000)
+            yield _FakeGenerationResponse(text[start:start + FAKE_GEMINI_CHUNK_CHARS])
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        FakeGenerativeModel.faults.inject("generate_content")
+        text = self._reply(generation_config)
+        return self._stream(text) if stream else _FakeGenerationResponse(text)
+
+    async def generate_content_async(self, contents, generation_config=None, stream=False, **kwargs):
+        await FakeGenerativeModel.faults.inject_async("generate_content_async")
+        text = self._reply(generation_config)
+        return self._stream_async(text) if stream else _FakeGenerationResponse(text)
+
+
+# ---------- 組み込み ----------
+
+class _PatchOnImport(importlib.abc.MetaPathFinder):
+    """指定モジュールが初めて import されたときに属性を差し替える"""
+
+    def __init__(self, module_name, attributes):
+        self.module_name = module_name
+        self.attributes = attributes
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname != self.module_name:
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(fullname)
+        if spec is None or spec.loader is None:
+            return spec
+        exec_module = spec.loader.exec_module
+        attributes = self.attributes
+
+        def patched_exec_module(module):
+            exec_module(module)
+            for name, value in attributes.items():
+                setattr(module, name, value)
+
+        spec.loader.exec_module = patched_exec_module
+        return spec
+
+
+def _patch_module(module_name, attributes):
+    module = sys.modules.get(module_name)
+    if module is not None:
+        for name, value in attributes.items():
+            setattr(module, name, value)
+    else:
+        sys.meta_path.insert(0, _PatchOnImport(module_name, attributes))
+
+
+def _importing(module_name, factory):
+    """実ライブラリの import だけは行う生成関数（import コストの計測用）"""
+    def create(*args):
+        try:
+            importlib.import_module(module_name)
+        except ImportError:
+            pass
+        return factory(*args)
+    return create
+
+
+_installed = None
+_install_lock = threading.Lock()
+
+
+def install_fake_backends(user_id=FAKE_USER_ID, import_real_libraries=False):
+    """
+    全バックエンドをインメモリ実装に差し替える（2回目以降は同じインスタンスを返す）
+
+    Args:
+        user_id: Authorization ヘッダーのないリクエストのユーザーID
+            （"Bearer <トークン>" はトークンをそのままユーザーIDとして扱う）
+        import_real_libraries: クライアント生成時に実ライブラリを import する（コールドスタート計測用）
+
+    Returns:
+        バックエンド名 -> フェイクのインスタンス
+    """
+    global _installed
+    with _install_lock:
+        if _installed is not None:
+            return _installed
+
+        # local_server.py と同じくテスト用のバケットを使う（main の import 前に設定する）
+        os.environ.setdefault("UPLOAD_BUCKET", FAKE_UPLOAD_BUCKET)
+
+        firestore_client = FakeFirestore()
+        storage_client = FakeStorageClient()
+        tts_client = FakeTextToSpeechClient()
+        FakeGenerativeModel.faults = FaultInjector.from_env("gemini")
+
+        import firebase_admin
+        from firebase_admin import auth, firestore
+
+        # local_server.py と同じく、初期化済みのアプリがあるように見せる
+        if not firebase_admin._apps:
+            firebase_admin._apps = {'[DEFAULT]': object()}
+        auth.verify_id_token = lambda id_token, *args, **kwargs: {"uid": id_token or user_id}
+
+        import clients
+        factories = {
+            "firestore": lambda: firestore_client,
+            "storage": lambda: storage_client,
+            "texttospeech": lambda: tts_client,
+            "vertexai": lambda: True,
+            "generative_model": lambda model_name: FakeGenerativeModel(model_name),
+        }
+        if import_real_libraries:
+            libraries = {
+                "firestore": "google.cloud.firestore",
+                "storage": "google.cloud.storage",
+                "texttospeech": "google.cloud.texttospeech",
+                "vertexai": "vertexai",
+            }
+            for name, module_name in libraries.items():
+                factories[name] = _importing(module_name, factories[name])
+        clients.use_factories(**factories)
+
+        # firestore.client() / firestore.Client() を直接呼ぶエージェントや、
+        # import 時に @firestore.transactional を適用するモジュールもフェイクを使うようにする
+        for name, value in {
+            "client": lambda *args, **kwargs: clients.get_firestore(),
+            "Client": lambda *args, **kwargs: clients.get_firestore(),
+            "transactional": transactional,
+            "SERVER_TIMESTAMP": SERVER_TIMESTAMP,
+            "DELETE_FIELD": DELETE_FIELD,
+            "Increment": Increment,
+            "ArrayUnion": ArrayUnion,
+            "ArrayRemove": ArrayRemove,
+            "FieldFilter": FieldFilter,
+            "Query": Query,
+        }.items():
+            setattr(firestore, name, value)
+
+        # GenerativeModel を直接作るエージェント用（vertexai は import されるまで読み込まない）
+        _patch_module("vertexai.generative_models", {
+            "GenerativeModel": FakeGenerativeModel,
+            "GenerationConfig": FakeGenerationConfig,
+        })
+
+        _installed = {
+            "firestore": firestore_client,
+            "storage": storage_client,
+            "texttospeech": tts_client,
+        }
+        logging.info("Fake backends installed")
+        return _installed
+
+
+def stats():
+    """各フェイクの呼び出し回数・注入したエラー数など"""
+    if _installed is None:
+        return {}
+    result = {name: backend.stats() for name, backend in _installed.items()}
+    if FakeGenerativeModel.faults is not None:
+        result["gemini"] = FakeGenerativeModel.faults.stats()
+    return result
@@ -2,72 +2,50 @@
 Guardian Agent - 飲酒ペース監視と警告生成
 """
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from firebase_admin import firestore
 
-# Firestore client
-db = firestore.client()
+import guardian_state
+from session_aggregate import get_session_stats
+
+# Firestore client（初回利用時に生成される共有クライアント）
+from clients import db
 
 
 class GuardianAgent:
-    # 推奨値
+    # 推奨値（判定ロジックは guardian_state と共通）
     SAFE_PACE_DRINKS_PER_HOUR = 1
-    DAILY_LIMIT_G = 20  # 純アルコール20g
-    WARNING_LEVELS = {
-        "ok": {"color": "green", "message": "良いペースです"},
-        "caution": {"color": "orange", "message": "ペースに注意してください"},
-        "warning": {"color": "red", "message": "飲み過ぎです。水分補給を"},
-        "stop": {"color": "red", "message": "これ以上は危険です"}
-    }
+    DAILY_LIMIT_G = guardian_state.DAILY_LIMIT_G
+    WARNING_LEVELS = guardian_state.WARNING_LEVELS
     
-    def analyze_drinking_pattern(self, user_id, session_id):
-        """飲酒パターンを分析"""
+    def analyze_drinking_pattern(self, user_id, session_id, stats=None):
+        """飲酒パターンを分析（statsを渡すとFirestoreを読まない）"""
         try:
-            session_data = self._get_session_data(user_id, session_id)
+            if stats is None:
+                stats = get_session_stats(user_id, session_id) or {}
+            
+            # 飲酒追加時に計算済みの判定があればそれを返す
+            precomputed = stats.get('guardian_level')
+            if precomputed:
+                return self.WARNING_LEVELS[precomputed['level']]
             
             # 1. 総量チェック
-            total_alcohol = session_data.get('total_alcohol_g', 0)
+            total_alcohol = stats.get('total_alcohol_g', 0)
             
             # 2. ペースチェック（30分あたりの飲酒数）
-            recent_drinks = self._get_recent_drinks(user_id, session_id, minutes=30)
-            pace_score = len(recent_drinks)
+            window = stats.get('window_summary', {}).get('last_30min', {})
+            pace_score = window.get('drinks', 0)
             
             # 3. 時間経過チェック
-            duration_hours = self._get_session_duration(session_data) / 3600
+            duration_hours = self._get_session_duration(stats) / 3600
             
             # 判定ロジック
-            if total_alcohol > self.DAILY_LIMIT_G * 1.5:
-                return self.WARNING_LEVELS["stop"]
-            elif total_alcohol > self.DAILY_LIMIT_G:
-                return self.WARNING_LEVELS["warning"]
-            elif pace_score >= 2:
-                return self.WARNING_LEVELS["caution"]
-            else:
-                return self.WARNING_LEVELS["ok"]
+            return self.WARNING_LEVELS[guardian_state.evaluate_level(total_alcohol, pace_score)]
                 
         except Exception as e:
             logging.error(f"Error in Guardian analysis: {e}")
             return self.WARNING_LEVELS["ok"]  # エラー時は安全側に
     
-    def _get_session_data(self, user_id, session_id):
-        """セッションデータを取得"""
-        session_ref = db.collection('users').document(user_id).collection('sessions').document(session_id)
-        session_doc = session_ref.get()
-        
-        if session_doc.exists:
-            return session_doc.to_dict()
-        return {}
-    
-    def _get_recent_drinks(self, user_id, session_id, minutes=30):
-        """最近の飲酒記録を取得"""
-        drinks_ref = db.collection('users').document(user_id).collection('sessions').document(session_id).collection('drinks')
-        
-        # 時間でフィルタリング
-        time_threshold = datetime.now() - timedelta(minutes=minutes)
-        recent_drinks = drinks_ref.where('timestamp', '>=', time_threshold).get()
-        
-        return recent_drinks
-    
     def _get_session_duration(self, session_data):
         """セッション継続時間を秒で返す"""
         start_time = session_data.get('start_time')
@@ -80,12 +58,14 @@ class GuardianAgent:
         else:
             start_datetime = start_time
             
-        duration = datetime.now() - start_datetime
+        # タイムゾーン付き（Firestore Timestamp）の場合はUTCで比較
+        now = datetime.now(timezone.utc) if start_datetime.tzinfo else datetime.now()
+        duration = now - start_datetime
         return duration.total_seconds()
     
-    def check_veto(self, user_id, session_id):
+    def check_veto(self, user_id, session_id, stats=None):
         """Bartenderへの拒否権チェック"""
-        result = self.analyze_drinking_pattern(user_id, session_id)
+        result = self.analyze_drinking_pattern(user_id, session_id, stats)
         
         if result['color'] == 'red':
             return {
@@ -116,5 +96,6 @@ def save_guardian_warning(user_id, session_id, warning):
 
 def check_guardian_rules(user_id, session_id):
     """Guardian判定を実行して結果を返す"""
-    guardian = GuardianAgent()
+    from agents.registry import get_rule_guardian
+    guardian = get_rule_guardian()
     return guardian.analyze_drinking_pattern(user_id, session_id)
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+Guardian Analysis Cache - セッションのバージョンごとのGuardian分析結果キャッシュ
+キー: (user_id, session_id, version)。version は飲酒記録の書き込みごとに増える
+1層目: プロセス内LRU
+2層目: Firestore の users/{uid}/sessions/{sid}/guardian_cache/analysis（expires_at でTTL）
+飲酒の合間の拒否権チェックや状態ポーリングでは分析パイプラインを再実行しない
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+# Firestore client（初回利用時に生成される共有クライアント）
+from clients import db
+
+GUARDIAN_CACHE_COLLECTION = "guardian_cache"
+GUARDIAN_CACHE_DOCUMENT = "analysis"
+GUARDIAN_CACHE_MAX_ENTRIES = int(os.getenv("GUARDIAN_CACHE_MAX_ENTRIES", "1024"))
+# 飲酒がなくても時間経過でペース評価は変わるため、長くは保持しない
+GUARDIAN_CACHE_TTL_SECONDS = int(os.getenv("GUARDIAN_CACHE_TTL_SECONDS", "300"))
+
+
+def _cache_ref(user_id, session_id):
+    return (db.collection('users').document(user_id)
+            .collection('sessions').document(session_id)
+            .collection(GUARDIAN_CACHE_COLLECTION).document(GUARDIAN_CACHE_DOCUMENT))
+
+
+def _expires_at(stats, ttl_seconds):
+    """TTLとペース由来の判定が解除される時刻（valid_until）の早い方"""
+    expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
+    valid_until = (stats.get('guardian_level') or {}).get('valid_until')
+    if valid_until is not None:
+        expires_at = min(expires_at, datetime.fromtimestamp(valid_until, tz=timezone.utc))
+    return expires_at
+
+
+class GuardianAnalysisCache:
+    """Guardian分析結果のLRU + Firestoreの2層キャッシュ"""
+
+    def __init__(self, max_entries=GUARDIAN_CACHE_MAX_ENTRIES, ttl_seconds=GUARDIAN_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        # (user_id, session_id) -> (version, result, expires_at)。セッションごとに最新版だけ持つ
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "firestore_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "invalidations": 0,
+            "errors": 0
+        }
+
+    def _memory_put(self, key, version, result, expires_at):
+        with self._lock:
+            current = self._entries.get(key)
+            # 遅れて届いた古いバージョンで上書きしない
+            if current is not None and current[0] > version:
+                return
+            self._entries[key] = (version, result, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id, session_id, version, shared=True):
+        """
+        このバージョンの分析結果を返す（なければ None）
+
+        shared=False ならFirestoreは読まない（再計算の方が安い場合）
+        """
+        key = (user_id, session_id)
+        now = datetime.now(timezone.utc)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                cached_version, result, expires_at = entry
+                if cached_version == version and expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return result
+                if cached_version <= version:
+                    del self._entries[key]
+
+        if not shared:
+            with self._lock:
+                self._counters["misses"] += 1
+            return None
+
+        try:
+            doc = _cache_ref(user_id, session_id).get()
+        except Exception as e:
+            logging.warning(f"Guardian cache read failed: {e}")
+            with self._lock:
+                self._counters["errors"] += 1
+                self._counters["misses"] += 1
+            return None
+
+        data = doc.to_dict() if doc.exists else None
+        if (not data or data.get("version") != version
+                or data.get("expires_at") is None or data["expires_at"] <= now):
+            with self._lock:
+                self._counters["misses"] += 1
+            return None
+
+        with self._lock:
+            self._counters["firestore_hits"] += 1
+        self._memory_put(key, version, data["result"], data["expires_at"])
+        return data["result"]
+
+    def put(self, user_id, session_id, version, result, stats, shared=True):
+        """分析結果を保存（shared=False ならプロセス内のみ）"""
+        expires_at = _expires_at(stats, self.ttl_seconds)
+        self._memory_put((user_id, session_id), version, result, expires_at)
+        if not shared:
+            return
+
+        try:
+            _cache_ref(user_id, session_id).set({
+                "version": version,
+                "result": result,
+                "created_at": firestore.SERVER_TIMESTAMP,
+                "expires_at": expires_at
+            })
+            with self._lock:
+                self._counters["stores"] += 1
+        except Exception as e:
+            logging.warning(f"Guardian cache write failed: {e}")
+            with self._lock:
+                self._counters["errors"] += 1
+
+    def invalidate(self, user_id, session_id, shared=True):
+        """
+        セッションの分析結果を破棄（飲酒追加・セッション終了時）
+
+        shared=False ならプロセス内のエントリだけ消す（キーにバージョンを含むので共有側は読まれない）
+        """
+        with self._lock:
+            self._entries.pop((user_id, session_id), None)
+            self._counters["invalidations"] += 1
+        if not shared:
+            return
+
+        try:
+            _cache_ref(user_id, session_id).delete()
+        except Exception as e:
+            # version が変わるので残っても読まれない（TTLで削除される）
+            logging.warning(f"Guardian cache invalidation failed: {e}")
+            with self._lock:
+                self._counters["errors"] += 1
+
+    def stats(self):
+        """ヒット率などのメトリクス"""
+        with self._lock:
+            hits = self._counters["memory_hits"] + self._counters["firestore_hits"]
+            lookups = hits + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
+
+
+# シングルトンインスタンス
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_analysis_cache():
+    """プロセス共有のGuardian分析キャッシュを取得"""
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = GuardianAnalysisCache()
+    return _cache_instance
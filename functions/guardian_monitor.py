@@ -3,7 +3,7 @@ import json
 import logging
 import functions_framework
 from datetime import datetime, timedelta
-from firebase_admin import firestore, auth, initialize_app
+from firebase_admin import initialize_app
 import os
 
 # Firebase Admin SDK初期化
@@ -13,8 +13,9 @@ except ValueError:
     # すでに初期化されている場合はパス
     pass
 
-# Firestore client
-db = firestore.client()
+from auth_cache import get_user_id
+from active_session import get_or_create_session
+from session_aggregate import get_session_stats
 
 def add_cors_headers(response_data, status_code, content_type="application/json"):
     """レスポンスにCORSヘッダーを追加する共通関数"""
@@ -27,38 +28,6 @@ def add_cors_headers(response_data, status_code, content_type="application/json"
     }
     return (response_data, status_code, headers)
 
-def get_user_id(request):
-    """Extract user ID from request (mock for hackathon)"""
-    auth_header = request.headers.get('Authorization', '')
-    if auth_header.startswith('Bearer '):
-        try:
-            token = auth_header.split('Bearer ')[1]
-            decoded = auth.verify_id_token(token)
-            return decoded['uid']
-        except:
-            pass
-    return "demo_user_001"
-
-def get_or_create_session(user_id):
-    """Get active session or create new one"""
-    sessions_ref = db.collection('users').document(user_id).collection('sessions')
-    active_sessions = sessions_ref.where('status', '==', 'active').limit(1).get()
-    
-    if active_sessions:
-        return active_sessions[0].id
-    
-    # Create new session
-    session_data = {
-        'start_time': firestore.SERVER_TIMESTAMP,
-        'end_time': None,
-        'total_alcohol_g': 0,
-        'status': 'active',
-        'guardian_warnings': []
-    }
-    
-    doc_ref = sessions_ref.add(session_data)
-    return doc_ref[1].id
-
 @functions_framework.http
 def guardian_monitor(request):
     """Guardian monitoring endpoint"""
@@ -69,12 +38,11 @@ def guardian_monitor(request):
         user_id = get_user_id(request)
         session_id = get_or_create_session(user_id)
         
-        # セッションデータを取得
-        session_ref = db.collection('users').document(user_id).collection('sessions').document(session_id)
-        session_data = session_ref.get().to_dict()
+        # セッション集計を取得（drinksサブコレクションは読まない）
+        stats = get_session_stats(user_id, session_id) or {}
         
         # 飲酒量を取得
-        total_alcohol_g = session_data.get('total_alcohol_g', 0)
+        total_alcohol_g = stats.get('total_alcohol_g', 0)
         
         # Guardian分析を実行（簡易版）
         if total_alcohol_g >= 20:
@@ -89,6 +57,8 @@ def guardian_monitor(request):
         result = {
             "level": level,
             "total_alcohol_g": total_alcohol_g,
+            "drink_count": stats.get('drink_count', 0),
+            "recent_30min": stats.get('window_summary', {}).get('last_30min'),
             "recommendations": ["水分補給を忘れずに", "適度なペースで楽しみましょう"]
         }
         
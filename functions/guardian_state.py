@@ -0,0 +1,162 @@
+"""
+Guardian State - 飲酒イベント駆動のGuardian判定
+セッションごとに直近30分の飲酒（時刻・純アルコール量）の両端キューと累計を持ち、
+飲酒追加のたびに償却O(1)で警告レベルを更新する
+判定結果はセッションドキュメントの guardian_level に保存し、読み取り系APIはそれを返す
+"""
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+
+# 推奨値
+DAILY_LIMIT_G = 20  # 純アルコール20g
+PACE_WINDOW_SECONDS = 30 * 60
+PACE_CAUTION_DRINKS = 2  # 30分あたりこの杯数以上で注意
+
+WARNING_LEVELS = {
+    "ok": {"color": "green", "message": "良いペースです"},
+    "caution": {"color": "orange", "message": "ペースに注意してください"},
+    "warning": {"color": "red", "message": "飲み過ぎです。水分補給を"},
+    "stop": {"color": "red", "message": "これ以上は危険です"}
+}
+
+GUARDIAN_STATE_MAX_SESSIONS = 1024
+
+
+def evaluate_level(total_alcohol_g, pace_drinks):
+    """総量と直近30分の杯数から警告レベルのキーを判定"""
+    if total_alcohol_g > DAILY_LIMIT_G * 1.5:
+        return "stop"
+    elif total_alcohol_g > DAILY_LIMIT_G:
+        return "warning"
+    elif pace_drinks >= PACE_CAUTION_DRINKS:
+        return "caution"
+    return "ok"
+
+
+def _epoch(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return None
+
+
+class GuardianState:
+    """1セッション分のスライディングウィンドウと累計"""
+
+    def __init__(self, total_alcohol_g=0.0, drink_count=0, recent_drinks=()):
+        self.total_alcohol_g = float(total_alcohol_g or 0)
+        self.drink_count = drink_count or 0
+        self.window = deque()  # (UNIX秒, 純アルコールg)、時刻順
+        self.window_alcohol_g = 0.0
+        for drink in sorted(recent_drinks, key=lambda d: d['t']):
+            self.window.append((drink['t'], drink['g']))
+            self.window_alcohol_g += drink['g']
+
+    @classmethod
+    def from_session_data(cls, session_data):
+        """セッションドキュメントの集計フィールドから状態を復元"""
+        return cls(
+            session_data.get('total_alcohol_g', 0),
+            session_data.get('drink_count', 0),
+            session_data.get('recent_drinks') or []
+        )
+
+    def _evict(self, now_ts):
+        threshold = now_ts - PACE_WINDOW_SECONDS
+        while self.window and self.window[0][0] < threshold:
+            _, alcohol_g = self.window.popleft()
+            self.window_alcohol_g -= alcohol_g
+
+    def add_drink(self, timestamp, alcohol_g):
+        """飲酒イベントを反映し、新しい警告レベルを返す"""
+        now_ts = _epoch(timestamp)
+        self._evict(now_ts)
+        self.window.append((now_ts, alcohol_g))
+        self.window_alcohol_g += alcohol_g
+        self.total_alcohol_g += alcohol_g
+        self.drink_count += 1
+        return self.level(now_ts)
+
+    def level(self, now=None):
+        """
+        現時点の警告レベル
+
+        Returns:
+            {"level", "color", "message", "computed_at", "valid_until"}
+            valid_until はペース由来の判定が自然に解除される時刻（UNIX秒、なければ None）
+        """
+        now_ts = _epoch(now) if now is not None else datetime.now(timezone.utc).timestamp()
+        self._evict(now_ts)
+
+        key = evaluate_level(self.total_alcohol_g, len(self.window))
+        valid_until = None
+        if key == "caution":
+            # 古い飲酒がウィンドウから抜けて杯数が閾値を下回る時刻
+            oldest_needed = self.window[len(self.window) - PACE_CAUTION_DRINKS][0]
+            valid_until = oldest_needed + PACE_WINDOW_SECONDS
+
+        return {
+            "level": key,
+            **WARNING_LEVELS[key],
+            "computed_at": now_ts,
+            "valid_until": valid_until
+        }
+
+
+def current_level(session_data, now=None):
+    """
+    保存済みの判定を返す（期限切れ・未保存ならセッションドキュメントから再計算）
+
+    drinks サブコレクションは読まない。
+    """
+    now_ts = _epoch(now) if now is not None else datetime.now(timezone.utc).timestamp()
+    stored = session_data.get('guardian_level')
+    if stored and (stored.get('valid_until') is None or now_ts <= stored['valid_until']):
+        return stored
+    return GuardianState.from_session_data(session_data).level(now_ts)
+
+
+class GuardianStateStore:
+    """
+    プロセス内のセッション状態（LRU）
+
+    トランザクションは再試行されうるので、判定は毎回セッションドキュメントから組み立て、
+    ここにはコミットできた状態だけを置く。
+    """
+
+    def __init__(self, max_sessions=GUARDIAN_STATE_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._states = OrderedDict()  # (user_id, session_id) -> GuardianState
+        self._lock = threading.Lock()
+
+    def on_drink_committed(self, user_id, session_id, state):
+        """飲酒追加をコミットした後の状態を保存する"""
+        key = (user_id, session_id)
+        with self._lock:
+            self._states[key] = state
+            self._states.move_to_end(key)
+            while len(self._states) > self.max_sessions:
+                self._states.popitem(last=False)
+
+    def get(self, user_id, session_id):
+        with self._lock:
+            return self._states.get((user_id, session_id))
+
+    def forget(self, user_id, session_id):
+        with self._lock:
+            self._states.pop((user_id, session_id), None)
+
+
+# シングルトンインスタンス
+_store = GuardianStateStore()
+
+
+def get_state_store():
+    """プロセス共有のGuardian状態ストアを取得"""
+    return _store
@@ -15,25 +15,13 @@ os.environ['STORAGE_BUCKET'] = 'test-bucket'
 os.environ['GEMINI_LOCATION'] = 'us-central1'
 os.environ['GEMINI_MODEL'] = 'gemini-2.0-flash-001'
 
-# Mock Firebase admin initialization
-import firebase_admin
-from unittest.mock import MagicMock
+# Firestore・Cloud Storage・TTS・Gemini をインメモリのフェイクに置き換える
+# （書き込みはプロセス内に保持されるので /drink などを実際のハンドラで試せる）
+from fake_backends import install_fake_backends
 
-# Check if Firebase is already initialized
-if not firebase_admin._apps:
-    # If not initialized, create a mock app
-    firebase_admin._apps = {'[DEFAULT]': MagicMock()}
-    
-# Mock Firebase auth service
-firebase_admin.auth = MagicMock()
-firebase_admin.auth.verify_id_token = MagicMock(side_effect=Exception("Mock auth"))
-firebase_admin.firestore = MagicMock()
-
-# Mock Firestore client
-mock_db = MagicMock()
-firebase_admin.firestore.client = MagicMock(return_value=mock_db)
+install_fake_backends()
 
-# Import main functions after mocking
+# Import main functions after installing the fakes
 from main import (
     get_drinks_master, chat, start_session, get_current_session,
     guardian_check, add_drink, drink, get_user_id
@@ -87,7 +75,12 @@ app.route('/drink', methods=['POST', 'OPTIONS'])(convert_handler(drink))
 # Health check endpoint
 @app.route('/health')
 def health():
-    return jsonify({"status": "healthy", "service": "alco-guardian-backend"})
+    from agents.registry import get_registry
+    return jsonify({
+        "status": "healthy",
+        "service": "alco-guardian-backend",
+        "agents": get_registry().status()
+    })
 
 if __name__ == '__main__':
     print("🚀 Starting AlcoGuardian Local Development Server")
@@ -101,7 +94,7 @@ if __name__ == '__main__':
     print("   GET  /guardian_check")
     print("   POST /add_drink")
     print("   POST /drink")
-    print("\n⚠️  Note: Running with mocked Firebase services")
+    print("\n⚠️  Note: Running with in-memory fake backends (fake_backends.py)")
     print("Press Ctrl+C to stop the server\n")
     
     app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
@@ -1,51 +1,55 @@
 import json
 import logging
 import os
-import tempfile
 from datetime import datetime, timezone
-from pathlib import Path
-import hashlib
 import random
 
-import firebase_admin
 import functions_framework
-import vertexai
 from firebase_admin import auth, firestore
-from google.cloud import storage, texttospeech
+from flask import Response
 from nanoid import generate
-from vertexai.preview.generative_models import GenerativeModel, Part
+
+from async_runner import STAGE_TIMEOUT_SECONDS, run_async, run_stages
+from upload_buffer import UploadTooLarge, read_upload, use_memory_uploads
+from phrases import (
+    BARTENDER_EMPTY_RESPONSE,
+    BARTENDER_FALLBACK_RESPONSE,
+    DRINK_RECORDED_MESSAGE,
+    DRINK_RECORDED_SUFFIXES,
+    SESSION_RECOMMENDATIONS,
+    format_phrase,
+)
 
 # ---------- 初期化 ----------
-firebase_admin.initialize_app()
-PROJECT = os.getenv("GCP_PROJECT")
-# Vertex AI API を呼び出す際の推奨ロケーション (Geminiモデル用)
-GEMINI_LOCATION = os.getenv("GEMINI_LOCATION", "us-central1")
-# 使用するGeminiモデル
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-001")  # デフォルトを1.5 Proから2.0 Flashに変更
-
-# Cloud Functionsのデプロイリージョンとは別にVertex AIの処理リージョンを指定
-# (互換性の高い us-central1 を推奨)
-vertexai.init(project=PROJECT, location=GEMINI_LOCATION)
-model = GenerativeModel(GEMINI_MODEL)
+# クライアント（Firestore・GCS・TTS・Vertex AI）は初回利用時に生成する
+from clients import GEMINI_MODEL, LazyClient, db, ensure_firebase_app, get_generative_model
+
+ensure_firebase_app()
+model = LazyClient(lambda: get_generative_model(GEMINI_MODEL))
 
 # 他の環境変数 (ログレベル、アップロードバケットなど)
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 logging.basicConfig(level=LOG_LEVEL)
 bucket_name = os.getenv("UPLOAD_BUCKET")
-storage_client = storage.Client()
-
-# Firestore client
-db = firestore.client()
 
-# Text-to-Speech クライアントの初期化
-tts_client = texttospeech.TextToSpeechClient()
+# セッション解決・集計（Firebase初期化後に読み込む）
+from auth_cache import get_user_id, verify_id_token
+from active_session import (
+    close_session, get_active_session, get_active_session_id, get_or_create_session, open_session,
+    record_drink_in_active_session
+)
+from session_aggregate import get_session_stats
+from transcript_cache import get_transcript_cache, transcript_cache_key
 
-# TTS用のバケット設定
-TTS_BUCKET_NAME = os.getenv("STORAGE_BUCKET", "alco-guardian.appspot.com")
-tts_bucket = storage_client.bucket(TTS_BUCKET_NAME)
+# Text-to-Speech（クライアントとバケットは tts_cache で共有）
+from tts_cache import VOICE_NAME, get_audio_url
+from tts_jobs import submit_speech
+from chat_stream import SSE_HEADERS, gemini_text_chunks, stream_chat_events
 
-# 日本語男性音声
-VOICE_NAME = "ja-JP-Neural2-B"
+# コールドスタート時にエージェントを事前生成（WARM_UP_AGENTS=true の場合）
+if os.getenv("WARM_UP_AGENTS", "false").lower() == "true":
+    from agents.registry import warm_up
+    logging.info(f"Agent warm-up: {warm_up()}")
 
 
 def add_cors_headers(response_data, status_code, content_type="application/json"):
@@ -60,6 +64,17 @@ def add_cors_headers(response_data, status_code, content_type="application/json"
     return (response_data, status_code, headers)
 
 
+def session_start_datetime(start_time):
+    """セッション開始時刻をUTCのaware datetimeにする（Firestore Timestamp / naive datetime / 未設定）"""
+    if hasattr(start_time, 'seconds'):
+        return datetime.fromtimestamp(start_time.seconds, tz=timezone.utc)
+    if not start_time:
+        return datetime.now(timezone.utc)
+    if start_time.tzinfo is None:
+        return start_time.replace(tzinfo=timezone.utc)
+    return start_time
+
+
 @functions_framework.http
 def transcribe(request):
     # CORS対応
@@ -80,7 +95,7 @@ def transcribe(request):
         uid = None
         if id_token:
             try:
-                uid = auth.verify_id_token(id_token)["uid"]
+                uid = verify_id_token(id_token)["uid"]
             except auth.InvalidIdTokenError:
                 logging.warning("Invalid ID token provided.")
                 return add_cors_headers(
@@ -96,7 +111,18 @@ def transcribe(request):
 
         logging.info(f"Processing request from user: {uid}")
 
-        if "file" not in request.files:
+        # アップロードはディスクに書かずメモリで受ける（上限を超えた時点で打ち切る）
+        try:
+            use_memory_uploads(request)
+            has_file = "file" in request.files
+        except UploadTooLarge as e:
+            logging.warning(f"Upload rejected: {e}")
+            return add_cors_headers(
+                json.dumps({"code": "PAYLOAD_TOO_LARGE", "message": f"File is too large (max {e.max_bytes} bytes)"}),
+                413
+            )
+
+        if not has_file:
             logging.error("No file part in the request.")
             return add_cors_headers(
                 json.dumps({"code": "BAD_REQUEST", "message": "No file part in the request"}),
@@ -119,49 +145,58 @@ def transcribe(request):
                 500
             )
 
-        # ===== DEBUG MODE: load bytes instead of GCS =====
-        tmp_file_path = None  # finallyブロックで参照するため先に定義
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=Path(request_file.filename).suffix) as tmp:
-                request_file.save(tmp.name)  # saveメソッドはファイルオブジェクトのパスを期待
-                # tmp.flush() # saveが完了すればflushは不要な場合もある
-                audio_bytes = Path(tmp.name).read_bytes()
-                tmp_file_path = tmp.name
-
-            effective_mime_type = request_file.content_type
-            if not effective_mime_type or not effective_mime_type.startswith("audio/"):
-                logging.warning(
-                    f"Uploaded file MIME type '{request_file.content_type}' is not specific. Falling back to 'audio/mpeg'."
-                )
-                effective_mime_type = "audio/mpeg"  # MP3を想定したフォールバック
+            audio_bytes = read_upload(request_file)
+        except UploadTooLarge as e:
+            logging.warning(f"Upload rejected: {e}")
+            return add_cors_headers(
+                json.dumps({"code": "PAYLOAD_TOO_LARGE", "message": f"File is too large (max {e.max_bytes} bytes)"}),
+                413
+            )
 
-            logging.info(
-                f"File '{request_file.filename}' saved to temporary path: {tmp_file_path}. Effective MIME type: {effective_mime_type}. Size: {len(audio_bytes)} bytes."
+        effective_mime_type = request_file.content_type
+        if not effective_mime_type or not effective_mime_type.startswith("audio/"):
+            logging.warning(
+                f"Uploaded file MIME type '{request_file.content_type}' is not specific. Falling back to 'audio/mpeg'."
             )
+            effective_mime_type = "audio/mpeg"  # MP3を想定したフォールバック
+
+        logging.info(
+            f"File '{request_file.filename}' read into memory. Effective MIME type: {effective_mime_type}. Size: {len(audio_bytes)} bytes."
+        )
 
+        prompt = "以下の音声を書き起こしてください。"
+
+        # 同じ音声の再送はキャッシュから返す
+        transcript_cache = get_transcript_cache()
+        cache_key = transcript_cache_key(audio_bytes, prompt, GEMINI_MODEL)
+        transcript = transcript_cache.get(cache_key)
+        cached = transcript is not None
+
+        if cached:
+            logging.info(f"Transcript cache hit for file: {request_file.filename}. Stats: {transcript_cache.stats()}")
+        else:
+            from vertexai.generative_models import Part
             audio_part = Part.from_data(data=audio_bytes, mime_type=effective_mime_type)
-            prompt = "以下の音声を書き起こしてください。"
 
             logging.info(f"Calling Gemini API with in-memory bytes for file: {request_file.filename}")
             response = model.generate_content([audio_part, prompt])
             transcript = response.text
             logging.info(f"Transcription successful using in-memory bytes. Transcript length: {len(transcript)}")
 
-            return add_cors_headers(
-                json.dumps(
-                    {
-                        "message": "Transcription successful (direct bytes).",
-                        "original_filename": request_file.filename,
-                        "transcript": transcript,
-                    }
-                ),
-                200
-            )
-        finally:
-            if tmp_file_path and Path(tmp_file_path).exists():
-                Path(tmp_file_path).unlink()
-                logging.info(f"Temporary file {tmp_file_path} deleted.")
-        # ===== END DEBUG MODE =====
+            transcript_cache.put(cache_key, transcript, GEMINI_MODEL)
+
+        return add_cors_headers(
+            json.dumps(
+                {
+                    "message": "Transcription successful (direct bytes).",
+                    "original_filename": request_file.filename,
+                    "transcript": transcript,
+                    "cached": cached,
+                }
+            ),
+            200
+        )
 
     except Exception as e:
         error_type = type(e).__name__
@@ -384,43 +419,39 @@ def guardian_check(request):
         )
 
 
-import hashlib
 import random
 from firebase_admin import firestore
 
-# Firestore client
-db = firestore.client()
-
-def generate_audio_filename(text, voice_name):
-    """テキストと声の設定からユニークなファイル名を生成"""
-    content = f"{text}:{voice_name}"
-    hash_digest = hashlib.sha256(content.encode()).hexdigest()[:16]
-    return f"tts/{voice_name}/{hash_digest}.mp3"
-
-
-def synthesize_speech(text, voice_name="ja-JP-Neural2-B"):
-    """テキストを音声に変換"""
-    synthesis_input = texttospeech.SynthesisInput(text=text)
-    
-    voice = texttospeech.VoiceSelectionParams(
-        language_code="ja-JP",
-        name=voice_name
-    )
-    
-    audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.MP3,
-        speaking_rate=1.0,
-        pitch=0.0
-    )
+def _stream_chat(request, user_message, system_prompt, enable_tts):
+    """Geminiのストリーミング出力をSSEで返す（会話履歴の要約・直近のターンも使う）"""
+    user_id = get_user_id(request)
+    history_prompt = ""
+    on_complete = None
+    try:
+        from agents.conversation_memory import get_conversation_memory
+        memory = get_conversation_memory()
+        session_id = get_active_session_id(user_id)
+        memory_context = memory.prompt_context(user_id, session_id)
+        if memory_context["summary"]:
+            history_prompt += f"\n# これまでの会話の要約\n{memory_context['summary']}\n"
+        if memory_context["history"]:
+            history_prompt += "\n# 直近の会話\n" + "".join(
+                f"ユーザー: {turn['user']}\nBartender: {turn['agent']}\n" for turn in memory_context["history"]
+            )
+        on_complete = lambda message: memory.append(user_id, session_id, user_message, message)
+    except Exception as e:
+        logging.warning(f"Conversation memory unavailable for streaming chat: {e}")
     
-    response = tts_client.synthesize_speech(
-        input=synthesis_input,
-        voice=voice,
-        audio_config=audio_config
+    prompt = f"{system_prompt}{history_prompt}\nユーザー: {user_message}\nBartender:"
+    events = stream_chat_events(
+        gemini_text_chunks(model, prompt),
+        # 文ごとの音声は /tts_audio で取得する
+        submit=(lambda text: submit_speech(text, VOICE_NAME)) if enable_tts else None,
+        extra={"imageId": random.randint(1, 10), "agent": "bartender"},
+        on_complete=on_complete,
+        fallback_message=BARTENDER_FALLBACK_RESPONSE
     )
-    
-    return response.audio_content
-
+    return Response(events, status=200, headers=SSE_HEADERS)
 
 @functions_framework.http
 def chat(request):
@@ -442,8 +473,9 @@ def chat(request):
                 400
             )
         
-        # 音声生成オプション
+        # 音声生成オプション（ttsMode="deferred" なら音声は /tts_audio で後から取得）
         enable_tts = request_json.get("enableTTS", True)
+        tts_mode = request_json.get("ttsMode", "sync")
         
         # Bartenderプロンプト
         now = datetime.now()
@@ -453,7 +485,7 @@ def chat(request):
             "day_of_week": days[now.weekday()]
         }
         
-        bartender_prompt = f"""あなたは「AI Bartender」として、ユーザーと楽しく温かい会話をするエージェントです。
+        system_prompt = f"""あなたは「AI Bartender」として、ユーザーと楽しく温かい会話をするエージェントです。
 
 # 役割
 - ユーザーの話を共感的に聞き、楽しい会話を提供する
@@ -467,27 +499,28 @@ def chat(request):
 # 現在の状況
 - 時刻: {context['current_time']}
 - 曜日: {context['day_of_week']}
-
-ユーザー: {user_message}
-Bartender:"""
+"""
+        bartender_prompt = f"{system_prompt}\nユーザー: {user_message}\nBartender:"
+        
+        # ストリーミングモード（SSE）: 生成中のテキストを送り、文ごとに音声合成を開始する
+        if request_json.get("stream") or "text/event-stream" in request.headers.get("Accept", ""):
+            return _stream_chat(request, user_message, system_prompt, enable_tts)
         
         # ADK Bartenderエージェントを使用
         try:
             user_id = get_user_id(request)
             
             # ADK Bartenderサービスを使用
-            from agents.bartender_adk import create_bartender_service
-            bartender_service = create_bartender_service()
+            from agents.registry import get_bartender_service
+            bartender_service = get_bartender_service()
             
-            # エージェントとチャット（同期的に実行）
-            import asyncio
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            response_data = loop.run_until_complete(
+            # エージェントとチャット（共有イベントループで実行）
+            response_data = run_async(
                 bartender_service.chat(
                     user_message=user_message,
                     user_id=user_id
-                )
+                ),
+                timeout=STAGE_TIMEOUT_SECONDS
             )
             
             bartender_response = response_data["message"]
@@ -497,38 +530,22 @@ Bartender:"""
             # フォールバック: 従来のGemini直接呼び出し
             try:
                 response = model.generate_content(bartender_prompt)
-                bartender_response = response.text.strip() if response and response.text else "すみません、ちょっと聞き取れませんでした。"
+                bartender_response = response.text.strip() if response and response.text else BARTENDER_EMPTY_RESPONSE
             except:
-                bartender_response = "すみません、ちょっと聞き取れませんでした。もう一度お願いできますか？"
+                bartender_response = BARTENDER_FALLBACK_RESPONSE
         
         # ランダムな画像ID
         image_id = random.randint(1, 10)
         
-        # 音声生成
+        # 音声生成（メモリ/GCSの2層キャッシュ経由）
         audio_url = None
-        if enable_tts and bucket_name:
+        audio_job = None
+        if enable_tts:
             try:
-                voice_name = "ja-JP-Neural2-B"
-                filename = generate_audio_filename(bartender_response, voice_name)
-                
-                # Cloud Storageに既存ファイルがあるかチェック
-                bucket = storage_client.bucket(bucket_name)
-                blob = bucket.blob(filename)
-                
-                if blob.exists():
-                    audio_url = blob.public_url
-                    logging.info(f"Using cached audio: {filename}")
+                if tts_mode == "deferred":
+                    audio_job = submit_speech(bartender_response, VOICE_NAME)
                 else:
-                    # 音声合成
-                    audio_content = synthesize_speech(bartender_response, voice_name)
-                    
-                    # Cloud Storageにアップロード
-                    blob.cache_control = "public, max-age=86400"
-                    blob.upload_from_string(audio_content, content_type="audio/mpeg")
-                    blob.make_public()
-                    audio_url = blob.public_url
-                    logging.info(f"Generated new audio: {filename}")
-                    
+                    audio_url = get_audio_url(bartender_response, VOICE_NAME)
             except Exception as e:
                 logging.error(f"Error generating TTS audio: {e}")
                 # TTSエラーでもチャット機能は継続
@@ -544,6 +561,8 @@ Bartender:"""
         
         if audio_url:
             response_data["audioUrl"] = audio_url
+        if audio_job:
+            response_data.update(audio_job)
         
         return add_cors_headers(
             json.dumps(response_data, ensure_ascii=False),
@@ -788,33 +807,8 @@ def calculate_pure_alcohol(drink_type, volume_ml=None):
     return volume * (alcohol_percentage / 100) * 0.8
 
 
-def get_or_create_session(user_id):
-    """Get active session or create new one"""
-    sessions_ref = db.collection('users').document(user_id).collection('sessions')
-    
-    # Check for active session
-    active_sessions = sessions_ref.where('status', '==', 'active').limit(1).get()
-    
-    if active_sessions:
-        return active_sessions[0].id
-    
-    # Create new session
-    session_data = {
-        'start_time': firestore.SERVER_TIMESTAMP,
-        'end_time': None,
-        'total_alcohol_g': 0,
-        'status': 'active',
-        'guardian_warnings': []
-    }
-    
-    doc_ref = sessions_ref.add(session_data)
-    return doc_ref[1].id
-
-
-def save_drink_record(user_id, session_id, drink_data, alcohol_g):
-    """Save drink record to Firestore"""
-    drink_ref = db.collection('users').document(user_id).collection('sessions').document(session_id).collection('drinks')
-    
+def save_drink_record(user_id, drink_data, alcohol_g):
+    """Save drink record to the active session and return (session_id, updated session stats)"""
     drink_record = {
         'drink_type': drink_data['drink_id'],
         'volume_ml': drink_data.get('volume_ml', DRINKS_MASTER[drink_data['drink_id']]['volume']),
@@ -822,39 +816,9 @@ def save_drink_record(user_id, session_id, drink_data, alcohol_g):
         'timestamp': firestore.SERVER_TIMESTAMP
     }
     
-    drink_ref.add(drink_record)
-    
-    # Update session total
-    session_ref = db.collection('users').document(user_id).collection('sessions').document(session_id)
-    session_ref.update({
-        'total_alcohol_g': firestore.Increment(alcohol_g)
-    })
-
-
-def get_session_total(user_id, session_id):
-    """Get total alcohol for session"""
-    session_ref = db.collection('users').document(user_id).collection('sessions').document(session_id)
-    session_data = session_ref.get()
-    
-    if session_data.exists:
-        return session_data.to_dict().get('total_alcohol_g', 0)
-    return 0
-
-
-def get_user_id(request):
-    """Extract user ID from request (mock for hackathon)"""
-    # For hackathon, use anonymous ID if no auth
-    auth_header = request.headers.get('Authorization', '')
-    if auth_header.startswith('Bearer '):
-        try:
-            token = auth_header.split('Bearer ')[1]
-            decoded = auth.verify_id_token(token)
-            return decoded['uid']
-        except:
-            pass
-    
-    # Return demo user for hackathon
-    return "demo_user_001"
+    # Drink insert and session aggregate update in one transaction
+    session_id, _, stats = record_drink_in_active_session(user_id, drink_record)
+    return session_id, stats
 
 
 @functions_framework.http
@@ -892,13 +856,12 @@ def add_drink(request):
         )
         
         # Save to Firestore
-        session_id = get_or_create_session(user_id)
-        save_drink_record(user_id, session_id, data, alcohol_g)
+        session_id, session_stats = save_drink_record(user_id, data, alcohol_g)
         
         # Get Guardian check (ADK version)
         try:
             from agents.a2a_broker import get_broker, Message
-            from agents.guardian_adk import create_guardian_service
+            from agents.registry import get_guardian_service
             
             broker = get_broker()
             
@@ -915,17 +878,15 @@ def add_drink(request):
                 }
             )
             
-            # 同期的に実行
-            import asyncio
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(broker.publish(drink_added_msg))
-            
-            # Guardian分析を実行
-            guardian = create_guardian_service()
-            guardian_result = loop.run_until_complete(
-                guardian.analyze_drinking_pattern(user_id, session_id)
-            )
+            # A2A発行とGuardian分析を共有ループで並行実行
+            guardian = get_guardian_service()
+            results = run_stages({
+                "broker": broker.publish(drink_added_msg),
+                "guardian": guardian.analyze_drinking_pattern(user_id, session_id, stats=session_stats)
+            })
+            guardian_result = results["guardian"]
+            if isinstance(guardian_result, Exception):
+                raise guardian_result
         except Exception as e:
             logging.error(f"ADK Guardian error: {e}")
             # フォールバック
@@ -938,7 +899,7 @@ def add_drink(request):
             json.dumps({
                 "success": True,
                 "alcohol_g": alcohol_g,
-                "total_alcohol_g": get_session_total(user_id, session_id),
+                "total_alcohol_g": session_stats["total_alcohol_g"],
                 "guardian": guardian_result
             }, ensure_ascii=False),
             200
@@ -966,11 +927,10 @@ def start_session(request):
     try:
         user_id = get_user_id(request)
         
-        # Check for existing active session
-        sessions_ref = db.collection('users').document(user_id).collection('sessions')
-        active_sessions = sessions_ref.where('status', '==', 'active').limit(1).get()
+        # アクティブなセッションがなければトランザクションで作成
+        session_id, created = open_session(user_id)
         
-        if active_sessions:
+        if not created:
             return add_cors_headers(
                 json.dumps({
                     "code": "SESSION_EXISTS",
@@ -979,18 +939,6 @@ def start_session(request):
                 400
             )
         
-        # Create new session
-        session_data = {
-            'start_time': firestore.SERVER_TIMESTAMP,
-            'end_time': None,
-            'total_alcohol_g': 0,
-            'status': 'active',
-            'guardian_warnings': []
-        }
-        
-        doc_ref = sessions_ref.add(session_data)
-        session_id = doc_ref[1].id
-        
         return add_cors_headers(
             json.dumps({
                 "session_id": session_id,
@@ -1011,6 +959,45 @@ def start_session(request):
         )
 
 
+@functions_framework.http
+def end_session(request):
+    """End drinking session"""
+    if request.method == "OPTIONS":
+        return add_cors_headers("", 204)
+    
+    try:
+        user_id = get_user_id(request)
+        session_id = close_session(user_id)
+        
+        if not session_id:
+            return add_cors_headers(
+                json.dumps({
+                    "code": "NO_ACTIVE_SESSION",
+                    "message": "アクティブなセッションがありません"
+                }, ensure_ascii=False),
+                404
+            )
+        
+        return add_cors_headers(
+            json.dumps({
+                "session_id": session_id,
+                "end_time": datetime.now().isoformat(),
+                "message": "飲酒セッションを終了しました。お疲れさまでした！"
+            }, ensure_ascii=False),
+            200
+        )
+        
+    except Exception as e:
+        logging.error(f"Error ending session: {e}")
+        return add_cors_headers(
+            json.dumps({
+                "code": "INTERNAL_ERROR",
+                "message": str(e)
+            }),
+            500
+        )
+
+
 @functions_framework.http
 def get_current_session(request):
     """Get current session info"""
@@ -1020,11 +1007,10 @@ def get_current_session(request):
     try:
         user_id = get_user_id(request)
         
-        # Get active session
-        sessions_ref = db.collection('users').document(user_id).collection('sessions')
-        active_sessions = sessions_ref.where('status', '==', 'active').limit(1).get()
+        # Get active session（ポインタ経由でセッションドキュメント1件を読む）
+        session_id, session_data = get_active_session(user_id)
         
-        if not active_sessions:
+        if not session_id:
             return add_cors_headers(
                 json.dumps({
                     "active": False
@@ -1032,9 +1018,7 @@ def get_current_session(request):
                 200
             )
         
-        session = active_sessions[0]
-        session_id = session.id
-        session_data = session.to_dict()
+        sessions_ref = db.collection('users').document(user_id).collection('sessions')
         
         # Get drinks
         drinks_ref = sessions_ref.document(session_id).collection('drinks')
@@ -1042,21 +1026,21 @@ def get_current_session(request):
         for drink in drinks_ref.get():
             drink_data = drink.to_dict()
             drink_data['id'] = drink.id
+            # Firestore の Timestamp（datetime）はJSONにできないので文字列にする
+            if hasattr(drink_data.get('timestamp'), 'isoformat'):
+                drink_data['timestamp'] = drink_data['timestamp'].isoformat()
             drinks.append(drink_data)
         
-        # Get Guardian status
-        from guardian import GuardianAgent
-        guardian = GuardianAgent()
-        guardian_status = guardian.analyze_drinking_pattern(user_id, session_id)
+        # Get Guardian status (セッション集計から判定し、追加の読み取りを省く)
+        from agents.registry import get_rule_guardian
+        stats = get_session_stats(user_id, session_id, session_data=session_data)
+        guardian = get_rule_guardian()
+        guardian_status = guardian.analyze_drinking_pattern(user_id, session_id, stats)
         
         # Calculate duration
         start_time = session_data.get('start_time')
-        if hasattr(start_time, 'seconds'):
-            start_datetime = datetime.fromtimestamp(start_time.seconds)
-        else:
-            start_datetime = start_time or datetime.now()
-        
-        duration_minutes = int((datetime.now() - start_datetime).total_seconds() / 60)
+        start_datetime = session_start_datetime(start_time)
+        duration_minutes = int((datetime.now(timezone.utc) - start_datetime).total_seconds() / 60)
         
         return add_cors_headers(
             json.dumps({
@@ -1088,11 +1072,11 @@ def generate_recommendations(session_data):
     total_alcohol = session_data.get('total_alcohol_g', 0)
     
     if total_alcohol > 20:
-        return ["水分補給をしましょう", "そろそろ切り上げ時かも", "タクシーの手配をお勧めします"]
+        return list(SESSION_RECOMMENDATIONS["high"])
     elif total_alcohol > 10:
-        return ["水を飲みながら楽しみましょう", "おつまみも忘れずに"]
+        return list(SESSION_RECOMMENDATIONS["medium"])
     else:
-        return ["適度なペースで楽しみましょう"]
+        return list(SESSION_RECOMMENDATIONS["low"])
 
 
 @functions_framework.http 
@@ -1105,37 +1089,29 @@ def guardian_check(request):
         user_id = get_user_id(request)
         session_id = get_or_create_session(user_id)
         
-        from guardian import GuardianAgent, save_guardian_warning
-        guardian = GuardianAgent()
-        result = guardian.analyze_drinking_pattern(user_id, session_id)
+        # Get session stats (セッションドキュメント1件の読み取りのみ)
+        stats = get_session_stats(user_id, session_id) or {}
+        
+        from agents.registry import get_rule_guardian
+        from guardian import save_guardian_warning
+        guardian = get_rule_guardian()
+        result = guardian.analyze_drinking_pattern(user_id, session_id, stats)
         
         # Save warning if needed
         if result['color'] in ['orange', 'red']:
             save_guardian_warning(user_id, session_id, result)
         
-        # Get session stats
-        session_ref = db.collection('users').document(user_id).collection('sessions').document(session_id)
-        session_data = session_ref.get().to_dict()
-        
-        # Count drinks
-        drinks_ref = session_ref.collection('drinks')
-        drinks_count = len(drinks_ref.get())
-        
         # Calculate duration
-        start_time = session_data.get('start_time')
-        if hasattr(start_time, 'seconds'):
-            start_datetime = datetime.fromtimestamp(start_time.seconds)
-        else:
-            start_datetime = start_time or datetime.now()
-        
-        duration_minutes = int((datetime.now() - start_datetime).total_seconds() / 60)
+        start_time = stats.get('start_time')
+        start_datetime = session_start_datetime(start_time)
+        duration_minutes = int((datetime.now(timezone.utc) - start_datetime).total_seconds() / 60)
         
         return add_cors_headers(
             json.dumps({
                 "level": result,
                 "stats": {
-                    "total_alcohol_g": session_data.get('total_alcohol_g', 0),
-                    "drinks_count": drinks_count,
+                    "total_alcohol_g": stats.get('total_alcohol_g', 0),
+                    "drinks_count": stats.get('drink_count', 0),
                     "duration_minutes": duration_minutes
                 }
             }, ensure_ascii=False),
@@ -1154,74 +1130,10 @@ def guardian_check(request):
 
 # ========== TTS Helper Functions ==========
 
-def synthesize_speech_for_drink(text, voice_name=VOICE_NAME):
-    """テキストを音声に変換"""
-    synthesis_input = texttospeech.SynthesisInput(text=text)
-    
-    voice = texttospeech.VoiceSelectionParams(
-        language_code="ja-JP",
-        name=voice_name
-    )
-    
-    audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.MP3,
-        speaking_rate=1.0,
-        pitch=0.0
-    )
-    
-    response = tts_client.synthesize_speech(
-        input=synthesis_input,
-        voice=voice,
-        audio_config=audio_config
-    )
-    
-    return response.audio_content
-
-
-def upload_audio_to_storage_for_drink(audio_content, filename):
-    """音声データをCloud Storageにアップロード"""
-    blob = tts_bucket.blob(filename)
-    
-    # 既存チェック
-    if blob.exists():
-        logging.info(f"Audio file already exists: {filename}")
-        blob.make_public()
-        return blob.public_url
-    
-    # アップロード
-    blob.upload_from_string(
-        audio_content,
-        content_type="audio/mpeg"
-    )
-    
-    # キャッシュ設定
-    blob.cache_control = "public, max-age=86400"
-    blob.patch()
-    
-    # 公開設定
-    blob.make_public()
-    
-    return blob.public_url
-
-
 def generate_audio_response_for_drink(text, voice_name=VOICE_NAME):
     """テキストから音声URLを生成（キャッシュ対応）"""
-    # ファイル名をハッシュで生成
-    content_hash = hashlib.md5(f"{text}_{voice_name}".encode()).hexdigest()
-    filename = f"tts/{voice_name}/{content_hash}.mp3"
-    
-    # Cloud Storageに既存チェック
-    blob = tts_bucket.blob(filename)
-    if blob.exists():
-        logging.info(f"Using cached audio: {filename}")
-        blob.make_public()
-        return blob.public_url
-    
-    # 新規生成
     try:
-        audio_content = synthesize_speech_for_drink(text, voice_name)
-        audio_url = upload_audio_to_storage_for_drink(audio_content, filename)
-        return audio_url
+        return get_audio_url(text, voice_name)
     except Exception as e:
         logging.error(f"TTS generation error: {e}")
         return None
@@ -1300,9 +1212,6 @@ def drink(request):
         # 純アルコール量（g）= 飲酒量(ml) × アルコール度数(%) ÷ 100 × 0.8
         alcohol_g = volume * (alcohol_percentage / 100) * 0.8
         
-        # セッション取得または作成
-        session_id = get_or_create_session(user_id)
-        
         # 飲酒記録をFirestoreに保存
         drink_record = {
             'drink_type': drink_type,
@@ -1312,22 +1221,14 @@ def drink(request):
             'timestamp': firestore.SERVER_TIMESTAMP
         }
         
-        # Firestore に記録
-        session_ref = db.collection('users').document(user_id).collection('sessions').document(session_id)
-        drinks_ref = session_ref.collection('drinks')
-        doc_ref = drinks_ref.add(drink_record)
-        drink_id = doc_ref[1].id
-        
-        # セッションの総アルコール量を更新
-        session_ref.update({
-            'total_alcohol_g': firestore.Increment(alcohol_g)
-        })
+        # アクティブなセッション（なければ作成）に記録（セッション集計も同じトランザクションで更新）
+        session_id, drink_id, session_stats = record_drink_in_active_session(user_id, drink_record)
         
         # Guardian分析を実行
         guardian_result = None
         try:
             from agents.a2a_broker import get_broker, Message
-            from agents.guardian_adk import create_guardian_service
+            from agents.registry import get_guardian_service
             
             broker = get_broker()
             
@@ -1344,17 +1245,15 @@ def drink(request):
                 }
             )
             
-            # 同期的に実行
-            import asyncio
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(broker.publish(drink_added_msg))
-            
-            # Guardian分析を実行
-            guardian = create_guardian_service()
-            guardian_result = loop.run_until_complete(
-                guardian.analyze_drinking_pattern(user_id, session_id)
-            )
+            # A2A発行とGuardian分析を共有ループで並行実行
+            guardian = get_guardian_service()
+            results = run_stages({
+                "broker": broker.publish(drink_added_msg),
+                "guardian": guardian.analyze_drinking_pattern(user_id, session_id, stats=session_stats)
+            })
+            guardian_result = results["guardian"]
+            if isinstance(guardian_result, Exception):
+                raise guardian_result
         except Exception as e:
             logging.error(f"ADK Guardian error: {e}")
             # Guardian分析エラーでも飲酒記録は成功とする
@@ -1364,22 +1263,21 @@ def drink(request):
             }
         
         # Bartenderエージェントからのレスポンスメッセージを生成
-        response_message = f"{drink_type}を{volume}ml記録しました。"
+        response_message = format_phrase(DRINK_RECORDED_MESSAGE, drink_type, volume)
         
         # Guardian分析結果に基づいてメッセージを追加
         if guardian_result and guardian_result.get("level"):
             level_color = guardian_result["level"]["color"]
-            if level_color == "yellow":
-                response_message += " そろそろペースを落としましょうか。"
-            elif level_color == "red":
-                response_message += " 今日はもう十分飲みましたね。水分補給をお忘れなく。"
-            else:
-                response_message += " 良いペースですね。"
+            response_message += DRINK_RECORDED_SUFFIXES.get(level_color, DRINK_RECORDED_SUFFIXES["default"])
         
-        # 音声レスポンスを生成
+        # 音声レスポンスを生成（ttsMode="deferred" なら音声は /tts_audio で後から取得）
         audio_url = None
+        audio_job = None
         try:
-            audio_url = generate_audio_response_for_drink(response_message)
+            if request_json.get("ttsMode", "sync") == "deferred":
+                audio_job = submit_speech(response_message, VOICE_NAME)
+            else:
+                audio_url = generate_audio_response_for_drink(response_message)
         except Exception as e:
             logging.error(f"Audio generation error: {e}")
             # 音声生成エラーでも処理は継続
@@ -1408,6 +1306,8 @@ def drink(request):
         # 音声URLがある場合は追加
         if audio_url:
             response_data["audioUrl"] = audio_url
+        if audio_job:
+            response_data.update(audio_job)
         
         return add_cors_headers(
             json.dumps(response_data, ensure_ascii=False),
@@ -1432,4 +1332,4 @@ def drink(request):
 from bartender_standalone import bartender
 from guardian_monitor import guardian_monitor  
 from drinking_coach_analyze import drinking_coach_analyze
-from tts import tts
\ No newline at end of file
+from tts import tts, tts_audio
\ No newline at end of file
@@ -7,6 +7,7 @@ from main import (
     get_drinks_master,
     add_drink,
     start_session,
+    end_session,
     get_current_session,
     guardian_check,
     drink
@@ -16,7 +17,7 @@ from main import (
 from bartender import bartender
 from guardian_monitor import guardian_monitor
 from drinking_coach_analyze import drinking_coach_analyze
-from tts import tts
+from tts import tts, tts_audio
 
 # Make all functions available
 __all__ = [
@@ -25,11 +26,13 @@ __all__ = [
     'get_drinks_master',
     'add_drink',
     'start_session',
+    'end_session',
     'get_current_session',
     'guardian_check',
     'drink',
     'bartender',
     'guardian_monitor',
     'drinking_coach_analyze',
-    'tts'
+    'tts',
+    'tts_audio'
 ]
\ No newline at end of file
@@ -0,0 +1,131 @@
+"""
+Phrases - バックエンドが返す固定フレーズの定義
+音声の事前合成（prewarm_tts.py）で全フレーズを列挙できるよう、テンプレートをここに集約する
+"""
+from guardian_state import WARNING_LEVELS
+
+# ---------- /drink の飲み会風メッセージ（drink.py） ----------
+
+# ユーザーの発言に含まれるキーワード -> テンプレート
+PARTY_CONTEXT_MESSAGES = [
+    (("つかれ", "疲れ"), "お疲れ様！{drink_type}でリフレッシュだね！{volume}ml記録したよ〜"),
+    (("楽し", "最高"), "イェーイ！その調子！{drink_type}{volume}mlでさらに盛り上がろう！"),
+    (("おかわり", "もう一杯"), "おかわりきた〜！{drink_type}{volume}mlいっちゃう？いいね〜！"),
+]
+
+# Guardianの警告色ごとのテンプレート
+PARTY_LEVEL_MESSAGES = {
+    "red": [
+        "{drink_type}{volume}ml...って、ちょっと待って！今日はもう結構飲んでるよ？水飲も水！",
+        "おーい、{drink_type}はちょっとストップ！今は水タイムにしよ？体大事だよ〜",
+        "ま、まてまて！{drink_type}より水がいいって！明日のこと考えよ？"
+    ],
+    "orange": [
+        "{drink_type}{volume}mlね...そろそろペース落とさない？楽しく飲もうぜ〜",
+        "お、{drink_type}か〜。でもちょっとペース早くない？ゆっくり楽しもう！",
+        "{volume}mlっと...今日は長く楽しみたいよね？ちょっと休憩入れよ！"
+    ],
+    "yellow": [
+        "{drink_type}いいね！でも{volume}mlの後は、ちょっと水も飲んどこ？",
+        "おっけー{drink_type}{volume}ml！いいペースだけど、無理しないでね〜",
+        "{drink_type}記録！でもそろそろつまみも食べよ？胃に優しくね！"
+    ],
+}
+
+# 飲み始め
+PARTY_FIRST_DRINK_MESSAGES = [
+    "今日の一杯目！{drink_type}で乾杯〜！楽しい夜にしようぜ！",
+    "よーし飲み会スタート！{drink_type}{volume}mlからいくぞ〜！",
+    "待ってました！{drink_type}で始まり始まり〜！"
+]
+
+# 通常時
+PARTY_BASE_MESSAGES = [
+    "おっ！{drink_type}いいね〜！{volume}mlね、記録したよ！",
+    "{drink_type}キター！{volume}ml追加っと！",
+    "いえーい！{drink_type}{volume}ml入りました〜！",
+    "よっしゃ！{drink_type}で乾杯〜！{volume}ml記録！"
+]
+
+# ---------- /drink の記録メッセージ（main.py） ----------
+
+DRINK_RECORDED_MESSAGE = "{drink_type}を{volume}ml記録しました。"
+DRINK_RECORDED_SUFFIXES = {
+    "yellow": " そろそろペースを落としましょうか。",
+    "orange": " 飲み過ぎです。お水を挟んでひと休みしましょう。",
+    "red": " 今日はもう十分飲みましたね。水分補給をお忘れなく。",
+    "default": " 良いペースですね。"
+}
+
+# ---------- セッションの推奨事項（main.py） ----------
+
+SESSION_RECOMMENDATIONS = {
+    "high": ["水分補給をしましょう", "そろそろ切り上げ時かも", "タクシーの手配をお勧めします"],
+    "medium": ["水を飲みながら楽しみましょう", "おつまみも忘れずに"],
+    "low": ["適度なペースで楽しみましょう"]
+}
+
+# ---------- Bartenderのフォールバック応答（main.py） ----------
+
+BARTENDER_EMPTY_RESPONSE = "すみません、ちょっと聞き取れませんでした。"
+BARTENDER_FALLBACK_RESPONSE = "すみません、ちょっと聞き取れませんでした。もう一度お願いできますか？"
+
+# ---------- 事前合成の対象 ----------
+
+# フロントエンドの選択肢とドリンクマスターの飲み物、よく使われる量（ml）
+PREWARM_DRINKS = {
+    "ビール": [350, 500],
+    "ハイボール": [350, 500],
+    "その他": [100, 200, 350],
+    "ワイン": [125],
+    "日本酒": [180],
+    "焼酎水割り": [200],
+    "カクテル": [100],
+}
+
+
+def format_phrase(template, drink_type, volume):
+    """テンプレートに飲み物と量を埋め込む"""
+    return template.format(drink_type=drink_type, volume=volume)
+
+
+def iter_drink_templates():
+    """飲み物・量を埋め込む全テンプレート"""
+    for _, template in PARTY_CONTEXT_MESSAGES:
+        yield template
+    for templates in PARTY_LEVEL_MESSAGES.values():
+        yield from templates
+    yield from PARTY_FIRST_DRINK_MESSAGES
+    yield from PARTY_BASE_MESSAGES
+
+    yield DRINK_RECORDED_MESSAGE
+    for suffix in DRINK_RECORDED_SUFFIXES.values():
+        yield DRINK_RECORDED_MESSAGE + suffix
+
+
+def iter_static_phrases(drinks=None):
+    """
+    バックエンドが音声化しうる固定フレーズを全て列挙する
+
+    Args:
+        drinks: 飲み物名 -> 量(ml)のリスト（省略時は PREWARM_DRINKS）
+    """
+    drinks = drinks or PREWARM_DRINKS
+    phrases = set()
+
+    # ハンドラは量をfloatで受け取ってそのまま埋め込むため、同じ書式で展開する
+    for template in iter_drink_templates():
+        for drink_type, volumes in drinks.items():
+            for volume in volumes:
+                phrases.add(format_phrase(template, drink_type, float(volume)))
+
+    for recommendations in SESSION_RECOMMENDATIONS.values():
+        phrases.update(recommendations)
+
+    phrases.add(BARTENDER_EMPTY_RESPONSE)
+    phrases.add(BARTENDER_FALLBACK_RESPONSE)
+
+    # Guardianの警告メッセージ
+    phrases.update(level["message"] for level in WARNING_LEVELS.values())
+
+    return sorted(phrases)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+固定フレーズの音声をデプロイ前に事前合成する
+phrases.py のテンプレートを展開してTTSキャッシュ（GCS）に載せ、
+関数に同梱するマニフェスト（tts_manifest.json）を書き出す
+
+    STORAGE_BUCKET=<bucket> python prewarm_tts.py --concurrency 8
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import firebase_admin
+
+if not firebase_admin._apps:
+    firebase_admin.initialize_app()
+
+from phrases import iter_static_phrases
+from tts_cache import TTS_MANIFEST_PATH, VOICE_NAME, audio_cache_key, get_tts_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-synthesize static TTS phrases")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--voice", default=VOICE_NAME)
+    parser.add_argument("--output", default=TTS_MANIFEST_PATH, help="manifest path")
+    parser.add_argument("--dry-run", action="store_true", help="list phrases without synthesizing")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    phrases = iter_static_phrases()
+
+    if args.dry_run:
+        for text in phrases:
+            print(f"{audio_cache_key(text, args.voice)}  {text}")
+        print(f"\n{len(phrases)} phrases")
+        return 0
+
+    cache = get_tts_cache()
+    entries = {}
+    synthesized = 0
+    failures = 0
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = {
+            executor.submit(cache.get_or_synthesize, text, args.voice): text
+            for text in phrases
+        }
+        for future in as_completed(futures):
+            text = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"❌ {text}: {e}", file=sys.stderr)
+                continue
+            entries[result["filename"]] = result["url"]
+            if not result["cached"]:
+                synthesized += 1
+
+    manifest = {
+        "voice": args.voice,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "entries": dict(sorted(entries.items()))
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {len(entries)} phrases ready ({synthesized} synthesized, "
+          f"{len(entries) - synthesized} cached, {failures} failed) in {elapsed:.1f}s")
+    print(f"📝 Manifest: {args.output}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
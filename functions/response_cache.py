@@ -0,0 +1,155 @@
+"""
+Response Cache - 定型メッセージへのBartender応答キャッシュ
+キー: 正規化したユーザーメッセージ + 時間帯（時） + Guardianレベル
+キーごとに複数の応答（バリエーション）を持ち、毎回同じ文面にならないようにする
+（最初の応答が保存された時点から返し、ヒットの一部だけミス扱いにしてバリエーションを増やす）
+ヒット時はGeminiもTTSも呼ばない（音声URLも一緒に保持する）
+"""
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+RESPONSE_CACHE_MAX_KEYS = int(os.getenv("RESPONSE_CACHE_MAX_KEYS", "512"))
+RESPONSE_CACHE_VARIANTS = int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+# バリエーションがそろうまで、ヒットのうちこの割合をミス扱いにして新しい応答を作らせる
+RESPONSE_CACHE_FILL_RATE = float(os.getenv("RESPONSE_CACHE_FILL_RATE", "0.3"))
+# これより長いメッセージは一期一会なのでキャッシュしない
+RESPONSE_CACHE_MAX_MESSAGE_CHARS = 20
+
+# 末尾・前後の記号や空白（「乾杯！！」「おすすめは？」の揺れを吸収）
+_TRIM_PATTERN = re.compile(r"^[\s!?.,。、！？…~〜ー♪☆★]+|[\s!?.,。、！？…~〜ー♪☆★笑]+$")
+_SPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_message(message):
+    """全角半角・大文字小文字・前後の記号の違いを吸収した文字列"""
+    text = unicodedata.normalize("NFKC", message or "").lower()
+    text = _SPACE_PATTERN.sub(" ", text)
+    return _TRIM_PATTERN.sub("", text)
+
+
+def response_cache_key(message, hour, guardian_level="green"):
+    """
+    キャッシュキーを返す（キャッシュ対象外のメッセージなら None）
+    """
+    normalized = normalize_message(message)
+    if not normalized or len(normalized) > RESPONSE_CACHE_MAX_MESSAGE_CHARS:
+        return None
+    return (normalized, hour, guardian_level or "green")
+
+
+class ResponseCache:
+    """キーごとに最大 variants 件の応答を持つLRU"""
+
+    def __init__(self, max_keys=RESPONSE_CACHE_MAX_KEYS, variants=RESPONSE_CACHE_VARIANTS,
+                 ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, fill_rate=RESPONSE_CACHE_FILL_RATE):
+        self.max_keys = max_keys
+        self.variants = variants
+        self.ttl_seconds = ttl_seconds
+        self.fill_rate = fill_rate
+
+        self._entries = OrderedDict()  # key -> [{"message", "audio_url", "expires_at"}, ...]
+        self._last_served = {}  # key -> 直前に返したバリエーションの番号
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "fills": 0,
+            "uncacheable": 0
+        }
+
+    def get(self, key):
+        """
+        キャッシュ済みの応答を返す（なければ None）
+
+        バリエーションがそろうまでは fill_rate の割合でミス扱いにして新しい応答を作らせる
+        Returns:
+            {"message", "audio_url"}
+        """
+        if key is None:
+            with self._lock:
+                self._counters["uncacheable"] += 1
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            variants = [v for v in self._entries.get(key, []) if v["expires_at"] > now]
+            if not variants:
+                self._entries.pop(key, None)
+                self._last_served.pop(key, None)
+                self._counters["misses"] += 1
+                return None
+
+            self._entries[key] = variants
+            if len(variants) < self.variants and random.random() < self.fill_rate:
+                self._counters["fills"] += 1
+                self._counters["misses"] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            # 直前と同じ文面は避ける（1件しかなければそれを返す）
+            choices = [i for i in range(len(variants)) if i != self._last_served.get(key)] or [0]
+            index = random.choice(choices)
+            self._last_served[key] = index
+            self._counters["hits"] += 1
+            variant = variants[index]
+            return {"message": variant["message"], "audio_url": variant["audio_url"]}
+
+    def put(self, key, message, audio_url=None):
+        """応答をバリエーションとして追加（そろっていれば何もしない）"""
+        if key is None or not message:
+            return
+        with self._lock:
+            variants = self._entries.setdefault(key, [])
+            if len(variants) >= self.variants:
+                return
+            variants.append({
+                "message": message,
+                "audio_url": audio_url,
+                "expires_at": time.monotonic() + self.ttl_seconds
+            })
+            self._entries.move_to_end(key)
+            self._counters["stores"] += 1
+            while len(self._entries) > self.max_keys:
+                evicted, _ = self._entries.popitem(last=False)
+                self._last_served.pop(evicted, None)
+
+    def attach_audio(self, key, message, audio_url):
+        """音声なしで保存したバリエーションに音声URLを付ける"""
+        if key is None or not audio_url:
+            return
+        with self._lock:
+            for variant in self._entries.get(key, []):
+                if variant["message"] == message and not variant["audio_url"]:
+                    variant["audio_url"] = audio_url
+
+    def stats(self):
+        """ヒット率などのメトリクス"""
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "keys": len(self._entries),
+                "hit_rate": self._counters["hits"] / lookups if lookups else 0.0
+            }
+
+
+# シングルトンインスタンス
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """プロセス共有の応答キャッシュを取得"""
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = ResponseCache()
+    return _cache_instance
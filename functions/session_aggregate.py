@@ -0,0 +1,258 @@
+"""
+Session Aggregate - セッション集計ドキュメントの管理
+飲酒記録の追加と同じトランザクションでセッションドキュメント上の集計値を更新し、
+drinksサブコレクションを走査せずにセッション統計を返す
+"""
+import logging
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+from guardian_analysis_cache import get_analysis_cache
+from guardian_state import GuardianState, current_level, get_state_store
+
+# Firestore client（初回利用時に生成される共有クライアント）
+from clients import db
+
+# 集計するローリングウィンドウ（分）
+WINDOW_MINUTES = (30, 60)
+# recent_drinks に保持する期間（最大ウィンドウ分だけ保持）
+RECENT_DRINKS_RETENTION_SECONDS = max(WINDOW_MINUTES) * 60
+
+
+class SessionNotActive(Exception):
+    """記録先のセッションが既に終了している（別インスタンスで終了された）"""
+
+    def __init__(self, session_id):
+        super().__init__(f"Session {session_id} is not active")
+        self.session_id = session_id
+
+
+def _session_ref(user_id, session_id):
+    return db.collection('users').document(user_id).collection('sessions').document(session_id)
+
+
+def _to_epoch(value):
+    """Firestore Timestamp / datetime / ISO文字列 / 数値をUNIX秒に変換"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if hasattr(value, 'seconds'):
+        return float(value.seconds)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return None
+
+
+def session_version(session_data):
+    """セッションのバージョン（飲酒記録の書き込みごとに増える。導入前のセッションは杯数）"""
+    return session_data.get('version', session_data.get('drink_count', 0))
+
+
+def _now_epoch(now=None):
+    return _to_epoch(now) if now is not None else datetime.now(timezone.utc).timestamp()
+
+
+def summarize_windows(recent_drinks, now=None):
+    """直近30/60分のウィンドウ集計を計算"""
+    now_ts = _now_epoch(now)
+    summary = {}
+    for minutes in WINDOW_MINUTES:
+        threshold = now_ts - minutes * 60
+        in_window = [d for d in recent_drinks if d['t'] >= threshold]
+        summary[f"last_{minutes}min"] = {
+            'drinks': len(in_window),
+            'alcohol_g': sum(d['g'] for d in in_window)
+        }
+    return summary
+
+
+def initial_session_aggregate():
+    """新規セッション作成時に設定する集計フィールド"""
+    return {
+        'drink_count': 0,
+        'total_alcohol_g': 0,
+        'first_drink_at': None,
+        'last_drink_at': None,
+        'drink_type_counts': {},
+        'recent_drinks': [],
+        'window_summary': summarize_windows([]),
+        'guardian_level': None,
+        'version': 0
+    }
+
+
+def aggregate_from_drinks(drinks, total_alcohol_g=None, now=None):
+    """drinksの一覧から集計フィールドを再構築（集計導入前のセッション用）"""
+    now_ts = _now_epoch(now)
+    drink_count = 0
+    alcohol_sum = 0
+    type_counts = {}
+    times = []
+    recent = []
+
+    for drink in drinks:
+        drink_count += 1
+        alcohol_g = float(drink.get('alcohol_g', 0) or 0)
+        alcohol_sum += alcohol_g
+        drink_type = drink.get('drink_type', 'unknown')
+        type_counts[drink_type] = type_counts.get(drink_type, 0) + 1
+
+        drink_ts = _to_epoch(drink.get('timestamp'))
+        if drink_ts is None:
+            continue
+        times.append(drink_ts)
+        if now_ts - drink_ts <= RECENT_DRINKS_RETENTION_SECONDS:
+            recent.append({'t': drink_ts, 'g': alcohol_g})
+
+    recent.sort(key=lambda d: d['t'])
+
+    return {
+        'drink_count': drink_count,
+        'total_alcohol_g': alcohol_sum if total_alcohol_g is None else total_alcohol_g,
+        'first_drink_at': datetime.fromtimestamp(min(times), tz=timezone.utc) if times else None,
+        'last_drink_at': datetime.fromtimestamp(max(times), tz=timezone.utc) if times else None,
+        'drink_type_counts': type_counts,
+        'recent_drinks': recent,
+        'window_summary': summarize_windows(recent, now_ts)
+    }
+
+
+def apply_drink(session_data, drink_record, now=None):
+    """飲酒1件を反映した集計フィールドの更新内容を返す"""
+    now_dt = now or datetime.now(timezone.utc)
+    now_ts = _to_epoch(now_dt)
+    alcohol_g = float(drink_record.get('alcohol_g', 0) or 0)
+    drink_type = drink_record.get('drink_type', 'unknown')
+
+    type_counts = dict(session_data.get('drink_type_counts') or {})
+    type_counts[drink_type] = type_counts.get(drink_type, 0) + 1
+
+    # 保持期間を過ぎたものを捨ててから追加
+    recent = [
+        d for d in (session_data.get('recent_drinks') or [])
+        if now_ts - d['t'] <= RECENT_DRINKS_RETENTION_SECONDS
+    ]
+    recent.append({'t': now_ts, 'g': alcohol_g})
+
+    return {
+        'drink_count': session_data.get('drink_count', 0) + 1,
+        'total_alcohol_g': session_data.get('total_alcohol_g', 0) + alcohol_g,
+        'first_drink_at': session_data.get('first_drink_at') or now_dt,
+        'last_drink_at': now_dt,
+        'drink_type_counts': type_counts,
+        'recent_drinks': recent,
+        'window_summary': summarize_windows(recent, now_ts),
+        'version': session_version(session_data) + 1
+    }
+
+
+def stats_from_session_data(session_data, now=None):
+    """セッションドキュメントから統計を組み立てる（追加の読み取りなし）"""
+    recent = session_data.get('recent_drinks') or []
+    return {
+        'drink_count': session_data.get('drink_count', 0),
+        'total_alcohol_g': session_data.get('total_alcohol_g', 0),
+        'first_drink_at': session_data.get('first_drink_at'),
+        'last_drink_at': session_data.get('last_drink_at'),
+        'drink_type_counts': dict(session_data.get('drink_type_counts') or {}),
+        # ウィンドウは読み取り時点の時刻で再計算する
+        'window_summary': summarize_windows(recent, now),
+        'start_time': session_data.get('start_time'),
+        'status': session_data.get('status'),
+        # 飲酒追加時に保存した判定（期限切れならここで再計算）
+        'guardian_level': current_level(session_data, now),
+        'version': session_version(session_data)
+    }
+
+
+def _has_aggregate(session_data):
+    return 'drink_count' in session_data
+
+
+@firestore.transactional
+def _record_drink_in_transaction(transaction, session_id, session_ref, drink_ref, drink_record, now):
+    snapshot = session_ref.get(transaction=transaction)
+    session_data = snapshot.to_dict() if snapshot.exists else {}
+    # ポインタのキャッシュが古いと終了済みのセッションに記録してしまう
+    if session_data.get('status', 'active') != 'active':
+        raise SessionNotActive(session_id)
+
+    if not _has_aggregate(session_data):
+        # 集計導入前のセッションは一度だけdrinksから再構築
+        drinks = [doc.to_dict() for doc in transaction.get(session_ref.collection('drinks'))]
+        session_data.update(
+            aggregate_from_drinks(drinks, session_data.get('total_alcohol_g'), now)
+        )
+
+    update = apply_drink(session_data, drink_record, now)
+    # Guardian判定をイベント駆動で更新し、集計と同じ書き込みで保存する
+    # 再試行されても前の試行の飲酒が残らないよう、毎回このドキュメントから組み立てる
+    state = GuardianState.from_session_data(session_data)
+    update['guardian_level'] = state.add_drink(now, float(drink_record.get('alcohol_g', 0) or 0))
+
+    transaction.create(drink_ref, drink_record)
+    if snapshot.exists:
+        transaction.update(session_ref, update)
+    else:
+        transaction.set(session_ref, update, merge=True)
+
+    session_data.update(update)
+    return stats_from_session_data(session_data, now), state
+
+
+def record_drink(user_id, session_id, drink_record, now=None):
+    """
+    飲酒記録の追加とセッション集計の更新を1トランザクションで実行
+
+    Returns:
+        (drink_id, 追加後のセッション統計)
+
+    Raises:
+        SessionNotActive: セッションが終了済みの場合（何も書き込まない）
+    """
+    now = now or datetime.now(timezone.utc)
+    session_ref = _session_ref(user_id, session_id)
+    drink_ref = session_ref.collection('drinks').document()
+
+    stats, state = _record_drink_in_transaction(
+        db.transaction(), session_id, session_ref, drink_ref, drink_record, now
+    )
+    get_state_store().on_drink_committed(user_id, session_id, state)
+    # 前のバージョンのGuardian分析は使えなくなる（Firestore側はバージョン違いで読まれないので消さない）
+    get_analysis_cache().invalidate(user_id, session_id, shared=False)
+    logging.info(
+        f"Drink recorded: session={session_id}, drink_count={stats['drink_count']}, "
+        f"total_alcohol_g={stats['total_alcohol_g']:.1f}"
+    )
+    return drink_ref.id, stats
+
+
+def get_session_stats(user_id, session_id, session_data=None, now=None):
+    """
+    セッション統計を取得（セッションドキュメント1件の読み取りのみ）
+
+    session_data を渡した場合は読み取りも省略する。
+    セッションが存在しない場合は None を返す。
+    """
+    if session_data is None:
+        session_doc = _session_ref(user_id, session_id).get()
+        if not session_doc.exists:
+            return None
+        session_data = session_doc.to_dict()
+
+    if not _has_aggregate(session_data):
+        # 集計導入前のセッション: drinksを走査して組み立てる
+        drinks_ref = _session_ref(user_id, session_id).collection('drinks')
+        drinks = [doc.to_dict() for doc in drinks_ref.stream()]
+        session_data = {
+            **session_data,
+            **aggregate_from_drinks(drinks, session_data.get('total_alcohol_g'), now)
+        }
+
+    return stats_from_session_data(session_data, now)
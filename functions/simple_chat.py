@@ -2,6 +2,8 @@ import json
 import functions_framework
 from datetime import datetime
 
+from response_cache import normalize_message
+
 @functions_framework.http
 def simple_chat(request):
     """シンプルなテスト用チャットエンドポイント"""
@@ -29,8 +31,8 @@ def simple_chat(request):
             "日本酒": "日本酒もいいですね。熱燗と冷酒、どちらにしましょう？",
         }
         
-        # デフォルトの返答
-        bartender_response = responses.get(user_message, 
+        # デフォルトの返答（「ビール！」「こんにちは〜」などの表記揺れも同じ返答にする）
+        bartender_response = responses.get(normalize_message(user_message), 
             f"「{user_message}」ですね。今日はゆっくりお酒を楽しみましょう！")
         
         # レスポンスの構築
@@ -5,11 +5,14 @@ Simple local server for testing AlcoGuardian backend
 import os
 import json
 import random
+import time
 import uuid
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 
+from chat_stream import SSE_HEADERS, stream_chat_events
+
 # Set environment variables
 os.environ['GCP_PROJECT'] = 'alco-guardian-test-local'
 os.environ['DISABLE_AUTH'] = 'true'
@@ -70,6 +73,12 @@ def transcribe():
         "message": "音声を正常に文字起こししました"
     })
 
+def stub_stream(text, chunk_chars=4, delay=0.05):
+    """Geminiのストリーミング出力の代わりに、数文字ずつ間隔をあけて返す"""
+    for i in range(0, len(text), chunk_chars):
+        time.sleep(delay)
+        yield text[i:i + chunk_chars]
+
 @app.route('/chat', methods=['POST', 'OPTIONS'])
 def chat():
     if request.method == 'OPTIONS':
@@ -88,6 +97,14 @@ def chat():
     import random
     response = random.choice(responses)
     
+    # ストリーミングモード: スタブのモデルで数文字ずつ送る（ローカルでは文ごとの音声は作らない）
+    if data.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+        events = stream_chat_events(
+            stub_stream(response),
+            extra={"imageId": random.randint(1, 10), "agent": "bartender"}
+        )
+        return Response(events, headers=SSE_HEADERS)
+    
     return jsonify({
         "success": True,
         "message": response,
@@ -304,7 +321,7 @@ if __name__ == '__main__':
     print("\nAvailable endpoints:")
     print("  GET  /health")
     print("  GET  /get_drinks_master")
-    print("  POST /chat")
+    print("  POST /chat  (\"stream\": true for server-sent events)")
     print("  POST /start_session")
     print("  POST /add_drink")
     print("  GET  /get_current_session")
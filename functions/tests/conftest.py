@@ -0,0 +1,30 @@
+"""
+単体テストの共通設定
+Firestore・GCS・TTS・Gemini はインメモリのフェイク（fake_backends）に置き換える。
+モジュールの import 時に @firestore.transactional が適用されるため、テスト対象より先に差し替える
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_backends import install_fake_backends  # noqa: E402
+
+install_fake_backends()
+
+# デプロイ済みのエンドポイントを叩く結合テスト用スクリプト（手動で実行する）
+collect_ignore = [
+    "backend_integration_test.py",
+    "simple_test.py",
+    "test_drink_endpoint.py",
+    "test_with_firebase_auth.py",
+]
+
+
+@pytest.fixture
+def user_id():
+    """テストごとに別のユーザー（フェイクのFirestoreはプロセスで共有される）"""
+    return f"test-{uuid.uuid4().hex[:12]}"
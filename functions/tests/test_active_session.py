@@ -0,0 +1,90 @@
+import pytest
+
+import active_session
+from active_session import (
+    close_session,
+    get_active_session,
+    get_active_session_id,
+    get_or_create_session,
+    open_session,
+    record_drink_in_active_session,
+)
+from fake_backends import count_calls
+
+
+@pytest.fixture(autouse=True)
+def clear_pointer_cache():
+    with active_session._cache_lock:
+        active_session._cache.clear()
+
+
+def _drink():
+    return {"drink_type": "beer", "alcohol_g": 14.0, "timestamp": None}
+
+
+def test_open_creates_one_session_per_user(user_id):
+    session_id, created = open_session(user_id)
+    assert created
+
+    assert open_session(user_id) == (session_id, False)
+    assert get_or_create_session(user_id) == session_id
+    assert get_active_session_id(user_id) == session_id
+
+
+def test_close_clears_pointer(user_id):
+    session_id, _ = open_session(user_id)
+
+    assert close_session(user_id) == session_id
+    assert get_active_session_id(user_id) is None
+    assert get_active_session(user_id) == (None, None)
+    assert close_session(user_id) is None
+
+
+def test_get_active_session_returns_document(user_id):
+    session_id, _ = open_session(user_id)
+
+    found_id, session_data = get_active_session(user_id)
+    assert found_id == session_id
+    assert session_data["status"] == "active"
+    assert session_data["drink_count"] == 0
+
+
+def test_resolve_is_served_from_memory(user_id):
+    session_id, _ = open_session(user_id)
+    with count_calls() as calls:
+        assert get_active_session_id(user_id) == session_id
+    assert calls.get("firestore", 0) == 0
+
+
+def test_missing_pointer_is_cached(user_id):
+    assert get_active_session_id(user_id) is None
+    with count_calls() as calls:
+        assert get_active_session_id(user_id) is None
+    assert calls.get("firestore", 0) == 0
+
+    # 作成する場合はキャッシュされた「なし」を使わない
+    assert get_or_create_session(user_id) is not None
+
+
+def test_stale_pointer_from_another_instance_is_re_resolved(user_id):
+    old_session_id, _ = open_session(user_id)
+    close_session(user_id)
+    # 別インスタンスで終了された: このプロセスのキャッシュだけ古いまま残っている
+    active_session._cache_put(user_id, old_session_id)
+
+    session_id, drink_id, stats = record_drink_in_active_session(user_id, _drink())
+    assert session_id != old_session_id
+    assert drink_id
+    assert stats["drink_count"] == 1
+    assert get_active_session_id(user_id) == session_id
+
+
+def test_open_session_does_not_report_a_stale_pointer_as_existing(user_id):
+    old_session_id, _ = open_session(user_id)
+    close_session(user_id)
+    active_session._cache_put(user_id, old_session_id)
+
+    session_id, created = open_session(user_id)
+    assert created
+    assert session_id != old_session_id
+    assert get_or_create_session(user_id) == session_id
@@ -0,0 +1,34 @@
+from chat_stream import SentenceSplitter
+
+
+def test_splits_on_japanese_sentence_ends():
+    splitter = SentenceSplitter()
+    assert splitter.feed("こんばんは。今日は") == ["こんばんは。"]
+    assert splitter.feed("何にしますか？おすすめは") == ["今日は何にしますか？"]
+    assert splitter.flush() == ["おすすめは"]
+    assert splitter.flush() == []
+
+
+def test_waits_for_trailing_marks_at_chunk_end():
+    splitter = SentenceSplitter()
+    # 末尾の記号の後に「！」や閉じ括弧が続くかもしれないので、まだ返さない
+    assert splitter.feed("いいね！") == []
+    assert splitter.feed("！") == []
+    assert splitter.feed("」次は") == ["いいね！！」"]
+    assert splitter.flush() == ["次は"]
+
+
+def test_multiple_sentences_in_one_chunk():
+    splitter = SentenceSplitter()
+    assert splitter.feed("乾杯！ゆっくり飲もう。お水もね\n") == ["乾杯！", "ゆっくり飲もう。"]
+    assert splitter.flush() == ["お水もね"]
+
+
+def test_sentences_concatenate_to_input():
+    text = "はい。ビールですね！冷えてますよ？どうぞ"
+    splitter = SentenceSplitter()
+    sentences = []
+    for start in range(0, len(text), 3):
+        sentences.extend(splitter.feed(text[start:start + 3]))
+    sentences.extend(splitter.flush())
+    assert "".join(sentences) == text
@@ -0,0 +1,50 @@
+import time
+
+import pytest
+
+from agents.conversation_memory import ConversationMemory
+
+SESSION_ID = "session-1"
+
+
+def _summarize(summary, turns):
+    return ",".join(([summary] if summary else []) + [t["user"] for t in turns])
+
+
+@pytest.fixture
+def memory():
+    # 要約は自動では走らせず、テストから呼ぶ
+    memory = ConversationMemory(max_turns=2, summarizer=_summarize, summary_every=100)
+    yield memory
+    memory.writer.close()
+
+
+def _append(memory, user_id, *messages):
+    for message in messages:
+        memory.append(user_id, SESSION_ID, message, "reply")
+        # 同じ時刻のターンができないようにする
+        time.sleep(0.002)
+
+
+def _reload(memory, user_id):
+    memory.writer.flush()
+    return ConversationMemory(max_turns=2, summarizer=_summarize, summary_every=100)._get_buffer(user_id, SESSION_ID)
+
+
+def test_load_keeps_turns_that_were_never_summarized(memory, user_id):
+    _append(memory, user_id, "m0", "m1", "m2", "m3", "m4")
+
+    buffer = _reload(memory, user_id)
+    assert [t["user"] for t in buffer.turns] == ["m3", "m4"]
+    assert [t["user"] for t in buffer.unsummarized] == ["m0", "m1", "m2"]
+
+
+def test_load_resumes_after_summary_through(memory, user_id):
+    _append(memory, user_id, "m0", "m1", "m2", "m3")
+    memory._refresh_summary(user_id, memory._get_buffer(user_id, SESSION_ID))
+    _append(memory, user_id, "m4")
+
+    buffer = _reload(memory, user_id)
+    assert buffer.summary == "m0,m1"
+    assert [t["user"] for t in buffer.turns] == ["m3", "m4"]
+    assert [t["user"] for t in buffer.unsummarized] == ["m2"]
@@ -0,0 +1,37 @@
+import asyncio
+import json
+
+from agents.guardian_schema import GUARDIAN_RESPONSE_SCHEMA, parse_guardian_response
+from fake_backends import FakeGenerationConfig, FakeGenerativeModel
+
+
+def _json_model():
+    return FakeGenerativeModel(
+        "gemini-test",
+        generation_config=FakeGenerationConfig(
+            response_mime_type="application/json", response_schema=GUARDIAN_RESPONSE_SCHEMA
+        ),
+    )
+
+
+def test_generate_content_async_returns_schema_valid_json():
+    response = asyncio.run(_json_model().generate_content_async("prompt"))
+    assessment = parse_guardian_response(response.text)
+    assert assessment.level in GUARDIAN_RESPONSE_SCHEMA["properties"]["level"]["enum"]
+
+
+def test_async_and_sync_replies_match():
+    model = _json_model()
+    sync_reply = json.loads(model.generate_content("prompt").text)
+    async_reply = json.loads(asyncio.run(model.generate_content_async("prompt")).text)
+    assert sync_reply == async_reply
+
+
+def test_generate_content_async_streams_chunks():
+    async def collect():
+        stream = await FakeGenerativeModel("gemini-test").generate_content_async("prompt", stream=True)
+        return [chunk.text async for chunk in stream]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) > 1
+    assert "".join(chunks) == FakeGenerativeModel("gemini-test").generate_content("prompt").text
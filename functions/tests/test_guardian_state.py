@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+
+from guardian_state import (
+    DAILY_LIMIT_G,
+    PACE_WINDOW_SECONDS,
+    GuardianState,
+    GuardianStateStore,
+    current_level,
+    evaluate_level,
+)
+
+START = datetime(2026, 1, 1, 20, 0, tzinfo=timezone.utc)
+
+
+def test_evaluate_level_thresholds():
+    assert evaluate_level(0, 0) == "ok"
+    assert evaluate_level(DAILY_LIMIT_G, 1) == "ok"
+    assert evaluate_level(10, 2) == "caution"
+    assert evaluate_level(DAILY_LIMIT_G + 0.1, 0) == "warning"
+    assert evaluate_level(DAILY_LIMIT_G * 1.5, 0) == "warning"
+    assert evaluate_level(DAILY_LIMIT_G * 1.5 + 0.1, 0) == "stop"
+
+
+def test_total_takes_priority_over_pace():
+    assert evaluate_level(DAILY_LIMIT_G + 1, 5) == "warning"
+
+
+def test_pace_caution_expires_when_drinks_leave_window():
+    state = GuardianState()
+    assert state.add_drink(START, 5)["level"] == "ok"
+
+    level = state.add_drink(START + timedelta(minutes=10), 5)
+    assert level["level"] == "caution"
+    assert level["color"] == "orange"
+    assert level["valid_until"] == START.timestamp() + PACE_WINDOW_SECONDS
+
+    later = START + timedelta(seconds=PACE_WINDOW_SECONDS + 1)
+    assert state.level(later)["level"] == "ok"
+    assert state.window_alcohol_g == 5
+
+
+def test_current_level_recomputes_after_valid_until():
+    state = GuardianState()
+    state.add_drink(START, 5)
+    stored = state.add_drink(START + timedelta(minutes=1), 5)
+    session_data = {
+        "total_alcohol_g": 10,
+        "drink_count": 2,
+        "recent_drinks": [{"t": START.timestamp(), "g": 5}, {"t": START.timestamp() + 60, "g": 5}],
+        "guardian_level": stored,
+    }
+
+    assert current_level(session_data, START + timedelta(minutes=5)) is stored
+    expired = current_level(session_data, START + timedelta(minutes=40))
+    assert expired["level"] == "ok"
+
+
+def test_store_keeps_committed_state():
+    store = GuardianStateStore()
+    state = GuardianState()
+    state.add_drink(START, 14)
+    store.on_drink_committed("u", "s", state)
+
+    assert store.get("u", "s") is state
+    store.forget("u", "s")
+    assert store.get("u", "s") is None
+
+
+def test_store_evicts_least_recent_session():
+    store = GuardianStateStore(max_sessions=2)
+    for session_id in ("a", "b", "c"):
+        store.on_drink_committed("u", session_id, GuardianState())
+    assert list(store._states) == [("u", "b"), ("u", "c")]
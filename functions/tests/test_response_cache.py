@@ -0,0 +1,94 @@
+import types
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, normalize_message, response_cache_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache, "time", types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def test_normalize_message_absorbs_width_case_and_punctuation():
+    assert normalize_message("乾杯！！") == normalize_message("乾杯")
+    assert normalize_message("ＯＳＵＳＵＭＥは？") == "osusumeは"
+
+
+def test_key_is_none_for_long_or_empty_messages():
+    assert response_cache_key("", 20) is None
+    assert response_cache_key("あ" * 21, 20) is None
+    assert response_cache_key("乾杯", 20, None) == ("乾杯", 20, "green")
+
+
+def test_miss_until_first_variant_is_stored(clock):
+    cache = ResponseCache(variants=3, fill_rate=0)
+    key = response_cache_key("乾杯", 20)
+
+    assert cache.get(key) is None
+    cache.put(key, "かんぱい！", "https://example.com/a.mp3")
+    assert cache.get(key) == {"message": "かんぱい！", "audio_url": "https://example.com/a.mp3"}
+
+
+def test_fill_rate_turns_hits_into_misses_until_variants_are_complete(clock):
+    cache = ResponseCache(variants=2, fill_rate=1.0)
+    key = response_cache_key("乾杯", 20)
+    cache.put(key, "かんぱい！")
+    assert cache.get(key) is None
+    assert cache.stats()["fills"] == 1
+
+    cache.put(key, "乾杯しましょう！")
+    served = {cache.get(key)["message"] for _ in range(4)}
+    assert served == {"かんぱい！", "乾杯しましょう！"}
+
+
+def test_does_not_serve_the_same_variant_twice_in_a_row(clock):
+    cache = ResponseCache(variants=2, fill_rate=0)
+    key = response_cache_key("乾杯", 20)
+    cache.put(key, "a")
+    cache.put(key, "b")
+    cache.put(key, "c")  # そろっているので保存しない
+
+    messages = [cache.get(key)["message"] for _ in range(6)]
+    assert set(messages) == {"a", "b"}
+    assert all(x != y for x, y in zip(messages, messages[1:]))
+
+
+def test_variants_expire_after_ttl(clock):
+    cache = ResponseCache(ttl_seconds=60, fill_rate=0)
+    key = response_cache_key("乾杯", 20)
+    cache.put(key, "a")
+
+    clock.now += 59
+    assert cache.get(key) is not None
+    clock.now += 2
+    assert cache.get(key) is None
+    assert cache.stats()["keys"] == 0
+
+
+def test_attach_audio_fills_missing_url(clock):
+    cache = ResponseCache(fill_rate=0)
+    key = response_cache_key("乾杯", 20)
+    cache.put(key, "a")
+    cache.attach_audio(key, "a", "https://example.com/a.mp3")
+    assert cache.get(key)["audio_url"] == "https://example.com/a.mp3"
+
+
+def test_evicts_least_recently_used_key(clock):
+    cache = ResponseCache(max_keys=2, fill_rate=0)
+    keys = [response_cache_key(message, 20) for message in ("a", "b", "c")]
+    for key in keys:
+        cache.put(key, "reply")
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) is not None
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import session_aggregate
+from active_session import close_session, open_session
+from guardian_state import get_state_store
+from session_aggregate import (
+    SessionNotActive,
+    aggregate_from_drinks,
+    apply_drink,
+    get_session_stats,
+    initial_session_aggregate,
+    record_drink,
+    session_version,
+)
+
+START = datetime(2026, 1, 1, 20, 0, tzinfo=timezone.utc)
+
+
+def _drink(drink_type="beer", alcohol_g=14.0, at=START):
+    return {"drink_type": drink_type, "alcohol_g": alcohol_g, "timestamp": at}
+
+
+def test_apply_drink_updates_counters_and_version():
+    update = apply_drink(initial_session_aggregate(), _drink(), START)
+
+    assert update["drink_count"] == 1
+    assert update["total_alcohol_g"] == 14.0
+    assert update["drink_type_counts"] == {"beer": 1}
+    assert update["first_drink_at"] == START
+    assert update["window_summary"]["last_30min"] == {"drinks": 1, "alcohol_g": 14.0}
+    assert update["version"] == 1
+
+
+def test_apply_drink_drops_drinks_outside_retention():
+    session_data = {**initial_session_aggregate(), "recent_drinks": [{"t": START.timestamp(), "g": 10.0}]}
+    later = START + timedelta(minutes=90)
+
+    update = apply_drink(session_data, _drink(at=later), later)
+    assert update["recent_drinks"] == [{"t": later.timestamp(), "g": 14.0}]
+    assert update["window_summary"]["last_60min"]["drinks"] == 1
+
+
+def test_aggregate_from_drinks_matches_incremental_updates():
+    drinks = [_drink("beer", 14.0, START), _drink("wine", 12.0, START + timedelta(minutes=40))]
+    now = START + timedelta(minutes=45)
+
+    session_data = initial_session_aggregate()
+    for drink in drinks:
+        session_data.update(apply_drink(session_data, drink, drink["timestamp"]))
+    rebuilt = aggregate_from_drinks(drinks, now=now)
+
+    assert rebuilt["drink_count"] == session_data["drink_count"] == 2
+    assert rebuilt["total_alcohol_g"] == session_data["total_alcohol_g"] == 26.0
+    assert rebuilt["drink_type_counts"] == {"beer": 1, "wine": 1}
+    assert rebuilt["window_summary"]["last_30min"] == {"drinks": 1, "alcohol_g": 12.0}
+
+
+def test_session_version_falls_back_to_drink_count():
+    assert session_version({"drink_count": 3}) == 3
+    assert session_version({"drink_count": 3, "version": 7}) == 7
+
+
+def test_record_drink_updates_aggregate_in_one_transaction(user_id):
+    session_id, _ = open_session(user_id)
+
+    record_drink(user_id, session_id, _drink("beer", 14.0), START)
+    drink_id, stats = record_drink(user_id, session_id, _drink("wine", 12.0), START + timedelta(minutes=5))
+
+    assert drink_id
+    assert stats["drink_count"] == 2
+    assert stats["total_alcohol_g"] == pytest.approx(26.0)
+    assert stats["drink_type_counts"] == {"beer": 1, "wine": 1}
+    assert stats["version"] == 2
+    # 総量が20gを超えたので warning
+    assert stats["guardian_level"]["level"] == "warning"
+
+    stored = get_session_stats(user_id, session_id, now=START + timedelta(minutes=5))
+    assert stored["drink_count"] == 2
+    assert stored["version"] == 2
+
+
+def test_record_drink_rejects_ended_session(user_id):
+    session_id, _ = open_session(user_id)
+    close_session(user_id)
+
+    with pytest.raises(SessionNotActive):
+        record_drink(user_id, session_id, _drink(), START)
+    assert get_session_stats(user_id, session_id)["drink_count"] == 0
+
+
+def test_retried_transaction_does_not_keep_the_aborted_attempt(user_id, monkeypatch):
+    session_id, _ = open_session(user_id)
+    session_ref = session_aggregate._session_ref(user_id, session_id)
+    real_apply_drink = session_aggregate.apply_drink
+    attempts = []
+
+    def apply_drink_with_conflict(session_data, drink_record, now):
+        if not attempts:
+            # 1回目の試行中に別インスタンスが5gの飲酒をコミットする
+            session_ref.update(real_apply_drink(session_data, _drink("beer", 5.0, START), START))
+        attempts.append(now)
+        return real_apply_drink(session_data, drink_record, now)
+
+    monkeypatch.setattr(session_aggregate, "apply_drink", apply_drink_with_conflict)
+    _, stats = record_drink(user_id, session_id, _drink("beer", 14.0), START + timedelta(minutes=1))
+
+    assert len(attempts) == 2
+    assert stats["drink_count"] == 2
+    assert stats["total_alcohol_g"] == pytest.approx(19.0)
+    # 5g + 14g（中断した試行の14gは数えない）、30分に2杯なので caution
+    assert stats["guardian_level"]["level"] == "caution"
+    assert get_state_store().get(user_id, session_id).total_alcohol_g == pytest.approx(19.0)
@@ -0,0 +1,37 @@
+import pytest
+
+from agents import write_buffer
+from agents.write_buffer import MessageWriteBuffer
+from clients import get_firestore
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    db = get_firestore()
+    # バックグラウンドスレッドが先に書かないよう間隔を長くする
+    buf = MessageWriteBuffer(db, db.collection("a2a_messages_test"), flush_interval=60, name="test")
+    monkeypatch.setattr(write_buffer, "_open_buffers", [buf])
+    yield buf
+    buf.close()
+
+
+def test_coalesces_writes_to_the_same_document(buffer):
+    buffer.put("m1", "set", {"status": "pending"})
+    buffer.put("m1", "update", {"status": "processed"})
+
+    assert buffer.flush() == 1
+    snapshot = buffer.collection.document("m1").get()
+    assert snapshot.to_dict() == {"status": "processed"}
+    assert buffer.stats()["coalesced"] == 1
+
+
+def test_sigterm_flushes_pending_writes_and_chains_previous_handler(buffer, monkeypatch):
+    calls = []
+    monkeypatch.setattr(write_buffer, "_previous_sigterm_handler", lambda signum, frame: calls.append(signum))
+    buffer.put("m2", "set", {"status": "pending"})
+
+    write_buffer._on_sigterm(15, None)
+
+    assert buffer.collection.document("m2").get().exists
+    assert buffer.stats()["pending"] == 0
+    assert calls == [15]
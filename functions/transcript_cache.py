@@ -0,0 +1,141 @@
+"""
+Transcript Cache - 音声書き起こし結果のコンテンツアドレスキャッシュ
+キー: 音声バイト列 + プロンプト + モデル名 のSHA-256
+1層目: プロセス内LRU
+2層目: Firestore の transcript_cache コレクション（expires_at でTTL）
+ネットワーク再送で同じ音声が届いた場合に Gemini を呼ばずに結果を返す
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+# Firestore client（初回利用時に生成される共有クライアント）
+from clients import db
+
+TRANSCRIPT_CACHE_COLLECTION = "transcript_cache"
+TRANSCRIPT_CACHE_MAX_ENTRIES = int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", "256"))
+# 永続層の有効期間（Firestore の TTL ポリシーを expires_at に設定して自動削除する）
+TRANSCRIPT_CACHE_TTL_SECONDS = int(os.getenv("TRANSCRIPT_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+
+
+def transcript_cache_key(audio_bytes, prompt, model_name):
+    """音声・プロンプト・モデル名からキャッシュキーを生成"""
+    digest = hashlib.sha256()
+    digest.update(audio_bytes)
+    digest.update(b"\0")
+    digest.update(prompt.encode())
+    digest.update(b"\0")
+    digest.update(model_name.encode())
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    """書き起こし結果のLRU + Firestoreの2層キャッシュ"""
+
+    def __init__(self, max_entries=TRANSCRIPT_CACHE_MAX_ENTRIES, ttl_seconds=TRANSCRIPT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.collection = db.collection(TRANSCRIPT_CACHE_COLLECTION)
+
+        self._entries = OrderedDict()  # key -> (transcript, expires_at)
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "firestore_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "errors": 0
+        }
+
+    def _memory_put(self, key, transcript, expires_at):
+        with self._lock:
+            self._entries[key] = (transcript, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """キャッシュ済みの書き起こしを返す（なければ None）"""
+        now = datetime.now(timezone.utc)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                transcript, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return transcript
+                del self._entries[key]
+
+        try:
+            doc = self.collection.document(key).get()
+        except Exception as e:
+            # 永続層の障害時は書き起こしを通常どおり実行する
+            logging.warning(f"Transcript cache read failed: {e}")
+            with self._lock:
+                self._counters["errors"] += 1
+                self._counters["misses"] += 1
+            return None
+
+        data = doc.to_dict() if doc.exists else None
+        # TTLによる削除は即時ではないため、期限切れは読み取り時にも弾く
+        if not data or data.get("expires_at") is None or data["expires_at"] <= now:
+            with self._lock:
+                self._counters["misses"] += 1
+            return None
+
+        with self._lock:
+            self._counters["firestore_hits"] += 1
+        self._memory_put(key, data["transcript"], data["expires_at"])
+        return data["transcript"]
+
+    def put(self, key, transcript, model_name=None):
+        """書き起こし結果を両方の層に保存"""
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        self._memory_put(key, transcript, expires_at)
+
+        try:
+            self.collection.document(key).set({
+                "transcript": transcript,
+                "model": model_name,
+                "created_at": firestore.SERVER_TIMESTAMP,
+                "expires_at": expires_at
+            })
+            with self._lock:
+                self._counters["stores"] += 1
+        except Exception as e:
+            logging.warning(f"Transcript cache write failed: {e}")
+            with self._lock:
+                self._counters["errors"] += 1
+
+    def stats(self):
+        """ヒット率などのメトリクス"""
+        with self._lock:
+            hits = self._counters["memory_hits"] + self._counters["firestore_hits"]
+            lookups = hits + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
+
+
+# シングルトンインスタンス
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_transcript_cache():
+    """プロセス共有の書き起こしキャッシュを取得"""
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = TranscriptCache()
+    return _cache_instance
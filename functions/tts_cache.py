@@ -0,0 +1,335 @@
+"""
+TTS Cache - 音声合成結果の2層キャッシュ
+0層目: デプロイ時に事前合成した固定フレーズのマニフェスト（prewarm_tts.py）
+1層目: プロセス内LRU（エントリ数・バイト数で上限）
+2層目: Cloud Storage 上のMP3オブジェクト
+chat / drink / tts の各エンドポイントで同じキー体系を使い、音声クリップを共有する
+長い返答は文単位に分割して並列合成し、文ごとにキャッシュしたMP3を連結する
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from clients import get_storage_client, get_tts_client
+
+# TTS設定
+VOICE_NAME = "ja-JP-Neural2-B"  # 日本語男性の声
+LANGUAGE_CODE = "ja-JP"
+AUDIO_ENCODING_NAME = "MP3"  # texttospeech.AudioEncoding のメンバー名
+SPEAKING_RATE = 1.0
+PITCH = 0.0
+
+# キャッシュ設定
+TTS_BUCKET_NAME = os.getenv("STORAGE_BUCKET", "alco-guardian.appspot.com")
+TTS_CACHE_MAX_ENTRIES = int(os.getenv("TTS_CACHE_MAX_ENTRIES", "1024"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# GCSに存在しないと分かったキーを再確認しない期間（秒）
+TTS_NEGATIVE_TTL_SECONDS = float(os.getenv("TTS_NEGATIVE_TTL_SECONDS", "60"))
+CACHE_CONTROL = "public, max-age=86400"
+# この文字数以上の返答は文単位で分割して並列合成する
+TTS_CHUNK_MIN_CHARS = int(os.getenv("TTS_CHUNK_MIN_CHARS", "60"))
+TTS_CHUNK_WORKERS = int(os.getenv("TTS_CHUNK_WORKERS", "4"))
+# 事前合成したフレーズのマニフェスト（GCSオブジェクト名 -> 公開URL）
+TTS_MANIFEST_PATH = os.getenv(
+    "TTS_MANIFEST_PATH", os.path.join(os.path.dirname(__file__), "tts_manifest.json")
+)
+
+# 文末記号（。！？）までを1文とする。記号のない末尾もそのまま1文として扱う
+SENTENCE_PATTERN = re.compile(r"[^。！？!?\n]+[。！？!?]*")
+
+
+def audio_cache_key(text, voice_name=VOICE_NAME):
+    """テキストと音声設定からキャッシュキー（GCSオブジェクト名）を生成"""
+    content = f"{text}:{voice_name}:{SPEAKING_RATE}:{PITCH}:{AUDIO_ENCODING_NAME}"
+    hash_digest = hashlib.sha256(content.encode()).hexdigest()[:16]
+    return f"tts/{voice_name}/{hash_digest}.mp3"
+
+
+def synthesize_speech(text, voice_name=VOICE_NAME):
+    """テキストを音声に変換"""
+    # 重いライブラリなので合成が必要になるまで読み込まない
+    from google.cloud import texttospeech
+
+    synthesis_input = texttospeech.SynthesisInput(text=text)
+
+    voice = texttospeech.VoiceSelectionParams(
+        language_code=LANGUAGE_CODE,
+        name=voice_name
+    )
+
+    audio_config = texttospeech.AudioConfig(
+        audio_encoding=texttospeech.AudioEncoding[AUDIO_ENCODING_NAME],
+        speaking_rate=SPEAKING_RATE,
+        pitch=PITCH
+    )
+
+    response = get_tts_client().synthesize_speech(
+        input=synthesis_input,
+        voice=voice,
+        audio_config=audio_config
+    )
+
+    return response.audio_content
+
+
+def split_sentences(text):
+    """日本語の文末記号で文に分割する"""
+    return [m.group().strip() for m in SENTENCE_PATTERN.finditer(text) if m.group().strip()]
+
+
+class TTSCache:
+    """音声URLのLRUインデックス + GCSの2層キャッシュ"""
+
+    def __init__(self, bucket_name=TTS_BUCKET_NAME, max_entries=TTS_CACHE_MAX_ENTRIES,
+                 max_bytes=TTS_CACHE_MAX_BYTES, negative_ttl=TTS_NEGATIVE_TTL_SECONDS):
+        self.bucket_name = bucket_name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+
+        self._entries = OrderedDict()  # key -> {"url", "audio", "size"}
+        self._bytes = 0
+        self._missing = {}  # key -> GCSに存在しなかった時刻
+        self._pinned = {}  # key -> URL（マニフェスト由来、追い出さない）
+        self._lock = threading.Lock()
+        self._counters = {
+            "manifest_hits": 0,
+            "memory_hits": 0,
+            "gcs_hits": 0,
+            "misses": 0,
+            "negative_hits": 0,
+            "evictions": 0,
+            "synthesized": 0,
+            "chunked": 0
+        }
+        self._chunk_executor = None
+
+    @property
+    def bucket(self):
+        return get_storage_client().bucket(self.bucket_name)
+
+    # ---------- 0層目: マニフェスト ----------
+
+    def load_manifest(self, path=TTS_MANIFEST_PATH):
+        """
+        事前合成済みフレーズのマニフェストを読み込む（ファイルがなければ何もしない）
+
+        Returns:
+            読み込んだエントリ数
+        """
+        if not path or not os.path.exists(path):
+            return 0
+
+        try:
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Failed to load TTS manifest {path}: {e}")
+            return 0
+
+        entries = manifest.get("entries", {})
+        with self._lock:
+            self._pinned.update(entries)
+        logging.info(f"Loaded {len(entries)} pre-synthesized phrases from {path}")
+        return len(entries)
+
+    def _pinned_get(self, key):
+        with self._lock:
+            url = self._pinned.get(key)
+            if url is not None:
+                self._counters["manifest_hits"] += 1
+            return url
+
+    # ---------- 1層目: メモリ ----------
+
+    def _memory_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._counters["memory_hits"] += 1
+            return entry
+
+    def _memory_put(self, key, url, audio=None):
+        size = len(url) + (len(audio) if audio else 0)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old["size"]
+            self._entries[key] = {"url": url, "audio": audio, "size": size}
+            self._bytes += size
+            self._missing.pop(key, None)
+
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["size"]
+                self._counters["evictions"] += 1
+
+    def _known_missing(self, key):
+        with self._lock:
+            missing_at = self._missing.get(key)
+            if missing_at is None:
+                return False
+            if time.monotonic() - missing_at > self.negative_ttl:
+                del self._missing[key]
+                return False
+            self._counters["negative_hits"] += 1
+            return True
+
+    # ---------- 2層目: GCS ----------
+
+    def lookup(self, key, refresh=False):
+        """
+        キャッシュ済みの公開URLを返す（なければ None）
+
+        Args:
+            refresh: Trueならネガティブキャッシュを無視してGCSを確認する（合成待ちのポーリング用）
+        """
+        url = self._pinned_get(key)
+        if url is not None:
+            return url
+
+        entry = self._memory_get(key)
+        if entry is not None:
+            return entry["url"]
+
+        if not refresh and self._known_missing(key):
+            return None
+
+        blob = self.bucket.get_blob(key)
+        if blob is None:
+            with self._lock:
+                self._missing[key] = time.monotonic()
+                self._counters["misses"] += 1
+            return None
+
+        with self._lock:
+            self._counters["gcs_hits"] += 1
+        self._memory_put(key, blob.public_url)
+        return blob.public_url
+
+    def store(self, key, audio_content):
+        """音声をGCSにアップロードして公開URLを返す"""
+        blob = self.bucket.blob(key)
+        blob.cache_control = CACHE_CONTROL
+        blob.upload_from_string(audio_content, content_type="audio/mpeg")
+        blob.make_public()
+
+        self._memory_put(key, blob.public_url, audio_content)
+        return blob.public_url
+
+    # ---------- 文単位の分割合成 ----------
+
+    def _get_chunk_executor(self):
+        with self._lock:
+            if self._chunk_executor is None:
+                self._chunk_executor = ThreadPoolExecutor(
+                    max_workers=TTS_CHUNK_WORKERS, thread_name_prefix="tts-chunk"
+                )
+            return self._chunk_executor
+
+    def _chunk_audio(self, sentence, voice_name):
+        """1文分のMP3を取得（メモリ → GCS → 合成の順）"""
+        key = audio_cache_key(sentence, voice_name)
+
+        entry = self._memory_get(key)
+        if entry is not None and entry["audio"] is not None:
+            return entry["audio"]
+
+        if not self._known_missing(key):
+            blob = self.bucket.get_blob(key)
+            if blob is not None:
+                audio_content = blob.download_as_bytes()
+                with self._lock:
+                    self._counters["gcs_hits"] += 1
+                self._memory_put(key, blob.public_url, audio_content)
+                return audio_content
+            with self._lock:
+                self._missing[key] = time.monotonic()
+                self._counters["misses"] += 1
+
+        audio_content = synthesize_speech(sentence, voice_name)
+        with self._lock:
+            self._counters["synthesized"] += 1
+        self.store(key, audio_content)
+        return audio_content
+
+    def _synthesize_chunked(self, sentences, voice_name):
+        """文ごとに並列合成し、MP3フレームをそのまま連結する"""
+        executor = self._get_chunk_executor()
+        clips = list(executor.map(lambda sentence: self._chunk_audio(sentence, voice_name), sentences))
+        with self._lock:
+            self._counters["chunked"] += 1
+        return b"".join(clips)
+
+    # ---------- 公開API ----------
+
+    def get_or_synthesize(self, text, voice_name=VOICE_NAME):
+        """
+        キャッシュを引き、なければ合成してアップロードする
+
+        Returns:
+            {"url", "filename", "cached", "size"}（sizeは新規合成時のみ）
+        """
+        key = audio_cache_key(text, voice_name)
+        url = self.lookup(key)
+        if url:
+            logging.info(f"Using cached audio: {key}")
+            return {"url": url, "filename": key, "cached": True, "size": None}
+
+        sentences = split_sentences(text)
+        if len(text) >= TTS_CHUNK_MIN_CHARS and len(sentences) > 1:
+            audio_content = self._synthesize_chunked(sentences, voice_name)
+        else:
+            audio_content = synthesize_speech(text, voice_name)
+            with self._lock:
+                self._counters["synthesized"] += 1
+        url = self.store(key, audio_content)
+        logging.info(f"Generated new audio: {key}")
+        return {"url": url, "filename": key, "cached": False, "size": len(audio_content)}
+
+    def stats(self):
+        """ヒット/ミス/追い出しのカウンタ"""
+        with self._lock:
+            hits = (
+                self._counters["manifest_hits"]
+                + self._counters["memory_hits"]
+                + self._counters["gcs_hits"]
+            )
+            lookups = hits + self._counters["misses"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "pinned": len(self._pinned),
+                "bytes": self._bytes,
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
+
+
+# シングルトンインスタンス
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """プロセス共有のTTSキャッシュを取得"""
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                cache = TTSCache()
+                cache.load_manifest()
+                _cache_instance = cache
+    return _cache_instance
+
+
+def get_audio_url(text, voice_name=VOICE_NAME):
+    """テキストの音声URLを取得（キャッシュ対応）"""
+    return get_tts_cache().get_or_synthesize(text, voice_name)["url"]
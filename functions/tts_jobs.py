@@ -0,0 +1,194 @@
+"""
+TTS Jobs - 音声合成のバックグラウンド実行（遅延音声モード）
+chat / drink はテキストを即座に返し、音声は audioToken で後から取得する。
+トークンはTTSキャッシュのキー（GCSオブジェクト名）なので、別インスタンスでも解決できる。
+合成の失敗は「<トークン>.failed」のマーカーとしてGCSに残すので、別インスタンスのポーリングにも返せる
+
+注意: Gen1 のCloud Functionsはレスポンス返却後にCPUが絞られるため、
+このモードはGen2（CPU常時割り当て）での利用を想定している
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from tts_cache import VOICE_NAME, audio_cache_key, get_tts_cache
+
+TTS_JOB_WORKERS = int(os.getenv("TTS_JOB_WORKERS", "4"))
+# ロングポーリングの最大待機秒数
+TTS_POLL_TIMEOUT_SECONDS = float(os.getenv("TTS_POLL_TIMEOUT_SECONDS", "25"))
+TTS_POLL_INTERVAL_SECONDS = 0.5
+# 失敗したジョブを覚えておく秒数
+TTS_FAILED_TTL_SECONDS = 300
+
+# audio_cache_key の形式のみ受け付ける（任意のオブジェクトを引かせない）
+TOKEN_PATTERN = re.compile(r"^tts/[A-Za-z0-9-]+/[0-9a-f]{16}\.mp3$")
+
+_executor = None
+_jobs = {}  # token -> Future
+_failed = {}  # token -> (失敗時刻, エラーメッセージ)
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=TTS_JOB_WORKERS, thread_name_prefix="tts-job")
+    return _executor
+
+
+def _failure_marker(token):
+    return f"{token}.failed"
+
+
+def _write_failure(token, error):
+    """失敗マーカーをGCSに保存（別インスタンスのポーリング用）"""
+    try:
+        blob = get_tts_cache().bucket.blob(_failure_marker(token))
+        blob.upload_from_string(
+            json.dumps({"error": error, "failedAt": time.time()}), content_type="application/json"
+        )
+    except Exception as e:
+        logging.warning(f"Failed to persist TTS failure for {token}: {e}")
+
+
+def _read_failure(token):
+    """GCSの失敗マーカーを読む（期限切れ・なしなら None）"""
+    try:
+        blob = get_tts_cache().bucket.get_blob(_failure_marker(token))
+        if blob is None:
+            return None
+        marker = json.loads(blob.download_as_bytes())
+    except Exception as e:
+        logging.warning(f"Failed to read TTS failure marker for {token}: {e}")
+        return None
+    if time.time() - marker.get("failedAt", 0) > TTS_FAILED_TTL_SECONDS:
+        return None
+    return marker.get("error") or "Audio synthesis failed"
+
+
+def _clear_failure(token):
+    try:
+        blob = get_tts_cache().bucket.get_blob(_failure_marker(token))
+        if blob is not None:
+            blob.delete()
+    except Exception as e:
+        logging.warning(f"Failed to clear TTS failure marker for {token}: {e}")
+
+
+def _run_job(token, text, voice_name):
+    # 前回の失敗マーカーが残っていると、再合成中のポーリングが失敗を返してしまう
+    _clear_failure(token)
+    return get_tts_cache().get_or_synthesize(text, voice_name)
+
+
+def _on_done(token, future):
+    error = future.exception()
+    with _lock:
+        _jobs.pop(token, None)
+        if error is not None:
+            logging.error(f"Background TTS failed for {token}: {error}")
+            _failed[token] = (time.monotonic(), str(error))
+    if error is not None:
+        _write_failure(token, str(error))
+
+
+def _prune_failed(now):
+    expired = [t for t, (failed_at, _) in _failed.items() if now - failed_at > TTS_FAILED_TTL_SECONDS]
+    for token in expired:
+        del _failed[token]
+
+
+def is_valid_token(token):
+    """audioToken の形式チェック"""
+    return bool(token) and bool(TOKEN_PATTERN.match(token))
+
+
+def submit_speech(text, voice_name=VOICE_NAME):
+    """
+    音声合成をバックグラウンドで開始する（キャッシュ済みなら即座にURLを返す）
+
+    Returns:
+        {"audioToken", "audioStatus": "ready" | "pending", "audioUrl"（readyの場合）}
+    """
+    cache = get_tts_cache()
+    token = audio_cache_key(text, voice_name)
+
+    url = cache.lookup(token)
+    if url:
+        return {"audioToken": token, "audioStatus": "ready", "audioUrl": url}
+
+    future = None
+    with _lock:
+        _prune_failed(time.monotonic())
+        _failed.pop(token, None)
+        if token not in _jobs:
+            future = _get_executor().submit(_run_job, token, text, voice_name)
+            _jobs[token] = future
+    # 完了済みならコールバックが即時実行されるため、ロックの外で登録する
+    if future is not None:
+        future.add_done_callback(lambda f, token=token: _on_done(token, f))
+
+    return {"audioToken": token, "audioStatus": "pending"}
+
+
+def wait_for_audio(token, timeout=TTS_POLL_TIMEOUT_SECONDS):
+    """
+    audioToken の音声が揃うまで最大 timeout 秒待つ
+
+    このインスタンスで合成中ならその完了を待ち、そうでなければGCSの音声と失敗マーカーをポーリングする。
+
+    Returns:
+        {"audioToken", "audioStatus": "ready" | "pending" | "failed", "audioUrl" / "error"}
+
+    Raises:
+        ValueError: トークンの形式が不正な場合
+    """
+    if not is_valid_token(token):
+        raise ValueError("Invalid audio token")
+
+    cache = get_tts_cache()
+    timeout = max(0.0, min(timeout, TTS_POLL_TIMEOUT_SECONDS))
+    deadline = time.monotonic() + timeout
+
+    with _lock:
+        future = _jobs.get(token)
+
+    if future is not None:
+        try:
+            result = future.result(timeout)
+            return {"audioToken": token, "audioStatus": "ready", "audioUrl": result["url"]}
+        except FutureTimeoutError:
+            return {"audioToken": token, "audioStatus": "pending"}
+        except Exception as e:
+            return {"audioToken": token, "audioStatus": "failed", "error": str(e)}
+
+    while True:
+        with _lock:
+            failed = _failed.get(token)
+        if failed is not None:
+            return {"audioToken": token, "audioStatus": "failed", "error": failed[1]}
+
+        url = cache.lookup(token, refresh=True)
+        if url:
+            return {"audioToken": token, "audioStatus": "ready", "audioUrl": url}
+
+        # 別インスタンスで合成したジョブの失敗
+        error = _read_failure(token)
+        if error is not None:
+            return {"audioToken": token, "audioStatus": "failed", "error": error}
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return {"audioToken": token, "audioStatus": "pending"}
+        time.sleep(min(TTS_POLL_INTERVAL_SECONDS, remaining))
+
+
+def job_stats():
+    """実行中・失敗ジョブ数"""
+    with _lock:
+        return {"pending": len(_jobs), "failed": len(_failed)}
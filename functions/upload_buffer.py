@@ -0,0 +1,98 @@
+"""
+Upload Buffer - アップロードファイルをディスクを経由せずメモリで受け取る
+Werkzeug は既定で500KBを超えるファイルを一時ファイルに退避するため、
+フォーム解析前に Request.form_data_parser_class（公開API）を
+ファイルをサイズ上限付きの BytesIO で受けるパーサーに差し替える
+"""
+import io
+import os
+from functools import lru_cache
+
+from werkzeug.formparser import FormDataParser
+
+# transcribe が受け付ける音声ファイルの最大サイズ（バイト）
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# multipart の境界・ヘッダー分の余裕
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """アップロードが上限サイズを超えた"""
+
+    def __init__(self, max_bytes):
+        super().__init__(f"Upload exceeds {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+class LimitedBuffer(io.BytesIO):
+    """書き込み中に上限を超えた時点で UploadTooLarge を送出する BytesIO"""
+
+    def __init__(self, max_bytes):
+        super().__init__()
+        self.max_bytes = max_bytes
+
+    def write(self, data):
+        if self.tell() + len(data) > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        return super().write(data)
+
+
+class MemoryFormDataParser(FormDataParser):
+    """アップロードファイルを LimitedBuffer に書き込むフォームパーサー"""
+
+    max_bytes = MAX_UPLOAD_BYTES
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stream_factory = self._memory_stream
+
+    def _memory_stream(self, *args, **kwargs):
+        return LimitedBuffer(self.max_bytes)
+
+
+@lru_cache(maxsize=None)
+def memory_form_parser(max_bytes):
+    """上限サイズごとのパーサークラス"""
+    if max_bytes == MemoryFormDataParser.max_bytes:
+        return MemoryFormDataParser
+    return type("MemoryFormDataParser", (MemoryFormDataParser,), {"max_bytes": max_bytes})
+
+
+def use_memory_uploads(request, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    request.files を参照する前に呼び出し、ファイルをメモリ上のバッファで受ける
+
+    Raises:
+        UploadTooLarge: Content-Length の時点で上限を超えている場合
+    """
+    if request.content_length and request.content_length > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise UploadTooLarge(max_bytes)
+
+    # request.files の解析はこのリクエストだけメモリ上のパーサーで行う
+    request.form_data_parser_class = memory_form_parser(max_bytes)
+
+
+def read_upload(file_storage, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    アップロードされたファイルの中身をbytesで返す
+
+    use_memory_uploads 済みならバッファをそのまま返し、
+    そうでなければストリームを上限付きでチャンク読みする。
+
+    Raises:
+        UploadTooLarge: 上限サイズを超えた場合
+    """
+    stream = file_storage.stream
+    if isinstance(stream, io.BytesIO):
+        return stream.getvalue()
+
+    buffer = bytearray()
+    while True:
+        chunk = stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        if len(buffer) + len(chunk) > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        buffer.extend(chunk)
+    return bytes(buffer)